@@ -1,8 +1,9 @@
-from django.db import transaction
-from django.db.models import F
+from django.utils import timezone
 from rest_framework import serializers
 
 from cart.models import CartItem
+from cart.store import get_cart_store
+from core.transactions import atomic_with_retry
 from product.models import Product
 
 
@@ -46,20 +47,28 @@ class CartSerializer(serializers.ModelSerializer):
         ]
 
     def get_user_info(self, obj):
+        if obj.user_id is None:
+            return None
         return {
             "id": obj.user.id,
             "email": obj.user.email,
         }
 
     def get_product(self, obj):
-        """Return cart related products"""
+        """
+        Return cart related products
+        Active discounts attached in batch by the cart store when listing
+        """
         product = obj.product
         features = product.product_features.all()
-        discounts = product.product_discounts.all()
+        if hasattr(product, "active_product_discounts"):
+            discounts = product.active_product_discounts
+        else:
+            discounts = product.product_discounts.filter(end_date__gte=timezone.now())
 
         return {
             "id": product.id,
-            "in_stock": product.stock >= 1,
+            "in_stock": product.available >= 1,
             "title": product.title,
             "price": product.price,
             "main_image": product.main_image or None,
@@ -80,82 +89,48 @@ class CartSerializer(serializers.ModelSerializer):
             ],
         }
 
-    def validate(self, attrs):
+    @atomic_with_retry("cart_update")
+    def create(self, validated_data):
         """
-        Validate total number againts cart max limit
-        Validate total number against stock
+        Add & remove through the configured cart store
+        Limit & stock validated atomically by the store
         """
-        product = attrs.get("product_id")
-        buy_quantity = attrs.get("quantity", 1)
-        action = attrs.get("action", "add")
-        user = self.context["request"].user
-        cart_max_limit = 5  # cart limitation
-
-        cart = CartItem.objects.filter(
-            user=user,
-            product=product,
-        ).first()
-
-        cart_quantity = cart.quantity if cart else 0
-        total_quantity = cart_quantity + buy_quantity
-
-        if action == "add":
-            if total_quantity > cart_max_limit:
-                raise serializers.ValidationError(
-                    {"detail": f"You have reached the cart limit ({cart_max_limit})"}
-                )
-            elif total_quantity > product.stock:
-                raise serializers.ValidationError(
-                    {"detail": f"Quantity exceeds available stock ({product.stock})"}
-                )
-        elif action == "remove":
-            if not cart:
-                raise serializers.ValidationError({"detail": "Cart is empty"})
-
-            if buy_quantity > cart.quantity:
-                raise serializers.ValidationError(
-                    {"detail": "Cannot remove more than available"}
-                )
-        return attrs
-
-    @transaction.atomic
-    def create(self, validated_data):
         data = validated_data
-        user = self.context["request"].user
+        request = self.context["request"]
         product = data.get("product_id")
         buy_quantity = data.get("quantity", 1)
         action = data.get("action", "add")
 
-        cart_qs = CartItem.objects.filter(
-            user=user,
-            product=product,
-        ).select_for_update()
-        cart = cart_qs.first()
-
+        store = get_cart_store(request.user, request.session)
         if action == "remove":
-            if buy_quantity > cart.quantity:
-                raise serializers.ValidationError(
-                    {"detail": "Cannot remove more than available"}
-                )
+            return store.remove(product, buy_quantity)
+        return store.add(product, buy_quantity)
 
-            cart.quantity = F("quantity") - buy_quantity
-            cart.save(update_fields=["quantity"])
-            cart.refresh_from_db()
-            if cart.quantity == 0:
-                cart.delete()
-                cart = CartItem(user=user, product=product, quantity=0)
-            return cart
 
-        elif action == "add":
-            if not cart:
-                cart = CartItem.objects.create(
-                    user=user,
-                    product=product,
-                    quantity=buy_quantity,
-                )
-            else:
-                cart.quantity = F("quantity") + buy_quantity
-                cart.save(update_fields=["quantity"])
-                cart.refresh_from_db()
+class CartOperationSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField(min_value=1)
+    action = serializers.ChoiceField(
+        choices=[
+            "add",
+            "remove",
+        ],
+        default="add",
+    )
+    quantity = serializers.IntegerField(
+        min_value=1,
+        max_value=5,
+        default=1,
+        error_messages={
+            "min_value": "min value is 1",
+            "max_value": "max value is 5",
+            "invalid": "Please enter a valid integer value",
+        },
+    )
+
 
-            return cart
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(
+        many=True,
+        allow_empty=False,
+        max_length=50,
+    )
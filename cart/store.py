@@ -0,0 +1,821 @@
+import threading
+from datetime import timezone as dt_timezone
+from logging import getLogger
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from redis.exceptions import LockNotOwnedError, RedisError
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+
+from core.redis_client import get_redis_client, mark_unavailable
+from core.transactions import lock_in_order
+from product.models import FeatureValue, Product
+
+from .models import CartItem
+
+logger = getLogger(__name__)
+
+CART_MAX_LIMIT = 5  # cart limitation per product
+
+DIRTY_KEY = "cart:dirty"
+LOADED_FIELD = "_"  # marks a hash hydrated from the database
+CART_TTL = 60 * 60 * 24  # idle carts evicted from Redis once persisted
+SESSION_CART_KEY = "cart"  # guest cart in the session: product id -> quantity
+FLUSH_LOCK_TIMEOUT = 10  # seconds a flush waits for the user's running flush
+FLUSH_LOCK_TTL = 60  # flush lock freed after a worker crash
+# Store methods changing the cart, their database fallback makes the hash stale
+WRITE_METHODS = {"add", "remove", "apply", "clear", "discard", "merge"}
+
+# KEYS: cart hash, dirty set | ARGV: product id, quantity, limit, stock, user id
+ADD_SCRIPT = """
+local current = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+local total = current + tonumber(ARGV[2])
+if total > tonumber(ARGV[3]) then return {-1, current} end
+if total > tonumber(ARGV[4]) then return {-2, current} end
+redis.call('HSET', KEYS[1], ARGV[1], total)
+redis.call('PERSIST', KEYS[1])
+redis.call('SADD', KEYS[2], ARGV[5])
+return {total, current}
+"""
+
+# KEYS: cart hash, dirty set | ARGV: product id, quantity, user id
+REMOVE_SCRIPT = """
+local current = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+if current == 0 then return {-1, current} end
+local total = current - tonumber(ARGV[2])
+if total < 0 then return {-2, current} end
+if total == 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+else
+    redis.call('HSET', KEYS[1], ARGV[1], total)
+end
+redis.call('PERSIST', KEYS[1])
+redis.call('SADD', KEYS[2], ARGV[3])
+return {total, current}
+"""
+
+# KEYS: cart hash | ARGV: field/value pairs
+HYDRATE_SCRIPT = (
+    """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+redis.call('HSET', KEYS[1], unpack(ARGV))
+redis.call('EXPIRE', KEYS[1], %d)
+return 1
+"""
+    % CART_TTL
+)
+
+
+# One round-trip add: insert or increment, only while within limit and stock
+ADD_SQL = """
+INSERT INTO {cart} (user_id, product_id, quantity, created_at, updated_at)
+SELECT %(user)s, p.id, %(quantity)s, %(now)s, %(now)s
+FROM {product} AS p
+WHERE p.id = %(product)s
+  AND %(quantity)s <= {least}(%(limit)s, p.stock - p.reserved)
+ON CONFLICT (user_id, product_id) DO UPDATE
+SET quantity = {cart}.quantity + excluded.quantity,
+    updated_at = excluded.updated_at
+WHERE {cart}.quantity + excluded.quantity <= %(limit)s
+  AND {cart}.quantity + excluded.quantity <= (
+      SELECT stock - reserved FROM {product} WHERE id = excluded.product_id
+  )
+RETURNING id, quantity, created_at
+"""
+
+REMOVE_SQL = """
+UPDATE {cart}
+SET quantity = quantity - %(quantity)s, updated_at = %(now)s
+WHERE user_id = %(user)s AND product_id = %(product)s AND quantity >= %(quantity)s
+RETURNING id, quantity, created_at
+"""
+
+# Decrement and drop emptied rows in one statement
+REMOVE_SQL_POSTGRES = """
+WITH removed AS (
+    DELETE FROM {cart}
+    WHERE user_id = %(user)s AND product_id = %(product)s
+      AND quantity = %(quantity)s
+    RETURNING id, 0 AS quantity, created_at
+), decremented AS (
+    UPDATE {cart}
+    SET quantity = quantity - %(quantity)s, updated_at = %(now)s
+    WHERE user_id = %(user)s AND product_id = %(product)s
+      AND quantity > %(quantity)s
+    RETURNING id, quantity, created_at
+)
+SELECT * FROM removed UNION ALL SELECT * FROM decremented
+"""
+
+# Guest cart merged in one statement, capped by the cart limit and live stock
+MERGE_SQL = """
+INSERT INTO {cart} (user_id, product_id, quantity, created_at, updated_at)
+SELECT %(user)s, p.id, {least}(guest.column2, %(limit)s, p.stock - p.reserved),
+       %(now)s, %(now)s
+FROM (VALUES {rows}) AS guest
+JOIN {product} AS p ON p.id = guest.column1
+WHERE p.stock > p.reserved
+ON CONFLICT (user_id, product_id) DO UPDATE
+SET quantity = {least}(
+        {cart}.quantity + excluded.quantity,
+        %(limit)s,
+        (SELECT stock - reserved FROM {product} WHERE id = excluded.product_id)
+    ),
+    updated_at = excluded.updated_at
+"""
+
+LIMIT_MESSAGE = f"You have reached the cart limit ({CART_MAX_LIMIT})"
+EMPTY_MESSAGE = "Cart is empty"
+REMOVE_MESSAGE = "Cannot remove more than available"
+
+
+def stock_message(product):
+    return f"Quantity exceeds available stock ({product.available})"
+
+
+def cart_error(message):
+    return serializers.ValidationError({"detail": message})
+
+
+def check_operation(action, held, quantity, product):
+    """
+    Return the error message of an add/remove on the held quantity, None if valid
+    """
+    if action == "add":
+        if held + quantity > CART_MAX_LIMIT:
+            return LIMIT_MESSAGE
+        if held + quantity > product.available:
+            return stock_message(product)
+    else:
+        if not held:
+            return EMPTY_MESSAGE
+        if quantity > held:
+            return REMOVE_MESSAGE
+    return None
+
+
+def replay_operations(operations, current, products):
+    """
+    Apply batch operations in order on the current quantities
+    Return resulting quantities per touched product and per-operation errors
+    """
+    quantities = {}
+    errors = []
+    for index, operation in enumerate(operations):
+        product_id = operation["product_id"]
+        product = products.get(product_id)
+        if product is None:
+            errors.append(
+                {
+                    "index": index,
+                    "product_id": product_id,
+                    "detail": "Product not found",
+                }
+            )
+            continue
+
+        held = quantities.get(product_id, current.get(product_id, 0))
+        message = check_operation(
+            operation["action"], held, operation["quantity"], product
+        )
+        if message:
+            errors.append({"index": index, "product_id": product_id, "detail": message})
+            continue
+
+        sign = 1 if operation["action"] == "add" else -1
+        quantities[product_id] = held + sign * operation["quantity"]
+
+    return quantities, errors
+
+
+class CartBatchRejected(APIException):
+    """
+    Batch rejected as a whole, body listing the failed operations
+    Detail set as is, ValidationError would turn the indices into strings
+    """
+
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = "Cart batch rejected"
+    default_code = "cart_batch_rejected"
+
+    def __init__(self, errors):
+        super().__init__()
+        self.detail = {"detail": self.default_detail, "errors": errors}
+
+
+class CartFlushBusy(Exception):
+    """Another flush of the cart held its lock past FLUSH_LOCK_TIMEOUT"""
+
+
+def batch_error(errors):
+    return CartBatchRejected(errors)
+
+
+def feature_prefetch(lookup="product_features"):
+    return Prefetch(lookup, queryset=FeatureValue.objects.select_related("feature"))
+
+
+def cart_products():
+    """Products with the features the cart serializer reads"""
+    return Product.objects.prefetch_related(feature_prefetch())
+
+
+def prepare_items(user, items):
+    """
+    Attach the owner and batch-resolved discounts so serializing N items costs no extra query
+    """
+    Product.attach_discounts(item.product for item in items)
+    for item in items:
+        item.user = user
+    return items
+
+
+class DatabaseCartStore:
+    """
+    Cart stored as CartItem rows
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    def get_items(self):
+        items = (
+            CartItem.objects.filter(user=self.user)
+            .select_related("product")
+            .prefetch_related(feature_prefetch("product__product_features"))
+        )
+        return prepare_items(self.user, list(items))
+
+    def _format(self, sql, **parts):
+        return sql.format(
+            cart=CartItem._meta.db_table,
+            product=Product._meta.db_table,
+            least="LEAST" if connection.vendor == "postgresql" else "MIN",
+            **parts,
+        )
+
+    def _execute(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(self._format(sql), params)
+            return cursor.fetchone()
+
+    def _reject(self, action, product, quantity):
+        """
+        Statement matched no row: re-read quantities to report the violated rule
+        """
+        product.refresh_from_db(fields=["stock", "reserved"])
+        held = (
+            CartItem.objects.filter(user=self.user, product=product)
+            .values_list("quantity", flat=True)
+            .first()
+        )
+        message = check_operation(action, held or 0, quantity, product)
+        raise cart_error(message or stock_message(product))
+
+    def _item(self, product, row):
+        pk, quantity, created_at = row
+        created_at = CartItem._meta.get_field("created_at").to_python(created_at)
+        if created_at and timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at, dt_timezone.utc)
+        return CartItem(
+            pk=pk,
+            user=self.user,
+            product=product,
+            quantity=quantity,
+            created_at=created_at,
+        )
+
+    def add(self, product, quantity):
+        """
+        Single conditional upsert guarded by the cart limit and live stock
+        """
+        row = self._execute(
+            ADD_SQL,
+            {
+                "user": self.user.pk,
+                "product": product.pk,
+                "quantity": quantity,
+                "limit": CART_MAX_LIMIT,
+                "now": timezone.now(),
+            },
+        )
+        if row is None:
+            self._reject("add", product, quantity)
+        return self._item(product, row)
+
+    @transaction.atomic
+    def remove(self, product, quantity):
+        """
+        Single conditional decrement, row deleted in the same statement on PostgreSQL
+        """
+        params = {
+            "user": self.user.pk,
+            "product": product.pk,
+            "quantity": quantity,
+            "now": timezone.now(),
+        }
+        if connection.vendor == "postgresql":
+            row = self._execute(REMOVE_SQL_POSTGRES, params)
+        else:
+            row = self._execute(REMOVE_SQL, params)
+            if row is not None and row[1] == 0:
+                CartItem.objects.filter(pk=row[0]).delete()
+
+        if row is None:
+            self._reject("remove", product, quantity)
+        if row[1] == 0:
+            return CartItem(user=self.user, product=product, quantity=0)
+        return self._item(product, row)
+
+    @transaction.atomic
+    def apply(self, operations):
+        """
+        Apply batch operations against one locked fetch of the involved products,
+        then persist with a single upsert and a single delete
+        """
+        product_ids = sorted({op["product_id"] for op in operations})
+        products = {
+            p.id: p for p in lock_in_order(cart_products().filter(id__in=product_ids))
+        }
+        current = dict(
+            CartItem.objects.filter(
+                user=self.user, product_id__in=product_ids
+            ).values_list("product_id", "quantity")
+        )
+
+        quantities, errors = replay_operations(operations, current, products)
+        if errors:
+            raise batch_error(errors)
+
+        changed = {
+            pid: qty
+            for pid, qty in quantities.items()
+            if qty and qty != current.get(pid)
+        }
+        emptied = [pid for pid, qty in quantities.items() if not qty and pid in current]
+        if changed:
+            CartItem.objects.bulk_create(
+                [
+                    CartItem(user=self.user, product_id=pid, quantity=qty)
+                    for pid, qty in changed.items()
+                ],
+                update_conflicts=True,
+                unique_fields=["user", "product"],
+                update_fields=["quantity"],
+            )
+        if emptied:
+            CartItem.objects.filter(user=self.user, product_id__in=emptied).delete()
+
+        items = [
+            CartItem(user=self.user, product=products[pid], quantity=qty)
+            for pid, qty in quantities.items()
+        ]
+        return prepare_items(self.user, items)
+
+    def clear(self):
+        deleted, _ = CartItem.objects.filter(user=self.user).delete()
+        return bool(deleted)
+
+    def discard(self, product_ids):
+        """Drop the given products, e.g. once ordered"""
+        CartItem.objects.filter(user=self.user, product_id__in=product_ids).delete()
+
+    def flush(self):
+        """Rows are already persisted"""
+
+    def merge(self, quantities):
+        """
+        Upsert a guest cart into the user's rows with a single statement
+        Summed quantities capped by the cart limit and stock, out of stock products skipped
+        """
+        params = {
+            "user": self.user.pk,
+            "limit": CART_MAX_LIMIT,
+            "now": timezone.now(),
+        }
+        rows = []
+        for index, (product_id, quantity) in enumerate(quantities.items()):
+            params[f"product_{index}"] = int(product_id)
+            params[f"quantity_{index}"] = int(quantity)
+            rows.append(f"(%(product_{index})s, %(quantity_{index})s)")
+
+        with connection.cursor() as cursor:
+            cursor.execute(self._format(MERGE_SQL, rows=", ".join(rows)), params)
+            return cursor.rowcount
+
+
+class RedisCartStore:
+    """
+    Live cart kept as a Redis hash per user (product id -> quantity)
+        - add/remove/clear are single atomic script calls
+        - CartItem rows written behind by flush (periodic task & checkout)
+    """
+
+    def __init__(self, user, client):
+        self.user = user
+        self.client = client
+        self.key = f"cart:{user.pk}"
+
+    def _hydrate(self):
+        """Load persisted rows into Redis the first time the cart is touched"""
+        rows = CartItem.objects.filter(user=self.user).values_list(
+            "product_id", "quantity"
+        )
+        mapping = [LOADED_FIELD, 1]
+        for product_id, quantity in rows:
+            mapping += [product_id, quantity]
+        self.client.eval(HYDRATE_SCRIPT, 1, self.key, *mapping)
+
+    def _quantities(self):
+        if not self.client.exists(self.key):
+            self._hydrate()
+        return {
+            int(product_id): int(quantity)
+            for product_id, quantity in self.client.hgetall(self.key).items()
+            if product_id.decode() != LOADED_FIELD
+        }
+
+    def get_items(self):
+        quantities = self._quantities()
+        products = cart_products().filter(id__in=quantities)
+        items = [
+            CartItem(user=self.user, product=product, quantity=quantities[product.id])
+            for product in sorted(products, key=lambda p: p.id, reverse=True)
+        ]
+        return prepare_items(self.user, items)
+
+    def add(self, product, quantity):
+        if not self.client.exists(self.key):
+            self._hydrate()
+        total, _ = self.client.eval(
+            ADD_SCRIPT,
+            2,
+            self.key,
+            DIRTY_KEY,
+            product.id,
+            quantity,
+            CART_MAX_LIMIT,
+            product.available,
+            self.user.pk,
+        )
+        if total == -1:
+            raise cart_error(LIMIT_MESSAGE)
+        if total == -2:
+            raise cart_error(stock_message(product))
+        return CartItem(user=self.user, product=product, quantity=total)
+
+    def remove(self, product, quantity):
+        if not self.client.exists(self.key):
+            self._hydrate()
+        total, _ = self.client.eval(
+            REMOVE_SCRIPT,
+            2,
+            self.key,
+            DIRTY_KEY,
+            product.id,
+            quantity,
+            self.user.pk,
+        )
+        if total == -1:
+            raise cart_error(EMPTY_MESSAGE)
+        if total == -2:
+            raise cart_error(REMOVE_MESSAGE)
+        return CartItem(user=self.user, product=product, quantity=total)
+
+    def apply(self, operations):
+        """
+        Apply batch operations in one optimistic (WATCH/MULTI) transaction on the hash
+        """
+        if not self.client.exists(self.key):
+            self._hydrate()
+        products = {
+            p.id: p
+            for p in cart_products().filter(
+                id__in={op["product_id"] for op in operations}
+            )
+        }
+        outcome = {}
+
+        def write(pipe):
+            current = {
+                int(pid): int(qty)
+                for pid, qty in pipe.hgetall(self.key).items()
+                if pid.decode() != LOADED_FIELD
+            }
+            quantities, errors = replay_operations(operations, current, products)
+            outcome.update(quantities=quantities, errors=errors)
+            if errors:
+                return
+
+            pipe.multi()
+            emptied = [pid for pid, qty in quantities.items() if not qty]
+            filled = {pid: qty for pid, qty in quantities.items() if qty}
+            if emptied:
+                pipe.hdel(self.key, *emptied)
+            if filled:
+                pipe.hset(self.key, mapping=filled)
+            pipe.persist(self.key)
+            pipe.sadd(DIRTY_KEY, self.user.pk)
+
+        self.client.transaction(write, self.key)
+        if outcome["errors"]:
+            raise batch_error(outcome["errors"])
+
+        items = [
+            CartItem(user=self.user, product=products[pid], quantity=qty)
+            for pid, qty in outcome["quantities"].items()
+        ]
+        return prepare_items(self.user, items)
+
+    def clear(self):
+        had_items = bool(self._quantities())
+        pipe = self.client.pipeline()
+        pipe.delete(self.key)
+        pipe.hset(self.key, LOADED_FIELD, 1)
+        pipe.sadd(DIRTY_KEY, self.user.pk)
+        pipe.execute()
+        return had_items
+
+    def discard(self, product_ids):
+        """Rows already removed in the caller's transaction"""
+        if product_ids:
+            self.client.hdel(self.key, *product_ids)
+
+    def flush(self):
+        """
+        Persist the Redis hash into CartItem rows with one upsert and one delete
+        Serialized per user, a concurrent flush never commits an older snapshot last
+        """
+        lock = self.client.lock(
+            f"cart:flush:{self.user.pk}",
+            timeout=FLUSH_LOCK_TTL,
+            blocking_timeout=FLUSH_LOCK_TIMEOUT,
+        )
+        if not lock.acquire():
+            raise CartFlushBusy(self.user.pk)
+        try:
+            self._flush()
+        finally:
+            try:
+                lock.release()
+            except LockNotOwnedError as e:
+                logger.warning(f"Cart flush lock {lock.name} expired: {e}")
+
+    def _flush(self):
+        pipe = self.client.pipeline()
+        pipe.srem(DIRTY_KEY, self.user.pk)
+        pipe.hgetall(self.key)
+        _, snapshot = pipe.execute()
+
+        # Never hydrated: database already authoritative
+        if not snapshot:
+            return
+
+        quantities = {
+            int(product_id): int(quantity)
+            for product_id, quantity in snapshot.items()
+            if product_id.decode() != LOADED_FIELD
+        }
+        try:
+            with transaction.atomic():
+                CartItem.objects.filter(user=self.user).exclude(
+                    product_id__in=quantities
+                ).delete()
+                CartItem.objects.bulk_create(
+                    [
+                        CartItem(
+                            user=self.user,
+                            product_id=product_id,
+                            quantity=quantity,
+                        )
+                        for product_id, quantity in quantities.items()
+                    ],
+                    update_conflicts=True,
+                    unique_fields=["user", "product"],
+                    update_fields=["quantity"],
+                )
+        except Exception:
+            self.client.sadd(DIRTY_KEY, self.user.pk)
+            raise
+        self.client.expire(self.key, CART_TTL)
+
+    def merge(self, quantities):
+        """
+        Persist the live cart, merge into rows, then drop the hash to rehydrate on next access
+        """
+        self.flush()
+        merged = DatabaseCartStore(self.user).merge(quantities)
+        self.client.delete(self.key)
+        return merged
+
+
+class SessionCartStore:
+    """
+    Guest cart kept in the cache backed session (product id -> quantity)
+    Nothing written to the database until merged on login
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    def _quantities(self):
+        return {
+            int(product_id): quantity
+            for product_id, quantity in self.session.get(SESSION_CART_KEY, {}).items()
+        }
+
+    def _save(self, quantities):
+        self.session[SESSION_CART_KEY] = {
+            str(product_id): quantity
+            for product_id, quantity in quantities.items()
+            if quantity
+        }
+
+    def get_items(self):
+        quantities = self._quantities()
+        if not quantities:
+            return []
+        products = cart_products().filter(id__in=quantities)
+        items = [
+            CartItem(product=product, quantity=quantities[product.id])
+            for product in sorted(products, key=lambda p: p.id, reverse=True)
+        ]
+        return prepare_items(None, items)
+
+    def _change(self, action, product, quantity):
+        quantities = self._quantities()
+        held = quantities.get(product.id, 0)
+        message = check_operation(action, held, quantity, product)
+        if message:
+            raise cart_error(message)
+
+        total = held + quantity if action == "add" else held - quantity
+        quantities[product.id] = total
+        self._save(quantities)
+        return CartItem(product=product, quantity=total)
+
+    def add(self, product, quantity):
+        return self._change("add", product, quantity)
+
+    def remove(self, product, quantity):
+        return self._change("remove", product, quantity)
+
+    def apply(self, operations):
+        products = {
+            p.id: p
+            for p in cart_products().filter(
+                id__in={op["product_id"] for op in operations}
+            )
+        }
+        current = self._quantities()
+        quantities, errors = replay_operations(operations, current, products)
+        if errors:
+            raise batch_error(errors)
+
+        self._save({**current, **quantities})
+        items = [
+            CartItem(product=products[pid], quantity=qty)
+            for pid, qty in quantities.items()
+        ]
+        return prepare_items(None, items)
+
+    def clear(self):
+        had_items = bool(self._quantities())
+        self.session.pop(SESSION_CART_KEY, None)
+        return had_items
+
+
+# Users whose rows changed while their hash could not be dropped (per process)
+_stale_carts = set()
+_stale_lock = threading.Lock()
+
+
+def drop_stale_carts(client):
+    """
+    Delete the hashes of carts changed in the database while Redis was down,
+    so neither a read nor a flush brings their old state back
+    """
+    with _stale_lock:
+        user_ids = list(_stale_carts)
+    if not user_ids:
+        return
+    pipe = client.pipeline()
+    pipe.delete(*[f"cart:{user_id}" for user_id in user_ids])
+    pipe.srem(DIRTY_KEY, *user_ids)
+    pipe.execute()
+    with _stale_lock:
+        _stale_carts.difference_update(user_ids)
+
+
+class CartStore:
+    """
+    Cart facade choosing Redis when configured and reachable, CartItem rows otherwise
+    A change applied to the rows while Redis is down invalidates the user's hash,
+    right away or once Redis answers again
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.database = DatabaseCartStore(user)
+
+    def _call(self, method, *args):
+        redis_store = settings.CART_STORE == "redis"
+        client = get_redis_client() if redis_store else None
+        if client is not None:
+            try:
+                drop_stale_carts(client)
+                return getattr(RedisCartStore(self.user, client), method)(*args)
+            except RedisError as e:
+                mark_unavailable(e)
+        result = getattr(self.database, method)(*args)
+        if redis_store and method in WRITE_METHODS:
+            self._invalidate(client)
+        return result
+
+    def _invalidate(self, client):
+        if client is not None:
+            try:
+                pipe = client.pipeline()
+                pipe.delete(f"cart:{self.user.pk}")
+                pipe.srem(DIRTY_KEY, self.user.pk)
+                pipe.execute()
+                return
+            except RedisError:
+                pass
+        with _stale_lock:
+            _stale_carts.add(self.user.pk)
+
+    def get_items(self):
+        return self._call("get_items")
+
+    def add(self, product, quantity):
+        return self._call("add", product, quantity)
+
+    def remove(self, product, quantity):
+        return self._call("remove", product, quantity)
+
+    def apply(self, operations):
+        return self._call("apply", operations)
+
+    def clear(self):
+        return self._call("clear")
+
+    def discard(self, product_ids):
+        return self._call("discard", list(product_ids))
+
+    def flush(self):
+        return self._call("flush")
+
+    def merge(self, quantities):
+        return self._call("merge", quantities)
+
+
+def get_cart_store(user, session=None):
+    """
+    Session cart for guests, user cart store otherwise
+    """
+    if user is None or not user.is_authenticated:
+        return SessionCartStore(session)
+    return CartStore(user)
+
+
+def merge_session_cart(session, user):
+    """
+    Move the guest cart into the user's cart on login
+    """
+    quantities = SessionCartStore(session)._quantities()
+    if not quantities:
+        return 0
+    merged = get_cart_store(user).merge(quantities)
+    session.pop(SESSION_CART_KEY, None)
+    return merged
+
+
+def flush_dirty_carts(batch_size=500):
+    """
+    Write-behind: persist every cart changed in Redis since the last run
+    Failed carts stay in the dirty set for the next run
+    """
+    client = get_redis_client() if settings.CART_STORE == "redis" else None
+    if client is None:
+        return 0
+
+    User = get_user_model()
+    flushed = 0
+    try:
+        drop_stale_carts(client)
+        for user_id in client.sscan_iter(DIRTY_KEY, count=batch_size):
+            try:
+                RedisCartStore(User(pk=int(user_id)), client).flush()
+                flushed += 1
+            except RedisError:
+                raise
+            except Exception as e:
+                logger.error(f"Cart flush failed for user {int(user_id)}: {e}")
+    except RedisError as e:
+        mark_unavailable(e)
+    return flushed
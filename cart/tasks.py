@@ -0,0 +1,8 @@
+from celery import shared_task
+
+from .store import flush_dirty_carts
+
+
+@shared_task
+def flush_carts_task():
+    flush_dirty_carts()
@@ -2,8 +2,17 @@ from decimal import Decimal
 
 import pytest
 from django.db import IntegrityError
+from rest_framework.exceptions import ValidationError
 
 from cart.models import CartItem
+from cart.store import (
+    CART_MAX_LIMIT,
+    EMPTY_MESSAGE,
+    LIMIT_MESSAGE,
+    REMOVE_MESSAGE,
+    DatabaseCartStore,
+)
+from product.models import Product
 
 
 @pytest.mark.parametrize("quantity", [1, 5, 10])
@@ -46,3 +55,44 @@ def test_user_cart_setup(
             product=product,
             quantity=quantity,
         )
+
+
+def rejected(call, *args):
+    with pytest.raises(ValidationError) as error:
+        call(*args)
+    return str(error.value.detail["detail"])
+
+
+def test_database_store_add_upsert(auth_client, sample_products):
+    """ADD_SQL: insert, increment on conflict, limit and stock guards"""
+    _, user = auth_client
+    first, second = sample_products["products"][:2]
+    Product.objects.filter(pk=second.pk).update(stock=3, reserved=1)
+    second.refresh_from_db()
+    store = DatabaseCartStore(user)
+
+    assert store.add(first, 2).quantity == 2
+    assert store.add(first, CART_MAX_LIMIT - 2).quantity == CART_MAX_LIMIT
+    assert rejected(store.add, first, 1) == LIMIT_MESSAGE
+    # Insert branch guarded by the available stock (stock - reserved)
+    assert "stock" in rejected(store.add, second, 3)
+    assert store.add(second, 2).quantity == 2
+    assert "stock" in rejected(store.add, second, 1)
+
+    assert dict(
+        CartItem.objects.filter(user=user).values_list("product_id", "quantity")
+    ) == {first.id: CART_MAX_LIMIT, second.id: 2}
+
+
+def test_database_store_remove(auth_client, sample_products, cart_item_factory):
+    """REMOVE_SQL (REMOVE_SQL_POSTGRES on PostgreSQL): decrement, row dropped at zero"""
+    _, user = auth_client
+    product = sample_products["products"][0]
+    cart_item_factory(user=user, product=product, quantity=3)
+    store = DatabaseCartStore(user)
+
+    assert store.remove(product, 1).quantity == 2
+    assert rejected(store.remove, product, 3) == REMOVE_MESSAGE
+    assert store.remove(product, 2).quantity == 0
+    assert not CartItem.objects.filter(user=user).exists()
+    assert rejected(store.remove, product, 1) == EMPTY_MESSAGE
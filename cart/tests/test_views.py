@@ -1,5 +1,14 @@
+from datetime import timedelta
+from decimal import Decimal
+
 import pytest
 from django.urls import reverse
+from django.utils import timezone
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from cart.models import CartItem
+from cart.store import DIRTY_KEY, RedisCartStore, flush_dirty_carts
+from product.models import Discount, FeatureValue, Product
 
 
 def test_cart_list(auth_client):
@@ -11,14 +20,55 @@ def test_cart_list(auth_client):
     data = response.json()
 
     assert response.status_code == 200
-    assert isinstance(data, list)
+    assert isinstance(data["items"], list)
 
-    expected_keys = [
-        "user",
+    expected_keys = {
+        "user_info",
         "quantity",
         "product",
-    ]
-    assert all(expected_keys.issubset(item.keys()) for item in data)
+    }
+    assert all(expected_keys.issubset(item.keys()) for item in data["items"])
+    assert {"item_count", "total", "total_discount"}.issubset(data.keys())
+
+
+@pytest.mark.parametrize("cart_size", [1, 5])
+def test_cart_list_totals(
+    auth_client,
+    sample_products,
+    sample_feature_name,
+    cart_item_factory,
+    django_assert_num_queries,
+    cart_size,
+):
+    """Constant queries for any cart size, totals include discounts"""
+    client, user = auth_client
+    products = sample_products["products"][:cart_size]
+    end_date = timezone.now() + timedelta(days=1)
+    Discount.objects.create(
+        name="product", percent=10, end_date=end_date, product=products[0]
+    )
+    Discount.objects.create(
+        name="category", percent=20, end_date=end_date, category=products[0].category
+    )
+    for product in products:
+        FeatureValue.objects.create(
+            product=product, feature=sample_feature_name, value="red"
+        )
+        cart_item_factory(user=user, product=product, quantity=2)
+
+    with django_assert_num_queries(3):
+        data = client.get(reverse("cart-list-create")).json()
+
+    prices = Product.objects.filter(id__in=[p.id for p in products]).values_list(
+        "price", flat=True
+    )
+    full_price = sum(price * 2 for price in prices)
+    discount = full_price * Decimal("0.2")  # category discount beats product one
+    assert data["item_count"] == cart_size * 2
+    assert Decimal(str(data["total_discount"])) == discount.quantize(Decimal("0.01"))
+    assert Decimal(str(data["total"])) == (full_price - discount).quantize(
+        Decimal("0.01")
+    )
 
 
 @pytest.mark.parametrize(
@@ -87,3 +137,264 @@ def test_clear_cart_items(
 
     response = client.delete(url)
     assert response.status_code == expected_status
+
+
+def test_cart_store_redis_unavailable(
+    settings,
+    monkeypatch,
+    auth_client,
+    sample_products,
+):
+    """Redis cart store falls back to CartItem rows"""
+    settings.CART_STORE = "redis"
+    monkeypatch.setattr("cart.store.get_redis_client", lambda: None)
+    client, user = auth_client
+    product = sample_products["products"][0]
+
+    response = client.post(
+        reverse("cart-list-create"),
+        {
+            "product_id": product.id,
+            "quantity": 2,
+        },
+    )
+
+    assert response.status_code == 201
+    assert CartItem.objects.get(user=user, product=product).quantity == 2
+    assert flush_dirty_carts() == 0
+
+
+def test_redis_cart_add_remove(
+    redis_cart_store, auth_client, sample_products, cart_item_factory
+):
+    client, user = auth_client
+    first, second = sample_products["products"][:2]
+    Product.objects.filter(pk=second.pk).update(stock=3, reserved=0)
+    cart_item_factory(user=user, product=first, quantity=2)
+    url = reverse("cart-list-create")
+
+    # Hydrated from the row, then changed by the Lua scripts only
+    added = client.post(url, {"product_id": first.id, "quantity": 3})
+    over_limit = client.post(url, {"product_id": first.id, "quantity": 1})
+    over_stock = client.post(url, {"product_id": second.id, "quantity": 4})
+    removed = client.post(
+        url, {"product_id": first.id, "quantity": 5, "action": "remove"}
+    )
+    client.post(url, {"product_id": second.id, "quantity": 3})
+
+    assert added.status_code == 201 and added.data["quantity"] == 5
+    assert over_limit.status_code == 400 and "limit" in over_limit.data["detail"]
+    assert over_stock.status_code == 400 and "stock" in over_stock.data["detail"]
+    assert removed.status_code == 201 and removed.data["quantity"] == 0
+    assert [i["product"]["id"] for i in client.get(url).json()["items"]] == [second.id]
+    assert CartItem.objects.get(user=user).quantity == 2
+    assert redis_cart_store.sismember(DIRTY_KEY, user.pk)
+
+    assert flush_dirty_carts() == 1
+
+    assert dict(
+        CartItem.objects.filter(user=user).values_list("product_id", "quantity")
+    ) == {second.id: 3}
+    assert not redis_cart_store.sismember(DIRTY_KEY, user.pk)
+    assert redis_cart_store.ttl(f"cart:{user.pk}") > 0
+
+
+def test_redis_cart_flush_serialized(
+    redis_cart_store, auth_client, sample_products, monkeypatch
+):
+    monkeypatch.setattr("cart.store.FLUSH_LOCK_TIMEOUT", 0.1)
+    client, user = auth_client
+    product = sample_products["products"][0]
+    Product.objects.filter(pk=product.pk).update(stock=5, reserved=0)
+    client.post(reverse("cart-list-create"), {"product_id": product.id, "quantity": 2})
+    running = redis_cart_store.lock(f"cart:flush:{user.pk}", timeout=60)
+    running.acquire()
+
+    # Behind the running flush: nothing written, the cart stays dirty
+    assert flush_dirty_carts() == 0
+    assert redis_cart_store.sismember(DIRTY_KEY, user.pk)
+    assert not CartItem.objects.filter(user=user).exists()
+
+    running.release()
+    assert flush_dirty_carts() == 1
+    assert CartItem.objects.get(user=user, product=product).quantity == 2
+
+
+def test_redis_cart_clear_flushed(redis_cart_store, auth_client, sample_cart_item):
+    client, user = auth_client
+
+    assert client.delete(reverse("cart-clear")).status_code == 204
+    assert CartItem.objects.filter(user=user).exists()
+    flush_dirty_carts()
+
+    assert not CartItem.objects.filter(user=user).exists()
+    assert client.get(reverse("cart-list-create")).json()["items"] == []
+
+
+def test_redis_cart_batch(
+    redis_cart_store, auth_client, sample_products, cart_item_factory
+):
+    client, user = auth_client
+    first, second, third = sample_products["products"][:3]
+    cart_item_factory(user=user, product=first, quantity=2)
+    cart_item_factory(user=user, product=third, quantity=1)
+    operations = [
+        {"product_id": first.id, "quantity": 3},
+        {"product_id": second.id, "quantity": 2},
+        {"product_id": third.id, "action": "remove"},
+    ]
+
+    applied = client.post(
+        reverse("cart-batch"), {"operations": operations}, format="json"
+    )
+    rejected = client.post(
+        reverse("cart-batch"),
+        {"operations": [{"product_id": first.id, "quantity": 1}]},
+        format="json",
+    )
+    flush_dirty_carts()
+
+    assert applied.status_code == 200
+    assert rejected.status_code == 400
+    assert dict(
+        CartItem.objects.filter(user=user).values_list("product_id", "quantity")
+    ) == {first.id: 5, second.id: 2}
+
+
+def test_redis_failure_drops_stale_hash(
+    redis_cart_store, monkeypatch, auth_client, sample_products, cart_item_factory
+):
+    """A change written to rows while Redis fails is not undone by the old hash"""
+    client, user = auth_client
+    first, second = sample_products["products"][:2]
+    cart_item_factory(user=user, product=first, quantity=1)
+    url = reverse("cart-list-create")
+    client.post(url, {"product_id": first.id, "quantity": 1})
+
+    def fail(*args):
+        raise RedisConnectionError("down")
+
+    monkeypatch.setattr(RedisCartStore, "add", fail)
+    response = client.post(url, {"product_id": second.id, "quantity": 2})
+
+    assert response.status_code == 201
+    assert not redis_cart_store.exists(f"cart:{user.pk}")
+    assert not redis_cart_store.sismember(DIRTY_KEY, user.pk)
+    assert dict(
+        CartItem.objects.filter(user=user).values_list("product_id", "quantity")
+    ) == {first.id: 1, second.id: 2}
+
+
+def test_redis_down_stale_hash_dropped_on_recovery(
+    redis_cart_store, monkeypatch, auth_client, sample_products, cart_item_factory
+):
+    client, user = auth_client
+    first, second = sample_products["products"][:2]
+    cart_item_factory(user=user, product=first, quantity=1)
+    url = reverse("cart-list-create")
+    client.post(url, {"product_id": first.id, "quantity": 1})
+
+    with monkeypatch.context() as down:
+        down.setattr("cart.store.get_redis_client", lambda: None)
+        client.post(url, {"product_id": second.id, "quantity": 2})
+
+    # Redis back: the stale hash ({first: 2}, unflushed) is dropped, not flushed
+    flush_dirty_carts()
+
+    assert dict(
+        CartItem.objects.filter(user=user).values_list("product_id", "quantity")
+    ) == {first.id: 1, second.id: 2}
+    items = client.get(url).json()["items"]
+    assert {i["product"]["id"]: i["quantity"] for i in items} == {
+        first.id: 1,
+        second.id: 2,
+    }
+
+
+def test_cart_batch(auth_client, sample_products, cart_item_factory):
+    client, user = auth_client
+    first, second, third = sample_products["products"][:3]
+    cart_item_factory(user=user, product=first, quantity=2)
+    cart_item_factory(user=user, product=third, quantity=1)
+
+    response = client.post(
+        reverse("cart-batch"),
+        {
+            "operations": [
+                {"product_id": first.id, "quantity": 3},
+                {"product_id": second.id, "quantity": 2},
+                {"product_id": third.id, "action": "remove"},
+            ]
+        },
+        format="json",
+    )
+
+    assert response.status_code == 200
+    assert {item["product"]["id"]: item["quantity"] for item in response.data} == {
+        first.id: 5,
+        second.id: 2,
+        third.id: 0,
+    }
+    assert dict(
+        CartItem.objects.filter(user=user).values_list("product_id", "quantity")
+    ) == {first.id: 5, second.id: 2}
+
+
+def test_cart_batch_rejected(auth_client, sample_products, cart_item_factory):
+    client, user = auth_client
+    first, second = sample_products["products"][:2]
+    cart_item_factory(user=user, product=first, quantity=4)
+
+    response = client.post(
+        reverse("cart-batch"),
+        {
+            "operations": [
+                {"product_id": second.id, "quantity": 1},
+                {"product_id": first.id, "quantity": 2},
+                {"product_id": 999_999, "action": "remove"},
+            ]
+        },
+        format="json",
+    )
+
+    assert response.status_code == 400
+    assert [error["index"] for error in response.json()["errors"]] == [1, 2]
+    assert not CartItem.objects.filter(user=user, product=second).exists()
+
+
+def test_guest_cart_merged_on_login(
+    locmem_cache, sample_active_user, sample_products, cart_item_factory
+):
+    from rest_framework.test import APIClient
+
+    from fixtures.auth_fixtures import RAW_PASSWORD
+
+    client = APIClient()
+    first, second, third = sample_products["products"][:3]
+    cart_item_factory(user=sample_active_user, product=first, quantity=4)
+
+    for product, quantity in ((first, 3), (second, 2), (third, 1)):
+        response = client.post(
+            reverse("cart-list-create"),
+            {"product_id": product.id, "quantity": quantity},
+        )
+        assert response.status_code == 201
+        assert response.data["user_info"] is None
+
+    response = client.get(reverse("cart-list-create"))
+    assert response.data["item_count"] == 6
+    assert not CartItem.objects.filter(product=second).exists()
+
+    Product.objects.filter(pk=third.pk).update(stock=0)
+    response = client.post(
+        "/auth/jwt/create/",
+        {"email": sample_active_user.email, "password": RAW_PASSWORD},
+    )
+
+    assert response.status_code == 200
+    assert dict(
+        CartItem.objects.filter(user=sample_active_user).values_list(
+            "product_id", "quantity"
+        )
+    ) == {first.id: 5, second.id: 2}
+    assert client.get(reverse("cart-list-create")).data["items"] == []
@@ -8,6 +8,11 @@ urlpatterns = [
         views.CartListCreateAPIView.as_view(),
         name="cart-list-create",
     ),
+    path(
+        "batch/",
+        views.CartBatchAPIView.as_view(),
+        name="cart-batch",
+    ),
     path(
         "cart/clear/",
         views.ClearCartAPIView.as_view(),
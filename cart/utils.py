@@ -1,31 +1,47 @@
+from decimal import Decimal
+
+from core.transactions import atomic_with_retry, lock_in_order
+
 from .models import CartItem
 
+CENT = Decimal("0.01")
 
+
+@atomic_with_retry("get_cart_items")
 def get_cart_items(user):
     """
-    - Fetch user related carts & products and lock the rows for update
-    - Return valid carts and out-of-stock items
+    - Fetch user related carts & products and lock the cart rows in product order
+    - Stock checked by the set-based deduction at order creation
     """
 
-    user_cart = (
-        CartItem.objects.filter(user=user).select_related("product").select_for_update()
+    user_cart = lock_in_order(
+        CartItem.objects.filter(user=user).select_related("product"),
+        "product_id",
+        of=("self",),
     )
 
-    if not user_cart.exists():
+    if not user_cart:
         return [], ["No cart found"]
 
-    cart_items, out_of_stock = [], []
-
-    for cart in user_cart:
-        product = cart.product
-        stock = product.stock
-        cart_quantity = cart.quantity
+    return (user_cart, [])
 
-        # out-of-stock items skipped
-        if cart_quantity > stock:
-            out_of_stock.append(product.title)
-            continue
 
-        cart_items.append(cart)
-
-    return (cart_items, out_of_stock)
+def cart_totals(items):
+    """
+    Cart level totals computed in a single pass
+        - item_count: number of units
+        - total: payable amount after discounts
+        - total_discount: amount saved by discounts
+    """
+    item_count, total, full_price = 0, Decimal("0"), Decimal("0")
+
+    for item in items:
+        item_count += item.quantity
+        total += item.subtotal
+        full_price += Decimal(item.product.price) * item.quantity
+
+    return {
+        "item_count": item_count,
+        "total": total.quantize(CENT),
+        "total_discount": (full_price - total).quantize(CENT),
+    }
@@ -1,40 +1,65 @@
-from django.db import transaction
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
-from rest_framework import generics, status
+from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import CartItem
-from .serializers import CartSerializer
+from .serializers import CartBatchSerializer, CartSerializer
+from .store import get_cart_store
+from .utils import cart_totals
 
 
 class CartListCreateAPIView(generics.ListCreateAPIView):
     """
     List & Create user cart items using the given product ID
+    Guests get a session cart merged into their account on login
     """
 
     serializer_class = CartSerializer
+    permission_classes = [permissions.AllowAny]
 
     def get_queryset(self):
         """
-        Return user specific cart associated with related products sorted by latest ones
+        Return user specific cart associated with related products from the cart store
         """
-        return (
-            CartItem.objects.filter(user=self.request.user)
-            .select_related("product")
-            .prefetch_related("product__product_features__feature")
-        )
+        return get_cart_store(self.request.user, self.request.session).get_items()
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def list(self, request, *args, **kwargs):
+        """
+        Cart items plus cart level totals, constant number of queries for any cart size
+        """
+        items = self.get_queryset()
+        serializer = self.get_serializer(items, many=True)
+        return Response(
+            {
+                **cart_totals(items),
+                "items": serializer.data,
+            },
+            status=status.HTTP_200_OK,
+        )
+
     @swagger_auto_schema(
         operation_summary="Fetch cart items",
-        operation_description="Return list of user cart items",
+        operation_description="Return user cart items with item count, total and total discount",
         responses={
-            401: openapi.Response(description="Unauthorized"),
-            200: CartSerializer(many=True),
+            200: openapi.Response(
+                description="Cart items and totals",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        "item_count": openapi.Schema(type=openapi.TYPE_INTEGER),
+                        "total": openapi.Schema(type=openapi.TYPE_NUMBER),
+                        "total_discount": openapi.Schema(type=openapi.TYPE_NUMBER),
+                        "items": openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_OBJECT),
+                        ),
+                    },
+                ),
+            ),
         },
         tags=["Cart"],
     )
@@ -62,7 +87,6 @@ class CartListCreateAPIView(generics.ListCreateAPIView):
         responses={
             201: CartSerializer(),
             400: openapi.Response(description="Validation error"),
-            401: openapi.Response(description="Unauthorized"),
         },
         tags=["Cart"],
     )
@@ -70,23 +94,57 @@ class CartListCreateAPIView(generics.ListCreateAPIView):
         return super().post(request, *args, **kwargs)
 
 
+class CartBatchAPIView(APIView):
+    """
+    Apply several add & remove operations in one request
+        - Validated against one locked fetch of the involved products
+        - All operations applied together or none of them
+    """
+
+    serializer_class = CartBatchSerializer
+    permission_classes = [permissions.AllowAny]
+
+    @swagger_auto_schema(
+        operation_summary="Batch cart update",
+        operation_description="Add & remove several products in a single transaction",
+        request_body=CartBatchSerializer(),
+        responses={
+            200: CartSerializer(many=True),
+            400: openapi.Response(description="Validation error per operation"),
+        },
+        tags=["Cart"],
+    )
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        items = get_cart_store(request.user, request.session).apply(
+            serializer.validated_data["operations"]
+        )
+        return Response(
+            CartSerializer(items, many=True, context={"request": request}).data,
+            status=status.HTTP_200_OK,
+        )
+
+
 class ClearCartAPIView(APIView):
     """
     Clear user cart items
     """
 
+    permission_classes = [permissions.AllowAny]
+
     @swagger_auto_schema(
         operation_summary="Clear user cart",
         operation_description="Remove cart items",
         responses={
             204: openapi.Response(description="Cart dropped successfully"),
             200: openapi.Response(description="Cart already empty"),
-            401: openapi.Response(description="Unauthorized"),
         },
         tags=["Cart"],
     )
     def delete(self, request, *args, **kwargs):
-        deleted, _ = CartItem.objects.filter(user=request.user).delete()
+        deleted = get_cart_store(request.user, request.session).clear()
 
         if deleted:
             return Response(
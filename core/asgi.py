@@ -9,8 +9,11 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+os.environ.setdefault("ASGI_MODE", "1")
 
-application = get_asgi_application()
+# Static files (admin & swagger assets) served without WhiteNoise, see ASGI_MODE
+application = ASGIStaticFilesHandler(get_asgi_application())
@@ -0,0 +1,56 @@
+from django.utils import timezone
+from redis.exceptions import RedisError
+
+from core.redis_client import get_redis_client, mark_unavailable
+
+# KEYS: deadline zset | ARGV: now, limit -> due members removed atomically
+POP_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #due > 0 then redis.call('ZREM', KEYS[1], unpack(due)) end
+return due
+"""
+
+
+class DeadlineQueue:
+    """
+    Redis sorted set of object ids scored by their deadline
+        - schedule: O(log n) insert when the object is created
+        - pop_due: due ids removed atomically, so concurrent pollers never share one
+    Nothing is scheduled while Redis is unavailable, the periodic sweep covers it
+    """
+
+    def __init__(self, name):
+        self.key = f"deadlines:{name}"
+
+    def schedule(self, object_id, deadline):
+        client = get_redis_client()
+        if client is None:
+            return
+        try:
+            client.zadd(self.key, {object_id: deadline.timestamp()})
+        except RedisError as e:
+            mark_unavailable(e)
+
+    def pop_due(self, limit=500):
+        client = get_redis_client()
+        if client is None:
+            return []
+        try:
+            due = client.eval(
+                POP_DUE_SCRIPT, 1, self.key, timezone.now().timestamp(), limit
+            )
+        except RedisError as e:
+            mark_unavailable(e)
+            return []
+        return [int(object_id) for object_id in due]
+
+    def retry(self, object_ids):
+        """Put ids back as due now, e.g. after a failed run"""
+        client = get_redis_client()
+        if client is None or not object_ids:
+            return
+        now = timezone.now().timestamp()
+        try:
+            client.zadd(self.key, {object_id: now for object_id in object_ids})
+        except RedisError as e:
+            mark_unavailable(e)
@@ -0,0 +1,33 @@
+import time
+from logging import getLogger
+
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+logger = getLogger(__name__)
+
+# Seconds to skip Redis after a failure before trying again
+RETRY_COOLDOWN = 5
+
+_unavailable_until = 0.0
+
+
+def get_redis_client(alias="default"):
+    """
+    Return the raw Redis client behind the cache, or None while Redis is marked unavailable
+    Callers fall back to their DB/in-memory path on None and report failures with mark_unavailable
+    """
+    if time.monotonic() < _unavailable_until:
+        return None
+    try:
+        return get_redis_connection(alias)
+    except (RedisError, NotImplementedError) as e:
+        mark_unavailable(e)
+        return None
+
+
+def mark_unavailable(error=None):
+    """Skip Redis for RETRY_COOLDOWN seconds"""
+    global _unavailable_until
+    _unavailable_until = time.monotonic() + RETRY_COOLDOWN
+    logger.warning(f"Redis unavailable, using fallback: {error}")
@@ -74,6 +74,9 @@ INSTALLED_APPS = [
     "cart",
     "orders",
     "payments",
+    "idempotency",
+    "reports",
+    "monitoring",
 ]
 
 # admin-interface
@@ -148,6 +151,9 @@ else:
 
 
 MIDDLEWARE = [
+    # request latency & query count metrics
+    "monitoring.middleware.MetricsMiddleware",
+    "monitoring.middleware.QueryOriginMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -162,6 +168,12 @@ MIDDLEWARE = [
     "whitenoise.middleware.WhiteNoiseMiddleware",
 ]
 
+# Served by uvicorn through core/asgi.py: WhiteNoise is sync only and would run
+# every request, async payment views included, through a single thread
+ASGI_MODE = os.getenv("ASGI_MODE") == "1"
+if ASGI_MODE:
+    MIDDLEWARE.remove("whitenoise.middleware.WhiteNoiseMiddleware")
+
 ROOT_URLCONF = "core.urls"
 
 LOGIN_URL = "/auth/jwt/create/"
@@ -258,22 +270,69 @@ EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")
 CELERY_BROKER_URL = "redis://localhost:6379/0"
 CELERY_RESULT_BACKEND = "redis://localhost:6379/1"
 
+CELERY_TASK_ROUTES = {
+    "orders.tasks.process_checkout_task": {"queue": "checkout"},
+}
+
 CELERY_BEAT_SCHEDULE = {
-    "expire-pending-orders-every-5-minutes": {
+    # Deadlines registered at creation, polled from Redis sorted sets
+    "expire-due-orders-every-5-seconds": {
+        "task": "orders.tasks.expire_due_orders_task",
+        "schedule": timedelta(seconds=5),
+    },
+    "expire-due-payments-every-5-seconds": {
+        "task": "payments.tasks.expire_due_payments_task",
+        "schedule": timedelta(seconds=5),
+    },
+    # Safety net sweeps for deadlines missed while Redis was unavailable
+    "sweep-pending-orders-every-15-minutes": {
         "task": "orders.tasks.expired_orders_task",
-        "schedule": crontab(minute="*/1"),
+        "schedule": crontab(minute="*/15"),
     },
-    "expire-pending-payments-every-5-minutes": {
+    "sweep-pending-payments-every-15-minutes": {
         "task": "payments.tasks.expired_payments_task",
+        "schedule": crontab(minute="*/15"),
+    },
+    # Stale pending payments verified with the gateway before they expire
+    "reconcile-pending-payments-every-5-minutes": {
+        "task": "payments.tasks.reconcile_payments_task",
+        "schedule": crontab(minute="*/5"),
+    },
+    "expire-stale-payment-initiations-every-minute": {
+        "task": "payments.tasks.expire_stale_initiations_task",
+        "schedule": crontab(minute="*/1"),
+    },
+    "release-stale-payment-verifications-every-minute": {
+        "task": "payments.tasks.release_stale_verifications_task",
+        "schedule": crontab(minute="*/1"),
+    },
+    "requeue-stale-checkout-jobs-every-minute": {
+        "task": "orders.tasks.requeue_checkout_jobs_task",
         "schedule": crontab(minute="*/1"),
     },
+    "reconcile-flash-sale-stock-every-minute": {
+        "task": "orders.tasks.reconcile_flash_sale_task",
+        "schedule": crontab(minute="*/1"),
+    },
+    "purge-idempotency-records-hourly": {
+        "task": "idempotency.tasks.purge_idempotency_records_task",
+        "schedule": crontab(minute=0),
+    },
+    "flush-redis-carts-every-minute": {
+        "task": "cart.tasks.flush_carts_task",
+        "schedule": crontab(minute="*/1"),
+    },
+    "decay-product-leaderboards-hourly": {
+        "task": "product.tasks.decay_leaderboards_task",
+        "schedule": crontab(minute=30),
+    },
 }
 
 
 # Redis caching
 CACHES = {
     "default": {
-        "BACKEND": "django_redis.cache.RedisCache",
+        "BACKEND": "monitoring.cache.InstrumentedRedisCache",
         "LOCATION": os.getenv(
             "REDIS_URL",
             "redis://127.0.0.1:6379/1",
@@ -285,8 +344,27 @@ CACHES = {
 }
 
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
+
+# Checkout handling: "sync" (in request) or "async" (queued for Celery workers)
+CHECKOUT_MODE = os.getenv("CHECKOUT_MODE", "sync")
+
+# Idempotency-Key support: stored responses lifetime, claim lifetime and
+# how long duplicates wait on the first request (seconds)
+IDEMPOTENCY_TTL = 60 * 60 * 24
+IDEMPOTENCY_LOCK_TTL = 60
+IDEMPOTENCY_WAIT_TIMEOUT = 10
+
+# Live cart storage: "redis" (write-behind to CartItem) or "db"
+CART_STORE = os.getenv("CART_STORE", "redis")
 SESSION_CACHE_ALIAS = "default"
 
+# Prometheus scrape token (open endpoint when unset)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Slow query capture
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", 200))
+SLOW_QUERY_BUFFER_SIZE = int(os.getenv("SLOW_QUERY_BUFFER_SIZE", 500))
+
 ZIBAL_MERCHANT_ID = os.getenv("ZIBAL_MERCHANT_ID", "zibal")
 ZIBAL_SANDBOX = True
 
@@ -0,0 +1,77 @@
+import random
+import time
+from functools import wraps
+from logging import getLogger
+
+from django.db import OperationalError, connection, transaction
+
+from monitoring.metrics import TRANSACTION_RETRIES
+
+logger = getLogger(__name__)
+
+# PostgreSQL serialization_failure & deadlock_detected
+RETRYABLE_SQLSTATES = {"40001", "40P01"}
+
+MAX_ATTEMPTS = 4
+BASE_DELAY = 0.05  # seconds, doubled per attempt
+MAX_DELAY = 1.0
+
+
+def is_retryable(error):
+    """True for serialization failures and deadlocks reported by the driver"""
+    cause = error.__cause__
+    sqlstate = getattr(cause, "sqlstate", None) or getattr(cause, "pgcode", None)
+    return sqlstate in RETRYABLE_SQLSTATES
+
+
+def backoff(attempt):
+    """Full jitter exponential backoff"""
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2**attempt))
+
+
+def atomic_with_retry(operation, attempts=MAX_ATTEMPTS):
+    """
+    Run the function in a transaction, retried with jittered backoff on deadlocks
+    and serialization failures
+        - Retries only from the outermost transaction, nested calls run as a savepoint
+        - Retries & exhausted retries counted per operation
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if connection.in_atomic_block:
+                with transaction.atomic():
+                    return func(*args, **kwargs)
+
+            for attempt in range(1, attempts + 1):
+                try:
+                    with transaction.atomic():
+                        return func(*args, **kwargs)
+                except OperationalError as e:
+                    if not is_retryable(e):
+                        raise
+                    if attempt == attempts:
+                        TRANSACTION_RETRIES.labels(
+                            operation=operation, outcome="exhausted"
+                        ).inc()
+                        raise
+                    TRANSACTION_RETRIES.labels(
+                        operation=operation, outcome="retried"
+                    ).inc()
+                    logger.warning(f"{operation} retry {attempt}/{attempts}: {e}")
+                    time.sleep(backoff(attempt))
+
+        return wrapper
+
+    return decorator
+
+
+def lock_in_order(queryset, *fields, **lock_options):
+    """
+    Lock rows in a deterministic order (primary key by default),
+    so overlapping transactions always queue instead of deadlocking
+    """
+    return list(
+        queryset.order_by(*(fields or ["pk"])).select_for_update(**lock_options)
+    )
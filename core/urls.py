@@ -9,6 +9,7 @@ from drf_yasg.views import get_schema_view
 from rest_framework_simplejwt.views import TokenBlacklistView
 
 from core.swagger import CustomSchemaGenerator
+from monitoring.views import slow_queries_admin_view
 
 load_dotenv()
 
@@ -34,6 +35,11 @@ schema_view = get_schema_view(
 
 urlpatterns = (
     [
+        path(
+            "admin/slow-queries/",
+            admin.site.admin_view(slow_queries_admin_view),
+            name="slow-queries",
+        ),
         path("admin/", admin.site.urls),
         # Redirection
         path("", RedirectView.as_view(url="swagger/"), name="redirection"),
@@ -51,6 +57,8 @@ urlpatterns = (
         path("api/v1/carts/", include("cart.urls")),
         path("api/v1/checkout/", include("orders.urls")),
         path("api/v1/payments/", include("payments.urls")),
+        # Prometheus metrics
+        path("metrics/", include("monitoring.urls")),
         # Djoser endpoints
         re_path(r"^auth/", include("djoser.urls")),
         re_path(r"^auth/", include("djoser.urls.jwt")),
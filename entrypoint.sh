@@ -33,6 +33,12 @@ while True:
 END
 
 
+# Fresh per-process metric files on every start
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+    rm -f "$PROMETHEUS_MULTIPROC_DIR"/*.db
+fi
+
 python manage.py migrate --noinput
 
 python manage.py collectstatic --noinput
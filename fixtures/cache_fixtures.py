@@ -0,0 +1,55 @@
+import fakeredis
+import pytest
+
+from core.redis_client import get_redis_client
+from product import leaderboards
+
+
+@pytest.fixture
+def locmem_cache(settings):
+    """Swap Redis backed cache & sessions for local memory"""
+    settings.CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    }
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """In-process Redis (fakeredis with Lua) behind get_redis_client, empty per test"""
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(
+        "core.redis_client.get_redis_connection", lambda alias="default": client
+    )
+    monkeypatch.setattr("core.redis_client._unavailable_until", 0.0)
+    return client
+
+
+@pytest.fixture
+def redis_cart_store(settings, monkeypatch, fake_redis):
+    """Live carts in fakeredis, CartItem rows written behind by flush"""
+    settings.CART_STORE = "redis"
+    monkeypatch.setattr("cart.store._stale_carts", set())
+    return fake_redis
+
+
+@pytest.fixture(autouse=True)
+def database_cart_store(settings):
+    """Keep cart state in CartItem rows so tests never share Redis carts"""
+    settings.CART_STORE = "db"
+
+
+@pytest.fixture
+def redis_leaderboards(monkeypatch, fake_redis):
+    """Leaderboards in fakeredis instead of the in-memory fallback"""
+    monkeypatch.setattr("product.leaderboards.get_redis_client", get_redis_client)
+    return fake_redis
+
+
+@pytest.fixture(autouse=True)
+def memory_leaderboards(monkeypatch):
+    """Rank products in the in-memory fallback, emptied for every test"""
+    monkeypatch.setattr("product.leaderboards.get_redis_client", lambda: None)
+    leaderboards.memory_leaderboards.clear()
+    return leaderboards.memory_leaderboards
@@ -0,0 +1,56 @@
+from contextlib import contextmanager
+
+import pytest
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+
+def full_scans(plan, table):
+    """Plan lines reading the whole table instead of going through an index"""
+    if connection.vendor == "postgresql":
+        return [line for line in plan if f"Seq Scan on {table} " in f"{line} "]
+    # SQLite: "SCAN <table>" without "USING ... INDEX" is a full table scan
+    return [
+        line
+        for line in plan
+        if f" SCAN {table} " in f" {line} " and "USING" not in line
+    ]
+
+
+def explain(sql):
+    """Plan lines of an executed statement"""
+    prefix = "EXPLAIN" if connection.vendor == "postgresql" else "EXPLAIN QUERY PLAN"
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        cursor.execute(f"{prefix} {sql}")
+        return [" ".join(str(column) for column in row) for row in cursor.fetchall()]
+
+
+@pytest.fixture
+def assert_uses_index(db):
+    """
+    EXPLAIN the statements reading a table inside the block, the real queries of a
+    view or task, and fail when a plan falls back to a full table scan
+    PostgreSQL disables sequential scans for the check, test tables being too
+    small for the planner to prefer an index otherwise
+    """
+    if connection.vendor not in ("postgresql", "sqlite"):
+        pytest.skip(f"No EXPLAIN check for {connection.vendor}")
+
+    @contextmanager
+    def check(table):
+        with CaptureQueriesContext(connection) as captured:
+            yield
+        selects = [
+            query["sql"]
+            for query in captured.captured_queries
+            if query["sql"].startswith(("SELECT", "UPDATE", "DELETE"))
+            and f'"{table}"' in query["sql"]
+        ]
+        assert selects, f"No query on {table}"
+        for sql in selects:
+            plan = explain(sql)
+            assert not full_scans(plan, table), "\n".join([sql, *plan])
+
+    return check
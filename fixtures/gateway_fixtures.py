@@ -0,0 +1,78 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from payments.gateway import CircuitBreaker, ZibalClient
+
+
+class StubGateway:
+    """
+    Local HTTP server standing in for Zibal
+    Answers with queued (status, body) replies, {"result": 100} once drained,
+    after `delay` seconds
+    Tracks the most requests in flight at once
+    """
+
+    def __init__(self):
+        self.replies = []
+        self.requests = []
+        self.delay = 0
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def reply(self, body, status=200, times=1):
+        self.replies.extend([(status, body)] * times)
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                stub.requests.append((self.path, json.loads(self.rfile.read(length))))
+                status, body = stub.replies.pop(0) if stub.replies else (200, None)
+                with stub.lock:
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                time.sleep(stub.delay)
+                with stub.lock:
+                    stub.in_flight -= 1
+                payload = json.dumps(body or {"result": 100}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def gateway_stub(monkeypatch):
+    """Serve the stub on a free local port and point the payment client at it"""
+    stub = StubGateway()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), stub.handler())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    stub.client = ZibalClient(
+        request_url=f"{base_url}/request",
+        verify_url=f"{base_url}/verify",
+        merchant="zibal",
+        callback_url="http://testserver/api/v1/payments/callback/",
+        breaker=CircuitBreaker(threshold=3, reset_timeout=60),
+    )
+    monkeypatch.setattr("payments.gateway._client", stub.client)
+    yield stub
+
+    stub.client.session.close()
+    server.shutdown()
+    server.server_close()
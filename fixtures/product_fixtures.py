@@ -74,7 +74,9 @@ def sample_features(
 
 
 @pytest.fixture
-def sample_images(db, sample_products):
+def sample_images(db, sample_products, settings, tmp_path):
+    # Uploads land in a per-test directory, not the project media folder
+    settings.MEDIA_ROOT = tmp_path
     product = sample_products["products"][0]
 
     image_file = SimpleUploadedFile(
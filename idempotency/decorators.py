@@ -0,0 +1,162 @@
+import asyncio
+import hashlib
+import json
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+from .store import IdempotencyStore
+
+HEADER = "Idempotency-Key"
+REPLAY_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 200
+POLL_INTERVAL = 0.1  # seconds between checks while a duplicate waits
+
+
+def fingerprint(request):
+    """Hash of method, path and body identifying the request behind a key"""
+    payload = json.dumps(
+        [request.method, request.path, request.data],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _invalid_key(raw_key):
+    if len(raw_key) > MAX_KEY_LENGTH:
+        return Response(
+            {
+                "detail": f"{HEADER} longer than {MAX_KEY_LENGTH} characters",
+            },
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+
+def _settle_claim(entry, request_fingerprint, deadline):
+    """
+    Response for a key claimed by an earlier request,
+    None while a duplicate should keep waiting
+    """
+    if entry["fingerprint"] != request_fingerprint:
+        return Response(
+            {
+                "detail": f"{HEADER} used with a different request",
+            },
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    if entry["status"] is not None:
+        return Response(
+            entry["body"],
+            status=entry["status"],
+            headers={REPLAY_HEADER: "true"},
+        )
+    if time.monotonic() >= deadline:
+        return Response(
+            {
+                "detail": "Request with this key still in progress",
+            },
+            status=status.HTTP_409_CONFLICT,
+        )
+
+
+def _store_response(store, key, request_fingerprint, response):
+    if response.status_code >= 500:
+        store.release(key)
+    else:
+        store.complete(key, request_fingerprint, response.status_code, response.data)
+
+
+def idempotent(scope):
+    """
+    Honour the Idempotency-Key header on an APIView method (sync or async)
+        - First request runs, its response (below 500) is stored
+        - Replays get the stored response without running the view again
+        - Concurrent duplicates wait for the first request to finish
+        - Reusing a key with another payload is rejected
+    Apply outside any transaction decorator so claims are visible to duplicates
+    """
+
+    def decorator(view_method):
+        if iscoroutinefunction(view_method):
+            return _async_wrapper(scope, view_method)
+
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            raw_key = request.headers.get(HEADER)
+            if not raw_key:
+                return view_method(self, request, *args, **kwargs)
+            if invalid := _invalid_key(raw_key):
+                return invalid
+
+            key = f"{scope}:{request.user.pk}:{raw_key}"
+            request_fingerprint = fingerprint(request)
+            store = IdempotencyStore()
+            deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+
+            while True:
+                entry = store.claim(key, request_fingerprint)
+                if entry is None:
+                    break
+                if settled := _settle_claim(entry, request_fingerprint, deadline):
+                    return settled
+                time.sleep(POLL_INTERVAL)
+
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except APIException as exc:
+                # Client errors are part of the stored outcome
+                response = self.handle_exception(exc)
+            except Exception:
+                store.release(key)
+                raise
+
+            _store_response(store, key, request_fingerprint, response)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _async_wrapper(scope, view_method):
+    """idempotent() for coroutine handlers, store calls run via sync_to_async"""
+
+    @wraps(view_method)
+    async def wrapper(self, request, *args, **kwargs):
+        raw_key = request.headers.get(HEADER)
+        if not raw_key:
+            return await view_method(self, request, *args, **kwargs)
+        if invalid := _invalid_key(raw_key):
+            return invalid
+
+        key = f"{scope}:{request.user.pk}:{raw_key}"
+        request_fingerprint = fingerprint(request)
+        store = await sync_to_async(IdempotencyStore)()
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+
+        while True:
+            entry = await sync_to_async(store.claim)(key, request_fingerprint)
+            if entry is None:
+                break
+            if settled := _settle_claim(entry, request_fingerprint, deadline):
+                return settled
+            await asyncio.sleep(POLL_INTERVAL)
+
+        try:
+            response = await view_method(self, request, *args, **kwargs)
+        except APIException as exc:
+            response = self.handle_exception(exc)
+        except Exception:
+            await sync_to_async(store.release)(key)
+            raise
+
+        await sync_to_async(_store_response)(store, key, request_fingerprint, response)
+        return response
+
+    return wrapper
@@ -0,0 +1,44 @@
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+from rest_framework.utils.encoders import JSONEncoder
+
+from users.models import BaseModel
+
+
+class IdempotencyRecord(BaseModel):
+    """
+    Database fallback of the Redis idempotency store
+    A record without status code is still being processed
+    """
+
+    key = models.CharField(
+        verbose_name=_("Key"),
+        max_length=255,
+        unique=True,
+    )
+    fingerprint = models.CharField(
+        verbose_name=_("Request fingerprint"),
+        max_length=64,
+    )
+    status_code = models.PositiveSmallIntegerField(
+        verbose_name=_("Status code"),
+        null=True,
+        blank=True,
+    )
+    response = models.JSONField(
+        verbose_name=_("Response"),
+        encoder=JSONEncoder,
+        null=True,
+        blank=True,
+    )
+    expires_at = models.DateTimeField(
+        verbose_name=_("Expires at"),
+        db_index=True,
+    )
+
+    class Meta:
+        verbose_name = _("Idempotency record")
+        verbose_name_plural = _("Idempotency records")
+
+    def __str__(self):
+        return self.key
@@ -0,0 +1,120 @@
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from redis.exceptions import RedisError
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.redis_client import get_redis_client, mark_unavailable
+
+from .models import IdempotencyRecord
+
+
+class RedisIdempotencyStore:
+    """
+    One JSON value per key: claimed with SET NX, overwritten with the response
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def _key(self, key):
+        return f"idempotency:{key}"
+
+    def claim(self, key, fingerprint):
+        """Return None when claimed, the existing entry otherwise"""
+        pipe = self.client.pipeline()
+        pipe.set(
+            self._key(key),
+            json.dumps({"fingerprint": fingerprint, "status": None}),
+            nx=True,
+            ex=settings.IDEMPOTENCY_LOCK_TTL,
+        )
+        pipe.get(self._key(key))
+        claimed, current = pipe.execute()
+        if claimed or current is None:
+            return None
+        return json.loads(current)
+
+    def complete(self, key, fingerprint, status_code, body):
+        entry = {"fingerprint": fingerprint, "status": status_code, "body": body}
+        self.client.set(
+            self._key(key),
+            json.dumps(entry, cls=JSONEncoder),
+            ex=settings.IDEMPOTENCY_TTL,
+        )
+
+    def release(self, key):
+        self.client.delete(self._key(key))
+
+
+class DatabaseIdempotencyStore:
+    """
+    IdempotencyRecord rows, the unique key serializes concurrent claims
+    """
+
+    def claim(self, key, fingerprint):
+        now = timezone.now()
+        IdempotencyRecord.objects.filter(key=key, expires_at__lt=now).delete()
+        try:
+            with transaction.atomic():
+                IdempotencyRecord.objects.create(
+                    key=key,
+                    fingerprint=fingerprint,
+                    expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_TTL),
+                )
+            return None
+        except IntegrityError:
+            record = IdempotencyRecord.objects.filter(key=key).first()
+            if record is None:
+                return None
+            return {
+                "fingerprint": record.fingerprint,
+                "status": record.status_code,
+                "body": record.response,
+            }
+
+    def complete(self, key, fingerprint, status_code, body):
+        IdempotencyRecord.objects.filter(key=key).update(
+            status_code=status_code,
+            response=json.loads(json.dumps(body, cls=JSONEncoder)),
+            expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_TTL),
+        )
+
+    def release(self, key):
+        IdempotencyRecord.objects.filter(key=key).delete()
+
+
+class IdempotencyStore:
+    """
+    Redis store when reachable, database otherwise
+    Pinned per request so claim and completion hit the same backend
+    """
+
+    def __init__(self):
+        client = get_redis_client()
+        self.backend = (
+            RedisIdempotencyStore(client)
+            if client is not None
+            else DatabaseIdempotencyStore()
+        )
+
+    def _call(self, method, *args):
+        if isinstance(self.backend, RedisIdempotencyStore):
+            try:
+                return getattr(self.backend, method)(*args)
+            except RedisError as e:
+                mark_unavailable(e)
+                self.backend = DatabaseIdempotencyStore()
+        return getattr(self.backend, method)(*args)
+
+    def claim(self, key, fingerprint):
+        return self._call("claim", key, fingerprint)
+
+    def complete(self, key, fingerprint, status_code, body):
+        return self._call("complete", key, fingerprint, status_code, body)
+
+    def release(self, key):
+        return self._call("release", key)
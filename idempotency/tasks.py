@@ -0,0 +1,9 @@
+from celery import shared_task
+from django.utils import timezone
+
+from .models import IdempotencyRecord
+
+
+@shared_task
+def purge_idempotency_records_task():
+    IdempotencyRecord.objects.filter(expires_at__lt=timezone.now()).delete()
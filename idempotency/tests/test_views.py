@@ -0,0 +1,70 @@
+import pytest
+from django.urls import reverse
+
+from idempotency.models import IdempotencyRecord
+from orders.models import Order
+from payments.models import Payment
+
+
+@pytest.fixture(autouse=True)
+def database_store(monkeypatch):
+    """Exercise the database fallback"""
+    monkeypatch.setattr("idempotency.store.get_redis_client", lambda: None)
+
+
+def test_checkout_replayed(auth_client, sample_products, cart_item_factory):
+    client, user = auth_client
+    product = sample_products["products"][0]
+    cart_item_factory(user=user, product=product, quantity=2)
+
+    responses = [
+        client.post(
+            reverse("checkout"),
+            {"address": "random-address"},
+            HTTP_IDEMPOTENCY_KEY="checkout-1",
+        )
+        for _ in range(2)
+    ]
+
+    assert [r.status_code for r in responses] == [201, 201]
+    assert responses[1].json() == responses[0].json()
+    assert responses[1]["Idempotent-Replayed"] == "true"
+    assert Order.objects.filter(user=user).count() == 1
+    product.refresh_from_db()
+    assert product.reserved == 2
+    assert IdempotencyRecord.objects.get().status_code == 201
+
+
+def test_key_reused_with_other_payload(auth_client):
+    client, _ = auth_client
+
+    first = client.post(
+        reverse("checkout"), {"address": "first"}, HTTP_IDEMPOTENCY_KEY="key"
+    )
+    second = client.post(
+        reverse("checkout"), {"address": "second"}, HTTP_IDEMPOTENCY_KEY="key"
+    )
+
+    assert first.status_code == 400
+    assert second.status_code == 422
+
+
+def test_payment_request_replayed(gateway_stub, auth_client, sample_order):
+    client, _ = auth_client
+    gateway_stub.reply(
+        {
+            "result": 100,
+            "trackId": "FAKE_TRACK_ID",
+            "message": "Success",
+        }
+    )
+
+    responses = [
+        client.post(reverse("create-payment"), HTTP_IDEMPOTENCY_KEY="pay-1")
+        for _ in range(2)
+    ]
+
+    assert [r.status_code for r in responses] == [200, 200]
+    assert responses[1].data["trackId"] == "FAKE_TRACK_ID"
+    assert len(gateway_stub.requests) == 1
+    assert Payment.objects.filter(order=sample_order).count() == 1
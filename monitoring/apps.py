@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+
+
+class MonitoringConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "monitoring"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        # Celery signal handlers
+        from . import signals  # noqa: F401
+        from .slow_queries import install_wrapper
+
+        connection_created.connect(install_wrapper)
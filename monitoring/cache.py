@@ -0,0 +1,24 @@
+from django_redis.cache import CONNECTION_INTERRUPTED, RedisCache
+
+from .metrics import CACHE_LOOKUPS
+
+_MISSING = object()
+
+
+class InstrumentedRedisCache(RedisCache):
+    """
+    django-redis backend counting hits and misses on every lookup
+    """
+
+    def get(self, key, default=None, version=None, client=None):
+        value = self._get(key, _MISSING, version, client)
+        if value is CONNECTION_INTERRUPTED:
+            CACHE_LOOKUPS.labels(result="error").inc()
+            return default
+
+        if value is _MISSING:
+            CACHE_LOOKUPS.labels(result="miss").inc()
+            return default
+
+        CACHE_LOOKUPS.labels(result="hit").inc()
+        return value
@@ -0,0 +1,148 @@
+import os
+import time
+from contextlib import contextmanager
+from glob import glob
+
+from django.db.models import Sum
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector
+
+# HTTP
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "API request latency by URL name, method and status",
+    ["view", "method", "status"],
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Number of DB queries issued per request",
+    ["view"],
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 89, float("inf")),
+)
+
+# Celery
+TASK_DURATION = Histogram(
+    "celery_task_duration_seconds",
+    "Celery task run time",
+    ["task"],
+)
+TASK_FAILURES = Counter(
+    "celery_task_failures_total",
+    "Celery task failures",
+    ["task"],
+)
+
+# Cache
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total",
+    "Cache lookups split by hit and miss",
+    ["result"],
+)
+
+# Database
+TRANSACTION_RETRIES = Counter(
+    "db_transaction_retries_total",
+    "Transactions retried after a deadlock or serialization failure",
+    ["operation", "outcome"],
+)
+
+# Payment gateway
+GATEWAY_LATENCY = Histogram(
+    "payment_gateway_duration_seconds",
+    "Payment gateway round-trip latency",
+    ["operation", "outcome"],
+)
+RECONCILED_PAYMENTS = Counter(
+    "payment_reconciliations_total",
+    "Stale pending payments verified by reconciliation, by outcome",
+    ["outcome"],
+)
+RECONCILE_BATCH_DURATION = Histogram(
+    "payment_reconciliation_batch_seconds",
+    "Time to verify and settle one reconciliation batch",
+)
+
+
+@contextmanager
+def track_gateway_call(operation):
+    """
+    Observe the gateway round-trip latency labeled by the call outcome
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        GATEWAY_LATENCY.labels(operation=operation, outcome=outcome).observe(
+            time.perf_counter() - start
+        )
+
+
+class BusinessMetricsCollector:
+    """
+    Business gauges computed from the database at scrape time
+        - pending orders
+        - stock held by active reservations
+    """
+
+    def collect(self):
+        from orders.models import Order, StockReservation
+
+        pending = Order.objects.filter(status=Order.Status.PENDING).count()
+        reserved = (
+            StockReservation.objects.filter(
+                status=StockReservation.Status.ACTIVE
+            ).aggregate(total=Sum("quantity"))["total"]
+            or 0
+        )
+
+        yield GaugeMetricFamily(
+            "orders_pending",
+            "Orders waiting for payment",
+            value=pending,
+        )
+        yield GaugeMetricFamily(
+            "stock_reserved_units",
+            "Product units held by active stock reservations",
+            value=reserved,
+        )
+
+
+class SharedDirCollector(MultiProcessCollector):
+    """
+    Multi-process collector reading every process file below the given root.
+    Web and worker containers write into their own sub-directory, so pids never collide
+    """
+
+    def collect(self):
+        files = glob(os.path.join(self._path, "**", "*.db"), recursive=True)
+        return self.merge(files, accumulate=True)
+
+
+def render_metrics():
+    """
+    Return metrics exposition in Prometheus text format
+        - Multi-process mode when PROMETHEUS_MULTIPROC_ROOT/PROMETHEUS_MULTIPROC_DIR is set
+        - Process local registry otherwise
+    """
+    shared_root = os.getenv("PROMETHEUS_MULTIPROC_ROOT") or os.getenv(
+        "PROMETHEUS_MULTIPROC_DIR"
+    )
+    if shared_root:
+        registry = CollectorRegistry()
+        SharedDirCollector(registry, path=shared_root)
+    else:
+        registry = REGISTRY
+
+    business = CollectorRegistry()
+    business.register(BusinessMetricsCollector())
+
+    return generate_latest(registry) + generate_latest(business)
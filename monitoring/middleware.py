@@ -0,0 +1,92 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .metrics import REQUEST_LATENCY, REQUEST_QUERIES
+from .slow_queries import query_origin, request_queries
+
+
+class MetricsMiddleware:
+    """
+    Record request latency and DB query count labeled by URL name
+    Queries are counted through a context variable, so statements run by
+    async views in sync_to_async threads are counted as well
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        counter = [0]
+        token = request_queries.set(counter)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            request_queries.reset(token)
+        self.observe(request, response, time.perf_counter() - start, counter[0])
+        return response
+
+    async def __acall__(self, request):
+        counter = [0]
+        token = request_queries.set(counter)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_queries.reset(token)
+        self.observe(request, response, time.perf_counter() - start, counter[0])
+        return response
+
+    def observe(self, request, response, duration, query_count):
+        match = getattr(request, "resolver_match", None)
+        view = (match.url_name if match else None) or "unresolved"
+
+        REQUEST_LATENCY.labels(
+            view=view,
+            method=request.method,
+            status=response.status_code,
+        ).observe(duration)
+        REQUEST_QUERIES.labels(view=view).observe(query_count)
+
+
+class QueryOriginMiddleware:
+    """
+    Tag queries issued while serving a view with its URL name for slow query capture
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        token = query_origin.set(f"view:{request.path}")
+        try:
+            return self.get_response(request)
+        finally:
+            query_origin.reset(token)
+
+    async def __acall__(self, request):
+        token = query_origin.set(f"view:{request.path}")
+        try:
+            return await self.get_response(request)
+        finally:
+            query_origin.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        query_origin.set(f"view:{request.resolver_match.view_name}")
@@ -0,0 +1,27 @@
+import time
+
+from celery.signals import task_failure, task_postrun, task_prerun
+
+from .metrics import TASK_DURATION, TASK_FAILURES
+from .slow_queries import query_origin
+
+_task_started = {}
+
+
+@task_prerun.connect
+def task_started(task_id=None, task=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+    query_origin.set(f"task:{task.name}")
+
+
+@task_postrun.connect
+def task_finished(task_id=None, task=None, **kwargs):
+    query_origin.set("unknown")
+    start = _task_started.pop(task_id, None)
+    if start is not None:
+        TASK_DURATION.labels(task=task.name).observe(time.perf_counter() - start)
+
+
+@task_failure.connect
+def task_failed(sender=None, **kwargs):
+    TASK_FAILURES.labels(task=sender.name).inc()
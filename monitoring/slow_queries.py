@@ -0,0 +1,210 @@
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from logging import getLogger
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from redis.exceptions import RedisError
+
+from core.redis_client import get_redis_client, mark_unavailable
+
+logger = getLogger(__name__)
+
+BUFFER_KEY = "slow_queries:buffer"
+PLANS_KEY = "slow_queries:plans"
+
+# View or task currently issuing queries
+query_origin = ContextVar("query_origin", default="unknown")
+# Statement counter of the request being served, set by MetricsMiddleware
+request_queries = ContextVar("request_queries", default=None)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%s|\$\d+")
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACE = re.compile(r"\s+")
+
+# In-process fallback while Redis is unavailable
+_local_buffer = deque(maxlen=settings.SLOW_QUERY_BUFFER_SIZE)
+_local_plans = {}
+_explaining = threading.local()
+_explain_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="explain")
+
+
+def normalize(sql):
+    """
+    Replace literals and placeholders with `?` and collapse value lists,
+    so statements differing only by parameters share one fingerprint
+    """
+    sql = _STRING.sub("?", sql)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _VALUE_LIST.sub("(...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+def fingerprint(normalized_sql):
+    return hashlib.md5(normalized_sql.encode()).hexdigest()[:16]
+
+
+def record(sql, params, duration_ms, vendor):
+    """
+    Push a slow statement onto the ring buffer and schedule an EXPLAIN for unseen fingerprints
+    """
+    normalized = normalize(sql)
+    entry = {
+        "fingerprint": fingerprint(normalized),
+        "sql": normalized,
+        "duration_ms": round(duration_ms, 2),
+        "origin": query_origin.get(),
+        "at": timezone.now().isoformat(),
+    }
+
+    is_new = _store(entry)
+    if is_new and vendor == "postgresql":
+        _explain_pool.submit(_capture_plan, entry["fingerprint"], sql, params)
+
+
+def _store(entry):
+    """Return True when the fingerprint has no plan slot yet"""
+    client = get_redis_client()
+    if client is not None:
+        try:
+            pipe = client.pipeline()
+            pipe.lpush(BUFFER_KEY, json.dumps(entry))
+            pipe.ltrim(BUFFER_KEY, 0, settings.SLOW_QUERY_BUFFER_SIZE - 1)
+            pipe.hsetnx(PLANS_KEY, entry["fingerprint"], "")
+            return bool(pipe.execute()[-1])
+        except RedisError as e:
+            mark_unavailable(e)
+
+    _local_buffer.appendleft(entry)
+    if entry["fingerprint"] in _local_plans:
+        return False
+    _local_plans[entry["fingerprint"]] = ""
+    return True
+
+
+def _capture_plan(fp, sql, params):
+    """
+    EXPLAIN (ANALYZE off) the statement on a dedicated thread connection
+    """
+    _explaining.active = True
+    try:
+        with connections["default"].cursor() as cursor:
+            cursor.execute(f"EXPLAIN (ANALYZE off) {sql}", params)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+    except Exception as e:
+        logger.warning(f"EXPLAIN failed for {fp}: {e}")
+        return
+    finally:
+        _explaining.active = False
+        connections["default"].close()
+
+    client = get_redis_client()
+    if client is not None:
+        try:
+            client.hset(PLANS_KEY, fp, plan)
+            return
+        except RedisError as e:
+            mark_unavailable(e)
+    _local_plans[fp] = plan
+
+
+class SlowQueryWrapper:
+    """
+    Connection execute wrapper timing every statement against SLOW_QUERY_THRESHOLD_MS
+    """
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(_explaining, "active", False):
+            return execute(sql, params, many, context)
+
+        counter = request_queries.get()
+        if counter is not None:
+            counter[0] += 1
+
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            threshold = settings.SLOW_QUERY_THRESHOLD_MS
+            if threshold is not None and duration_ms >= threshold:
+                try:
+                    record(
+                        sql,
+                        None if many else params,
+                        duration_ms,
+                        context["connection"].vendor,
+                    )
+                except Exception as e:
+                    logger.warning(f"Slow query capture failed: {e}")
+
+
+def install_wrapper(sender, connection, **kwargs):
+    """connection_created receiver attaching the wrapper once per connection"""
+    if not any(isinstance(w, SlowQueryWrapper) for w in connection.execute_wrappers):
+        connection.execute_wrappers.append(SlowQueryWrapper())
+
+
+def get_entries():
+    client = get_redis_client()
+    if client is not None:
+        try:
+            entries = client.lrange(BUFFER_KEY, 0, -1)
+            plans = client.hgetall(PLANS_KEY)
+            return (
+                [json.loads(e) for e in entries],
+                {k.decode(): v.decode() for k, v in plans.items()},
+            )
+        except RedisError as e:
+            mark_unavailable(e)
+    return list(_local_buffer), dict(_local_plans)
+
+
+def clear():
+    client = get_redis_client()
+    if client is not None:
+        try:
+            client.delete(BUFFER_KEY, PLANS_KEY)
+        except RedisError as e:
+            mark_unavailable(e)
+    _local_buffer.clear()
+    _local_plans.clear()
+
+
+def summarize():
+    """
+    Group buffered statements per fingerprint sorted by p95 descending
+    """
+    entries, plans = get_entries()
+    grouped = defaultdict(list)
+    for entry in entries:
+        grouped[entry["fingerprint"]].append(entry)
+
+    summary = []
+    for fp, items in grouped.items():
+        durations = sorted(item["duration_ms"] for item in items)
+        p95 = durations[max(math.ceil(len(durations) * 0.95) - 1, 0)]
+        summary.append(
+            {
+                "fingerprint": fp,
+                "sql": items[0]["sql"],
+                "count": len(items),
+                "p95_ms": p95,
+                "max_ms": durations[-1],
+                "origins": sorted({item["origin"] for item in items}),
+                "last_seen": max(item["at"] for item in items),
+                "plan": plans.get(fp) or None,
+            }
+        )
+    return sorted(summary, key=lambda row: row["p95_ms"], reverse=True)
@@ -0,0 +1,68 @@
+from django.urls import reverse
+from django.utils import timezone
+
+from monitoring import slow_queries
+from orders.models import StockReservation
+
+
+def test_metrics_exposition(auth_client, sample_order_item, settings):
+    settings.METRICS_TOKEN = None
+    client, _ = auth_client
+    StockReservation.objects.create(
+        order=sample_order_item.order,
+        product=sample_order_item.product,
+        quantity=sample_order_item.quantity,
+        expires_at=timezone.now(),
+    )
+    client.get(reverse("invoice-list"))
+
+    response = client.get(reverse("metrics"))
+    body = response.content.decode()
+
+    assert response.status_code == 200
+    assert (
+        'http_request_duration_seconds_count{method="GET",status="200",view="invoice-list"}'
+        in body
+    )
+    assert 'http_request_db_queries_count{view="invoice-list"}' in body
+    assert "orders_pending 1.0" in body
+    assert f"stock_reserved_units {float(sample_order_item.quantity)}" in body
+
+
+def test_metrics_token_required(client, settings, db):
+    settings.METRICS_TOKEN = "secret"
+    url = reverse("metrics")
+
+    assert client.get(url).status_code == 403
+    response = client.get(url, HTTP_AUTHORIZATION="Bearer secret")
+    assert response.status_code == 200
+
+
+def test_slow_query_fingerprint():
+    first = slow_queries.normalize(
+        "SELECT * FROM product WHERE id IN (1, 2, 3) AND title = 'a'"
+    )
+    second = slow_queries.normalize(
+        "SELECT *  FROM product WHERE id IN (7) AND title = 'other'"
+    )
+
+    assert first == "SELECT * FROM product WHERE id IN (...) AND title = ?"
+    assert slow_queries.fingerprint(first) == slow_queries.fingerprint(second)
+
+
+def test_slow_queries_admin_page(locmem_cache, admin_client, auth_client, settings):
+    settings.SLOW_QUERY_THRESHOLD_MS = 0
+    slow_queries.clear()
+    client, _ = auth_client
+    client.get(reverse("invoice-list"))
+
+    response = admin_client.get(reverse("slow-queries"))
+    rows = response.context["rows"]
+
+    assert response.status_code == 200
+    assert any("view:invoice-list" in row["origins"] for row in rows)
+    assert all(row["count"] >= 1 and row["p95_ms"] >= 0 for row in rows)
+
+    settings.SLOW_QUERY_THRESHOLD_MS = None
+    admin_client.post(reverse("slow-queries"))
+    assert slow_queries.get_entries() == ([], {})
@@ -0,0 +1,11 @@
+from django.urls import path
+
+from . import views
+
+urlpatterns = [
+    path(
+        "",
+        views.metrics_view,
+        name="metrics",
+    ),
+]
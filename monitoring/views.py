@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.contrib import admin
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from prometheus_client import CONTENT_TYPE_LATEST
+from rest_framework import status
+
+from . import slow_queries
+from .metrics import render_metrics
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint protected by an optional bearer token
+    """
+    token = getattr(settings, "METRICS_TOKEN", None)
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return JsonResponse(
+            {
+                "detail": "Invalid metrics token",
+            },
+            status=status.HTTP_403_FORBIDDEN,
+        )
+
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE_LATEST)
+
+
+def slow_queries_admin_view(request):
+    """
+    Admin page listing slow statements grouped by fingerprint
+    """
+    if request.method == "POST":
+        slow_queries.clear()
+        return redirect("slow-queries")
+
+    context = {
+        **admin.site.each_context(request),
+        "title": "Slow queries",
+        "rows": slow_queries.summarize(),
+        "threshold_ms": settings.SLOW_QUERY_THRESHOLD_MS,
+        "buffer_size": settings.SLOW_QUERY_BUFFER_SIZE,
+    }
+    return TemplateResponse(request, "admin/monitoring/slow_queries.html", context)
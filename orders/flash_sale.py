@@ -0,0 +1,221 @@
+import hashlib
+import time
+from datetime import datetime
+from datetime import timezone as dt_timezone
+from logging import getLogger
+
+from redis.exceptions import RedisError
+
+from core.redis_client import get_redis_client, mark_unavailable
+from product.models import Product
+
+from .models import StockReservation
+from .reservations import update_stock
+
+logger = getLogger(__name__)
+
+STOCK_KEY = "flash:stock"  # product id -> units left to admit
+SOLD_KEY = "flash:sold"  # product id -> admitted units not yet deducted from stock
+
+# One per checkout attempt: product id -> admitted units, plus "at" timestamp
+ADMISSION_KEY = "flash:admission:{}"
+# Admissions neither confirmed nor cancelled by then are settled by reconcile
+ADMISSION_TIMEOUT = 300  # seconds
+
+SELL = ("stock = stock - {quantity}", None)
+
+# KEYS: stock hash, sold hash, admission | ARGV: now, (product id, quantity,
+# database available)...
+# Counters missing from the hash are loaded from the database available value
+# An existing admission is returned as is: a retried checkout admits once
+ADMIT_SCRIPT = """
+local admitted = {}
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    for _, field in ipairs(redis.call('HKEYS', KEYS[3])) do
+        if field ~= 'at' then table.insert(admitted, field) end
+    end
+    return admitted
+end
+for i = 2, #ARGV, 3 do
+    local product, quantity = ARGV[i], tonumber(ARGV[i + 1])
+    redis.call('HSETNX', KEYS[1], product, ARGV[i + 2])
+    if tonumber(redis.call('HGET', KEYS[1], product)) >= quantity then
+        redis.call('HINCRBY', KEYS[1], product, -quantity)
+        redis.call('HINCRBY', KEYS[2], product, quantity)
+        redis.call('HSET', KEYS[3], product, quantity)
+        table.insert(admitted, product)
+    end
+end
+if #admitted > 0 then redis.call('HSET', KEYS[3], 'at', ARGV[1]) end
+return admitted
+"""
+
+# KEYS: stock hash, sold hash, admission | undo the admission, once
+# A negative sold value hands units already deducted by reconcile back to stock
+CANCEL_SCRIPT = """
+local admission = redis.call('HGETALL', KEYS[3])
+for i = 1, #admission, 2 do
+    local product, quantity = admission[i], tonumber(admission[i + 1])
+    if product ~= 'at' then
+        if redis.call('HEXISTS', KEYS[1], product) == 1 then
+            redis.call('HINCRBY', KEYS[1], product, quantity)
+        end
+        redis.call('HINCRBY', KEYS[2], product, -quantity)
+    end
+end
+redis.call('DEL', KEYS[3])
+return 1
+"""
+
+# KEYS: sold hash | take every pending deduction at once
+TAKE_SCRIPT = """
+local sold = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return sold
+"""
+
+# KEYS: stock hash | ARGV: (product id, quantity)... back to admittable units
+RESTORE_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    if redis.call('HEXISTS', KEYS[1], ARGV[i]) == 1 then
+        redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+return 1
+"""
+
+
+def admission_token(user_id, cart_items):
+    """Same user and flash sale items, same admission: stable across retries"""
+    items = ",".join(
+        f"{c.product_id}:{c.quantity}"
+        for c in sorted(cart_items, key=lambda c: c.product_id)
+    )
+    return f"{user_id}:{hashlib.sha1(items.encode()).hexdigest()[:16]}"
+
+
+def admit(token, cart_items):
+    """
+    Decrement the flash sale counters of all cart items in one atomic script,
+    recorded under the admission token until confirmed or cancelled
+    Return ids of admitted products, nothing is admitted while Redis is unavailable
+    """
+    if not cart_items:
+        return set()
+
+    client = get_redis_client()
+    if client is None:
+        return set()
+
+    args = [time.time()]
+    for cart in sorted(cart_items, key=lambda c: c.product_id):
+        args += [cart.product_id, cart.quantity, cart.product.available]
+    try:
+        admitted = client.eval(
+            ADMIT_SCRIPT,
+            3,
+            STOCK_KEY,
+            SOLD_KEY,
+            ADMISSION_KEY.format(token),
+            *args,
+        )
+    except RedisError as e:
+        mark_unavailable(e)
+        return set()
+    return {int(product_id) for product_id in admitted}
+
+
+def cancel(token):
+    """Give the admitted units back, the order was not created"""
+    client = get_redis_client()
+    if client is None:
+        return
+    try:
+        client.eval(CANCEL_SCRIPT, 3, STOCK_KEY, SOLD_KEY, ADMISSION_KEY.format(token))
+    except RedisError as e:
+        mark_unavailable(e)
+
+
+def confirm(token):
+    """The order holding the admitted units is committed"""
+    client = get_redis_client()
+    if client is None:
+        return
+    try:
+        client.delete(ADMISSION_KEY.format(token))
+    except RedisError as e:
+        mark_unavailable(e)
+
+
+def settle_admissions(client):
+    """
+    Settle admissions left behind by a crash or a rollback outside create_order:
+    confirmed when the user got flash sale reservations since, cancelled otherwise
+    """
+    cutoff = time.time() - ADMISSION_TIMEOUT
+    for key in client.scan_iter(match=ADMISSION_KEY.format("*")):
+        admitted_at = client.hget(key, "at")
+        if admitted_at is None or float(admitted_at) > cutoff:
+            continue
+        token = key.decode().removeprefix(ADMISSION_KEY.format(""))
+        user_id = int(token.split(":")[0])
+        ordered = StockReservation.objects.filter(
+            order__user_id=user_id,
+            flash_sale=True,
+            created_at__gte=datetime.fromtimestamp(float(admitted_at), dt_timezone.utc),
+        ).exists()
+        if ordered:
+            client.delete(key)
+        else:
+            client.eval(CANCEL_SCRIPT, 3, STOCK_KEY, SOLD_KEY, key)
+
+
+def restore(quantities):
+    """Hand released units back to the counters still running"""
+    client = get_redis_client()
+    if client is None or not quantities:
+        return
+    args = [value for item in quantities.items() for value in item]
+    try:
+        client.eval(RESTORE_SCRIPT, 1, STOCK_KEY, *args)
+    except RedisError as e:
+        mark_unavailable(e)
+
+
+def reconcile():
+    """
+    Settle stale admissions, deduct admitted units from Product.stock in one
+    batch update, then drop counters of products no longer on flash sale
+    """
+    client = get_redis_client()
+    if client is None:
+        return 0
+
+    try:
+        settle_admissions(client)
+        taken = client.eval(TAKE_SCRIPT, 1, SOLD_KEY)
+    except RedisError as e:
+        mark_unavailable(e)
+        return 0
+
+    sold = {int(taken[i]): int(taken[i + 1]) for i in range(0, len(taken), 2)}
+    try:
+        update_stock(SELL, sold)
+    except Exception:
+        # Keep the deductions for the next run
+        pipe = client.pipeline()
+        for product_id, quantity in sold.items():
+            pipe.hincrby(SOLD_KEY, product_id, quantity)
+        pipe.execute()
+        raise
+
+    try:
+        running = [int(product_id) for product_id in client.hkeys(STOCK_KEY)]
+        ended = set(running) - Product.flash_sale_ids(running)
+        if ended:
+            client.hdel(STOCK_KEY, *ended)
+    except RedisError as e:
+        mark_unavailable(e)
+
+    logger.info(f"Flash sale reconciled {sum(sold.values())} units")
+    return len(sold)
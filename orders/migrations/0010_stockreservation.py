@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-19 12:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_alter_order_options_alter_orderitem_options_and_more'),
+        ('product', '0055_product_reserved'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True, verbose_name='Created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True, verbose_name='Updated at')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Quantity')),
+                ('status', models.CharField(choices=[('active', 'Active'), ('committed', 'Committed'), ('released', 'Released')], db_index=True, default='active', max_length=20, verbose_name='Status')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='Expires at')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='orders.order', verbose_name='Order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='product_reservations', to='product.product', verbose_name='Product')),
+            ],
+            options={
+                'verbose_name': 'Stock reservation',
+                'verbose_name_plural': 'Stock reservations',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
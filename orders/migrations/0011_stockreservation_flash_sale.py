@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0010_stockreservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockreservation',
+            name='flash_sale',
+            field=models.BooleanField(default=False, help_text='Admitted by the Redis counter, stock deducted by the reconciler', verbose_name='Flash sale'),
+        ),
+    ]
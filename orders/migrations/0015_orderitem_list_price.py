@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-19 13:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("orders", "0014_order_order_user_created_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="orderitem",
+            name="list_price",
+            field=models.DecimalField(
+                blank=True,
+                decimal_places=2,
+                help_text="Product price before discount at checkout",
+                max_digits=12,
+                null=True,
+                verbose_name="List price",
+            ),
+        ),
+    ]
@@ -1,6 +1,8 @@
+import uuid
 from decimal import Decimal
 
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
@@ -56,6 +58,22 @@ class Order(BaseModel):
         ordering = ["-created_at"]
         verbose_name = _("Order")
         verbose_name_plural = _("Orders")
+        indexes = [
+            models.Index(fields=["user", "status"], name="order_user_status_idx"),
+            # Invoice cursor pagination
+            models.Index(
+                fields=["user", "-created_at", "-id"], name="order_user_created_idx"
+            ),
+            models.Index(
+                fields=["status", "created_at"], name="order_status_created_idx"
+            ),
+            # Expiry sweeps only scan pending orders (partial index where supported)
+            models.Index(
+                fields=["created_at"],
+                condition=models.Q(status="pending"),
+                name="order_pending_created_idx",
+            ),
+        ]
 
     @property
     def total(self):
@@ -94,6 +112,14 @@ class OrderItem(BaseModel):
         max_digits=12,
         decimal_places=2,
     )
+    list_price = models.DecimalField(
+        verbose_name=_("List price"),
+        max_digits=12,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        help_text="Product price before discount at checkout",
+    )
 
     class Meta:
         ordering = ["-created_at"]
@@ -104,3 +130,110 @@ class OrderItem(BaseModel):
         return (
             f"{self.product.title} x{self.quantity} (Order status: {self.order.status})"
         )
+
+
+class StockReservation(BaseModel):
+    """
+    Units of a product held for a pending order
+    Committed into stock on payment success, released on failure or expiry
+    """
+
+    class Status(models.TextChoices):
+        ACTIVE = "active", _("Active")
+        COMMITTED = "committed", _("Committed")
+        RELEASED = "released", _("Released")
+
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        verbose_name=_("Order"),
+        related_name="reservations",
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.PROTECT,
+        verbose_name=_("Product"),
+        related_name="product_reservations",
+    )
+    quantity = models.PositiveIntegerField(verbose_name=_("Quantity"))
+    status = models.CharField(
+        verbose_name=_("Status"),
+        choices=Status.choices,
+        max_length=20,
+        default=Status.ACTIVE,
+        db_index=True,
+    )
+    expires_at = models.DateTimeField(
+        verbose_name=_("Expires at"),
+        db_index=True,
+    )
+    flash_sale = models.BooleanField(
+        verbose_name=_("Flash sale"),
+        default=False,
+        help_text="Admitted by the Redis counter, stock deducted by the reconciler",
+    )
+
+    class Meta:
+        ordering = ["-created_at"]
+        verbose_name = _("Stock reservation")
+        verbose_name_plural = _("Stock reservations")
+
+    def __str__(self):
+        return f"{self.product} x{self.quantity} ({self.status})"
+
+
+class CheckoutJob(BaseModel):
+    """
+    Checkout queued for a worker when CHECKOUT_MODE is async
+    """
+
+    class Status(models.TextChoices):
+        QUEUED = "queued", _("Queued")
+        PROCESSING = "processing", _("Processing")
+        SUCCEEDED = "succeeded", _("Succeeded")
+        FAILED = "failed", _("Failed")
+
+    job_id = models.UUIDField(
+        verbose_name=_("Job ID"),
+        default=uuid.uuid4,
+        unique=True,
+        editable=False,
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        verbose_name=_("User"),
+        on_delete=models.CASCADE,
+        related_name="checkout_jobs",
+    )
+    shipping_address = models.TextField(
+        verbose_name=_("Shipping address"),
+    )
+    status = models.CharField(
+        verbose_name=_("Status"),
+        choices=Status.choices,
+        max_length=20,
+        default=Status.QUEUED,
+    )
+    order = models.ForeignKey(
+        Order,
+        verbose_name=_("Order"),
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="checkout_jobs",
+    )
+    result = models.JSONField(
+        verbose_name=_("Result"),
+        encoder=DjangoJSONEncoder,
+        null=True,
+        blank=True,
+        help_text="Checkout response or errors once processed",
+    )
+
+    class Meta:
+        ordering = ["-created_at"]
+        verbose_name = _("Checkout job")
+        verbose_name_plural = _("Checkout jobs")
+
+    def __str__(self):
+        return f"Checkout {self.job_id} - Status: {self.status.capitalize()}"
@@ -0,0 +1,10 @@
+from rest_framework.pagination import CursorPagination
+
+
+class InvoicePagination(CursorPagination):
+    """Keyset pages over (user, created_at), stable while new orders arrive"""
+
+    page_size = 10
+    page_size_query_param = "page_size"
+    max_page_size = 50
+    ordering = ("-created_at", "-id")
@@ -0,0 +1,165 @@
+from collections import defaultdict
+
+from django.db import connection, transaction
+
+from core.transactions import lock_in_order
+from product.models import Product
+
+from .models import StockReservation
+
+# Per-product quantities joined as a VALUES list
+STOCK_UPDATE_SQL_POSTGRES = """
+UPDATE {product} AS p
+SET {assignments}
+FROM (VALUES {rows}) AS v (id, quantity)
+WHERE p.id = v.id {guard}
+RETURNING p.id
+"""
+
+STOCK_UPDATE_SQL = """
+UPDATE {product}
+SET {assignments}
+WHERE id IN ({ids}) {guard}
+RETURNING id
+"""
+
+# (assignments, guard) with {quantity} standing for the per-product quantity
+RESERVE = ("reserved = reserved + {quantity}", "stock - reserved >= {quantity}")
+COMMIT = ("stock = stock - {quantity}, reserved = reserved - {quantity}", None)
+RELEASE = ("reserved = reserved - {quantity}", None)
+# Flash sale units never touch `reserved`, the reconciler deducts them from stock
+FLASH_RELEASE = ("stock = stock + {quantity}", None)
+# Released units taken straight from stock, while still available
+RETAKE = ("stock = stock - {quantity}", "stock - reserved >= {quantity}")
+
+
+class StockShortage(Exception):
+    """Raised to roll back a partial retake"""
+
+
+def update_stock(operation, quantities):
+    """
+    Apply per-product quantities with a single UPDATE
+    (`UPDATE ... FROM (VALUES ...)` on PostgreSQL, CASE expression elsewhere)
+    Return ids of updated products, products failing the guard are left out
+    """
+    if not quantities:
+        return set()
+
+    items = sorted(quantities.items())
+    # Row locks taken in id order before the set-based write
+    lock_in_order(Product.objects.filter(id__in=quantities).values_list("id"))
+
+    params = {}
+    for index, (product_id, quantity) in enumerate(items):
+        params[f"id_{index}"] = product_id
+        params[f"quantity_{index}"] = quantity
+
+    if connection.vendor == "postgresql":
+        template, quantity = STOCK_UPDATE_SQL_POSTGRES, "v.quantity"
+    else:
+        template = STOCK_UPDATE_SQL
+        quantity = "CASE id {} END".format(
+            " ".join(
+                f"WHEN %(id_{i})s THEN %(quantity_{i})s" for i in range(len(items))
+            )
+        )
+
+    assignments, guard = operation
+    sql = template.format(
+        product=Product._meta.db_table,
+        assignments=assignments.format(quantity=quantity),
+        guard=f"AND {guard.format(quantity=quantity)}" if guard else "",
+        rows=", ".join(f"(%(id_{i})s, %(quantity_{i})s)" for i in range(len(items))),
+        ids=", ".join(f"%(id_{i})s" for i in range(len(items))),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return {row[0] for row in cursor.fetchall()}
+
+
+def reserve_stock(quantities):
+    """
+    Hold units while available (stock - reserved) covers them
+    Return the ids of reserved products
+    """
+    return update_stock(RESERVE, quantities)
+
+
+def _settle(order_ids, status, operation, flash_operation=None):
+    """
+    Flip active reservations of the orders to `status` and apply their quantities
+    Return flash sale quantities, which skip `operation`
+    """
+    reservations = lock_in_order(
+        StockReservation.objects.filter(
+            order_id__in=order_ids,
+            status=StockReservation.Status.ACTIVE,
+        ).values_list("id", "product_id", "quantity", "flash_sale")
+    )
+    if not reservations:
+        return {}
+
+    quantities, flash_quantities = defaultdict(int), defaultdict(int)
+    for _, product_id, quantity, flash_sale in reservations:
+        if flash_sale:
+            flash_quantities[product_id] += quantity
+        else:
+            quantities[product_id] += quantity
+
+    StockReservation.objects.filter(id__in=[r[0] for r in reservations]).update(
+        status=status
+    )
+    update_stock(operation, quantities)
+    if flash_operation:
+        update_stock(flash_operation, flash_quantities)
+    return flash_quantities
+
+
+@transaction.atomic
+def commit_reservations(order_ids):
+    """Turn active reservations into a stock deduction once paid"""
+    _settle(order_ids, StockReservation.Status.COMMITTED, COMMIT)
+
+
+@transaction.atomic
+def release_reservations(order_ids):
+    """Give held units back to available stock and running flash sale counters"""
+    from .flash_sale import restore
+
+    flash_quantities = _settle(
+        order_ids, StockReservation.Status.RELEASED, RELEASE, FLASH_RELEASE
+    )
+    if flash_quantities:
+        transaction.on_commit(lambda: restore(flash_quantities))
+
+
+def retake_stock(order_id):
+    """
+    Deduct the released units of an expired or failed order again, for a
+    payment arriving late
+    Return False, changing nothing, when a product no longer covers its units
+    or the order held flash sale units (their counters moved on)
+    """
+    reservations = list(
+        StockReservation.objects.filter(
+            order_id=order_id,
+            status=StockReservation.Status.RELEASED,
+        ).values_list("id", "product_id", "quantity", "flash_sale")
+    )
+    if any(flash_sale for *_, flash_sale in reservations):
+        return False
+
+    quantities = defaultdict(int)
+    for _, product_id, quantity, _ in reservations:
+        quantities[product_id] += quantity
+    try:
+        with transaction.atomic():
+            if update_stock(RETAKE, quantities) != set(quantities):
+                raise StockShortage
+            StockReservation.objects.filter(id__in=[r[0] for r in reservations]).update(
+                status=StockReservation.Status.COMMITTED
+            )
+    except StockShortage:
+        return False
+    return True
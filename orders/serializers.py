@@ -1,6 +1,7 @@
+from django.urls import reverse
 from rest_framework import serializers
 
-from orders.models import Order, OrderItem
+from orders.models import CheckoutJob, Order, OrderItem
 from product.serializers import BaseSerializer
 
 
@@ -11,6 +12,21 @@ class CheckoutSerializer(serializers.Serializer):
     )
 
 
+class CheckoutJobSerializer(serializers.ModelSerializer):
+    order_id = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = CheckoutJob
+        fields = [
+            "job_id",
+            "status",
+            "order_id",
+            "result",
+            "created_at",
+            "updated_at",
+        ]
+
+
 class OrderItemSerializer(BaseSerializer):
     product = serializers.SerializerMethodField()
     price_at_purchase = serializers.SerializerMethodField()
@@ -41,6 +57,33 @@ class OrderItemSerializer(BaseSerializer):
         return f"{obj.price_at_purchase:,.0f}"
 
 
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """Order header with the item count annotated by the queryset"""
+
+    subtotal = serializers.ReadOnlyField(source="total_amount")
+    item_count = serializers.IntegerField(read_only=True)
+    items_url = serializers.SerializerMethodField()
+
+    created_at = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S")
+
+    class Meta:
+        model = Order
+        fields = [
+            "id",
+            "status",
+            "shipping_address",
+            "subtotal",
+            "item_count",
+            "items_url",
+            "created_at",
+        ]
+
+    def get_items_url(self, obj):
+        request = self.context.get("request")
+        url = reverse("invoice-items", kwargs={"order_id": obj.id})
+        return request.build_absolute_uri(url) if request else url
+
+
 class OrderSerializer(serializers.ModelSerializer):
     order_items = OrderItemSerializer(many=True)
     subtotal = serializers.ReadOnlyField(source="total_amount")
@@ -1,8 +1,35 @@
 from celery import shared_task
 
-from .utils import mark_pending_orders
+from . import flash_sale
+from .utils import (
+    expire_due_orders,
+    mark_pending_orders,
+    process_checkout_job,
+    requeue_stale_checkout_jobs,
+)
 
 
 @shared_task
 def expired_orders_task():
     mark_pending_orders()
+
+
+@shared_task
+def expire_due_orders_task():
+    expire_due_orders()
+
+
+@shared_task
+def reconcile_flash_sale_task():
+    flash_sale.reconcile()
+
+
+@shared_task
+def process_checkout_task(job_id):
+    process_checkout_job(job_id)
+
+
+@shared_task
+def requeue_checkout_jobs_task():
+    for job_id in requeue_stale_checkout_jobs():
+        process_checkout_task.delay(job_id)
@@ -1,6 +1,25 @@
+from datetime import timedelta
+
 import pytest
+from django.db import OperationalError
+from django.utils import timezone
+from prometheus_client import REGISTRY
 
-from orders.models import Order, OrderItem
+from cart.models import CartItem
+from core.deadlines import DeadlineQueue
+from core.transactions import atomic_with_retry
+from orders import flash_sale
+from orders.models import Order, OrderItem, StockReservation
+from orders.reservations import reserve_stock
+from orders.utils import (
+    ORDER_DEADLINES,
+    ORDER_EXPIRY,
+    create_order,
+    expire_due_orders,
+    expire_order_batch,
+    mark_pending_orders,
+)
+from product.models import Product
 
 
 @pytest.mark.parametrize(
@@ -57,3 +76,220 @@ def test_order_item_creation(
     assert str(
         f"{order_item.product.title} x{order_item.quantity} (Order status: {order_item.order.status})"
     )
+
+
+@pytest.mark.parametrize(
+    "outcome, stock, status",
+    [
+        ("success", 3, StockReservation.Status.COMMITTED),
+        ("failure", 5, StockReservation.Status.RELEASED),
+        ("expiry", 5, StockReservation.Status.RELEASED),
+    ],
+)
+def test_stock_reservation_settlement(
+    sample_products, sample_payment, outcome, stock, status
+):
+    product = sample_products["products"][0]
+    order = sample_payment.order
+
+    assert reserve_stock({product.id: 2}) == {product.id}
+    assert reserve_stock({product.id: 4}) == set()
+    reservation = StockReservation.objects.create(
+        order=order,
+        product=product,
+        quantity=2,
+        expires_at=order.created_at,
+    )
+    product.refresh_from_db()
+    assert product.available == 3
+
+    if outcome == "success":
+        sample_payment.mark_success({})
+    elif outcome == "failure":
+        sample_payment.mark_failure({})
+    else:
+        Order.objects.filter(pk=order.pk).update(
+            created_at=timezone.now() - timedelta(hours=1)
+        )
+        mark_pending_orders()
+
+    product.refresh_from_db()
+    reservation.refresh_from_db()
+    assert (product.stock, product.reserved) == (stock, 0)
+    assert reservation.status == status
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("sqlstate, calls", [("40P01", 2), ("42P01", 1)])
+def test_atomic_with_retry(sqlstate, calls):
+    attempts = []
+
+    @atomic_with_retry("test")
+    def deadlocking():
+        attempts.append(1)
+        if len(attempts) == 1:
+            error = OperationalError("conflict")
+            error.__cause__ = type("DriverError", (Exception,), {"sqlstate": sqlstate})()
+            raise error
+        return "done"
+
+    def retried():
+        labels = {"operation": "test", "outcome": "retried"}
+        return REGISTRY.get_sample_value("db_transaction_retries_total", labels) or 0
+
+    before = retried()
+
+    if calls == 1:
+        with pytest.raises(OperationalError):
+            deadlocking()
+    else:
+        assert deadlocking() == "done"
+    assert len(attempts) == calls
+    assert retried() - before == calls - 1
+
+
+def test_mark_pending_orders_batches(sample_products, order_factory):
+    product = sample_products["products"][0]
+    orders = [order_factory("pending") for _ in range(3)]
+    for order in orders:
+        StockReservation.objects.create(
+            order=order, product=product, quantity=1, expires_at=timezone.now()
+        )
+    Product.objects.filter(pk=product.pk).update(reserved=3)
+    Order.objects.update(created_at=timezone.now() - timedelta(hours=1))
+
+    assert mark_pending_orders(batch_size=2) == 3
+
+    product.refresh_from_db()
+    assert product.reserved == 0
+    assert not Order.objects.filter(status=Order.Status.PENDING).exists()
+    assert not StockReservation.objects.filter(
+        status=StockReservation.Status.ACTIVE
+    ).exists()
+
+
+def test_expire_order_batch_by_ids(order_factory):
+    due, other = order_factory("pending"), order_factory("pending")
+    Order.objects.update(created_at=timezone.now() - timedelta(hours=1))
+
+    assert expire_order_batch(order_ids=[due.id]) == 1
+
+    due.refresh_from_db()
+    other.refresh_from_db()
+    assert (due.status, other.status) == (Order.Status.EXPIRED, Order.Status.PENDING)
+
+
+def test_expiry_sweep_uses_index(assert_uses_index, order_factory):
+    order_factory("pending")
+
+    with assert_uses_index("orders_order"):
+        expire_order_batch()
+
+
+@pytest.fixture
+def flash_cart(sample_active_user, sample_products, cart_item_factory):
+    product = sample_products["products"][0]
+    Product.objects.filter(pk=product.pk).update(flash_sale=True)
+    product.refresh_from_db()
+    cart_item_factory(user=sample_active_user, product=product, quantity=2)
+    return product, list(
+        CartItem.objects.filter(user=sample_active_user).select_related("product")
+    )
+
+
+def test_flash_sale_admission_idempotent(fake_redis, sample_active_user, flash_cart):
+    product, cart_items = flash_cart
+    token = flash_sale.admission_token(sample_active_user.pk, cart_items)
+
+    assert flash_sale.admit(token, cart_items) == {product.pk}
+    assert flash_sale.admit(token, cart_items) == {product.pk}
+    assert int(fake_redis.hget(flash_sale.STOCK_KEY, product.pk)) == 3
+    assert int(fake_redis.hget(flash_sale.SOLD_KEY, product.pk)) == 2
+
+    flash_sale.cancel(token)
+    flash_sale.cancel(token)
+    assert int(fake_redis.hget(flash_sale.STOCK_KEY, product.pk)) == 5
+    assert int(fake_redis.hget(flash_sale.SOLD_KEY, product.pk)) == 0
+
+
+def test_flash_sale_rollback_cancels_admission(
+    monkeypatch, fake_redis, sample_active_user, flash_cart
+):
+    product, cart_items = flash_cart
+
+    def failing(*args, **kwargs):
+        raise OperationalError("connection lost")
+
+    monkeypatch.setattr(StockReservation.objects, "bulk_create", failing)
+    with pytest.raises(OperationalError):
+        create_order(sample_active_user, "random-address", cart_items)
+
+    assert not Order.objects.exists()
+    assert int(fake_redis.hget(flash_sale.STOCK_KEY, product.pk)) == 5
+    assert int(fake_redis.hget(flash_sale.SOLD_KEY, product.pk)) == 0
+    assert not fake_redis.keys(flash_sale.ADMISSION_KEY.format("*"))
+
+
+@pytest.mark.parametrize("ordered, stock", [(True, 3), (False, 5)])
+def test_reconcile_settles_stale_admissions(
+    fake_redis, sample_active_user, flash_cart, order_factory, ordered, stock
+):
+    """Stale admissions with an order are kept, the others given back"""
+    product, cart_items = flash_cart
+    token = flash_sale.admission_token(sample_active_user.pk, cart_items)
+    flash_sale.admit(token, cart_items)
+    key = flash_sale.ADMISSION_KEY.format(token)
+    admitted_at = float(fake_redis.hget(key, "at")) - flash_sale.ADMISSION_TIMEOUT
+    fake_redis.hset(key, "at", admitted_at - 1)
+    if ordered:
+        StockReservation.objects.create(
+            order=order_factory("pending"),
+            product=product,
+            quantity=2,
+            expires_at=timezone.now(),
+            flash_sale=True,
+        )
+
+    flash_sale.reconcile()
+
+    product.refresh_from_db()
+    assert product.stock == stock
+    assert int(fake_redis.hget(flash_sale.STOCK_KEY, product.pk)) == stock
+    assert not fake_redis.exists(key, flash_sale.SOLD_KEY)
+
+
+def test_deadline_queue(fake_redis):
+    queue = DeadlineQueue("test")
+    now = timezone.now()
+    queue.schedule(1, now - timedelta(minutes=1))
+    queue.schedule(2, now - timedelta(seconds=1))
+    queue.schedule(3, now + timedelta(minutes=1))
+
+    assert queue.pop_due(limit=1) == [1]
+    assert queue.pop_due() == [2]
+    assert queue.pop_due() == []
+    assert fake_redis.zrange(queue.key, 0, -1) == [b"3"]
+
+    queue.retry([1, 2])
+    assert sorted(queue.pop_due()) == [1, 2]
+
+
+def test_expire_due_orders_retried_on_failure(monkeypatch, fake_redis, order_factory):
+    """Popped deadlines go back to the queue when the expiry batch fails"""
+    order = order_factory("pending")
+    Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - ORDER_EXPIRY)
+    ORDER_DEADLINES.schedule(order.pk, timezone.now())
+
+    def failing(*args, **kwargs):
+        raise OperationalError("connection lost")
+
+    monkeypatch.setattr("orders.utils.expire_order_batch", failing)
+    with pytest.raises(OperationalError):
+        expire_due_orders()
+    assert fake_redis.zrange(ORDER_DEADLINES.key, 0, -1) == [str(order.pk).encode()]
+
+    monkeypatch.setattr("orders.utils.expire_order_batch", expire_order_batch)
+    assert expire_due_orders() == 1
+    order.refresh_from_db()
+    assert order.status == Order.Status.EXPIRED
+    assert not fake_redis.exists(ORDER_DEADLINES.key)
@@ -1,8 +1,17 @@
 import pytest
+from django.contrib.auth import get_user_model
 from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
 
 from cart.models import CartItem
-from orders.models import Order, OrderItem
+from orders import flash_sale
+from orders import utils as orders_utils
+from orders.models import CheckoutJob, Order, OrderItem, StockReservation
+from orders.reservations import release_reservations
+from orders.tasks import process_checkout_task
+from orders.utils import CHECKOUT_JOB_TIMEOUT, requeue_stale_checkout_jobs
+from product.models import Product
 
 
 @pytest.mark.parametrize(
@@ -43,9 +52,10 @@ def test_checkout(
             status=Order.Status.PENDING,
         ).first()
         assert order is not None
-        expected_stock = product.stock - cart.quantity
         product.refresh_from_db()
-        assert product.stock == expected_stock
+        assert product.stock == 5
+        assert product.reserved == cart.quantity
+        assert order.reservations.get().quantity == cart.quantity
         order_item = OrderItem.objects.filter(
             order=order,
             product=product,
@@ -76,4 +86,334 @@ def test_invoice(auth_client, sample_order_item):
     data = response.json()
 
     assert response.status_code == 200
-    assert isinstance(data, list)
+    assert isinstance(data["results"], list)
+    assert data["results"][0]["order_items"][0]["id"] == sample_order_item.id
+
+
+def test_invoice_cursor_pages(auth_client, order_factory):
+    client, _ = auth_client
+    orders = [order_factory() for _ in range(3)]
+
+    first = client.get(reverse("invoice-list"), {"page_size": 2}).json()
+    second = client.get(first["next"]).json()
+
+    assert [o["id"] for o in first["results"] + second["results"]] == [
+        o.id for o in reversed(orders)
+    ]
+    assert second["next"] is None
+
+
+def test_invoice_summary(
+    auth_client, sample_products, order_factory, order_item_factory
+):
+    client, _ = auth_client
+    order = order_factory()
+    for product in sample_products["products"][:2]:
+        order_item_factory(order=order, product=product, price=product.price)
+
+    response = client.get(reverse("invoice-list"), {"summary": "true"})
+    summary = response.json()["results"][0]
+
+    assert response.status_code == 200
+    assert summary["item_count"] == 2
+    assert "order_items" not in summary
+
+    items = client.get(summary["items_url"])
+
+    assert items.status_code == 200
+    assert len(items.json()) == 2
+
+
+def test_invoice_items_of_other_user(sample_order_item):
+    other = get_user_model().objects.create_user(
+        username="other_user", email="other_user@email.com", password="x"
+    )
+    client = APIClient()
+    client.force_authenticate(user=other)
+
+    response = client.get(
+        reverse("invoice-items", kwargs={"order_id": sample_order_item.order_id})
+    )
+
+    assert response.status_code == 404
+
+
+def test_checkout_skips_short_stock(auth_client, sample_products, cart_item_factory):
+    client, user = auth_client
+    available, short = sample_products["products"][:2]
+    cart_item_factory(user=user, product=available, quantity=2)
+    cart_item_factory(user=user, product=short, quantity=3)
+    Product.objects.filter(pk=short.pk).update(stock=2)
+
+    response = client.post(reverse("checkout"), {"address": "random-address"})
+
+    assert response.status_code == 201
+    assert response.data["skipped_items"] == [short.title]
+    assert [item["id"] for item in response.data["items"]] == [available.id]
+    assert dict(
+        Product.objects.filter(pk__in=[available.pk, short.pk]).values_list(
+            "id", "reserved"
+        )
+    ) == {available.id: 2, short.id: 0}
+    assert list(
+        CartItem.objects.filter(user=user).values_list("product_id", flat=True)
+    ) == [short.id]
+
+
+def test_checkout_all_short_stock(auth_client, sample_products, cart_item_factory):
+    client, user = auth_client
+    product = sample_products["products"][0]
+    cart_item_factory(user=user, product=product, quantity=3)
+    Product.objects.filter(pk=product.pk).update(stock=1)
+
+    response = client.post(reverse("checkout"), {"address": "random-address"})
+
+    assert response.status_code == 400
+    assert response.data["out of stock"] == [product.title]
+    assert not Order.objects.filter(user=user).exists()
+    product.refresh_from_db()
+    assert product.reserved == 0
+
+
+def test_checkout_uses_index(
+    assert_uses_index, auth_client, sample_products, cart_item_factory
+):
+    """The one pending order per user check"""
+    client, user = auth_client
+    cart_item_factory(user=user, product=sample_products["products"][0])
+
+    with assert_uses_index("orders_order"):
+        response = client.post(reverse("checkout"), {"address": "random-address"})
+
+    assert response.status_code == 201
+
+
+def test_checkout_flash_sale_redis_unavailable(
+    monkeypatch, auth_client, sample_products, cart_item_factory
+):
+    """Flash sale items are rejected rather than admitted against stale stock"""
+    monkeypatch.setattr("orders.flash_sale.get_redis_client", lambda: None)
+    client, user = auth_client
+    flash, regular = sample_products["products"][:2]
+    Product.objects.filter(pk=flash.pk).update(flash_sale=True)
+    cart_item_factory(user=user, product=flash, quantity=1)
+    cart_item_factory(user=user, product=regular, quantity=1)
+
+    response = client.post(reverse("checkout"), {"address": "random-address"})
+
+    assert response.status_code == 201
+    assert response.data["skipped_items"] == [flash.title]
+    assert [item["id"] for item in response.data["items"]] == [regular.id]
+
+
+def test_checkout_flash_sale_admitted(
+    fake_redis,
+    django_capture_on_commit_callbacks,
+    auth_client,
+    sample_products,
+    cart_item_factory,
+):
+    """Admitted by the counters, deducted by reconcile, restored on release"""
+    client, user = auth_client
+    flash, sold_out = sample_products["products"][:2]
+    Product.objects.filter(pk__in=[flash.pk, sold_out.pk]).update(flash_sale=True)
+    fake_redis.hset(flash_sale.STOCK_KEY, sold_out.pk, 0)
+    cart_item_factory(user=user, product=flash, quantity=2)
+    cart_item_factory(user=user, product=sold_out, quantity=1)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.post(reverse("checkout"), {"address": "random-address"})
+
+    assert response.status_code == 201
+    assert response.data["skipped_items"] == [sold_out.title]
+    assert int(fake_redis.hget(flash_sale.STOCK_KEY, flash.pk)) == 3
+    assert int(fake_redis.hget(flash_sale.SOLD_KEY, flash.pk)) == 2
+    assert not fake_redis.keys(flash_sale.ADMISSION_KEY.format("*"))
+    assert StockReservation.objects.get().flash_sale
+
+    assert flash_sale.reconcile() == 1
+    flash.refresh_from_db()
+    assert (flash.stock, flash.reserved) == (3, 0)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        release_reservations([Order.objects.get(user=user).pk])
+    flash.refresh_from_db()
+    assert flash.stock == 5
+    assert int(fake_redis.hget(flash_sale.STOCK_KEY, flash.pk)) == 5
+
+
+def test_async_checkout(
+    settings,
+    monkeypatch,
+    django_capture_on_commit_callbacks,
+    auth_client,
+    sample_products,
+    cart_item_factory,
+):
+    settings.CHECKOUT_MODE = "async"
+    queued = []
+    monkeypatch.setattr(
+        "orders.views.process_checkout_task.delay",
+        lambda job_id: queued.append(job_id),
+    )
+    client, user = auth_client
+    product = sample_products["products"][0]
+    cart_item_factory(user=user, product=product, quantity=2)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.post(reverse("checkout"), {"address": "random-address"})
+
+    assert response.status_code == 202
+    status_url = response.data["status_url"]
+    assert client.get(status_url).data["status"] == CheckoutJob.Status.QUEUED
+    assert not Order.objects.filter(user=user).exists()
+
+    process_checkout_task(*queued)
+    process_checkout_task(*queued)
+
+    data = client.get(status_url).data
+    order = Order.objects.get(user=user)
+    assert data["status"] == CheckoutJob.Status.SUCCEEDED
+    assert data["order_id"] == order.id
+    assert data["result"]["items"][0]["quantity"] == 2
+
+
+def test_async_checkout_failed(
+    settings, monkeypatch, django_capture_on_commit_callbacks, auth_client
+):
+    settings.CHECKOUT_MODE = "async"
+    monkeypatch.setattr(
+        "orders.views.process_checkout_task.delay", process_checkout_task
+    )
+    client, _ = auth_client
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.post(reverse("checkout"), {"address": "random-address"})
+
+    data = client.get(response.data["status_url"]).data
+    assert data["status"] == CheckoutJob.Status.FAILED
+    assert data["result"] == {"out of stock": ["No cart found"]}
+
+
+def test_async_checkout_product_busy(
+    settings,
+    monkeypatch,
+    django_capture_on_commit_callbacks,
+    fake_redis,
+    auth_client,
+    sample_products,
+    cart_item_factory,
+):
+    """A lock held past the timeout fails the job instead of checking out unlocked"""
+    settings.CHECKOUT_MODE = "async"
+    monkeypatch.setattr("orders.utils.PRODUCT_LOCK_TIMEOUT", 0.1)
+    monkeypatch.setattr(
+        "orders.views.process_checkout_task.delay", process_checkout_task
+    )
+    client, user = auth_client
+    busy, free = sample_products["products"][1], sample_products["products"][0]
+    cart_item_factory(user=user, product=free, quantity=1)
+    cart_item_factory(user=user, product=busy, quantity=1)
+    fake_redis.lock(f"checkout:product:{busy.pk}", timeout=10).acquire()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.post(reverse("checkout"), {"address": "random-address"})
+
+    data = client.get(response.data["status_url"]).data
+    assert data["status"] == CheckoutJob.Status.FAILED
+    assert data["result"] == {"detail": "Checkout busy, please try again"}
+    assert not Order.objects.filter(user=user).exists()
+    assert not fake_redis.exists(f"checkout:product:{free.pk}")
+
+
+def test_async_checkout_locks_unflushed_items(
+    settings,
+    monkeypatch,
+    django_capture_on_commit_callbacks,
+    redis_cart_store,
+    auth_client,
+    sample_products,
+):
+    """Items added since the last write-behind flush are locked too"""
+    settings.CHECKOUT_MODE = "async"
+    monkeypatch.setattr("orders.utils.PRODUCT_LOCK_TIMEOUT", 0.1)
+    monkeypatch.setattr(
+        "orders.views.process_checkout_task.delay", process_checkout_task
+    )
+    client, user = auth_client
+    product = sample_products["products"][0]
+    client.post(reverse("cart-list-create"), {"product_id": product.pk})
+    assert not CartItem.objects.filter(user=user).exists()
+    redis_cart_store.lock(f"checkout:product:{product.pk}", timeout=10).acquire()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.post(reverse("checkout"), {"address": "random-address"})
+
+    data = client.get(response.data["status_url"]).data
+    assert data["status"] == CheckoutJob.Status.FAILED
+    assert not Order.objects.filter(user=user).exists()
+
+
+def test_async_checkout_outlived_lock(
+    settings,
+    monkeypatch,
+    django_capture_on_commit_callbacks,
+    fake_redis,
+    auth_client,
+    sample_products,
+    cart_item_factory,
+):
+    """A lock expired during a long checkout does not fail the committed order"""
+    settings.CHECKOUT_MODE = "async"
+    monkeypatch.setattr(
+        "orders.views.process_checkout_task.delay", process_checkout_task
+    )
+    checkout = orders_utils.checkout
+
+    def slow_checkout(user, shipping_address):
+        result = checkout(user, shipping_address)
+        fake_redis.delete(*fake_redis.keys("checkout:product:*"))
+        return result
+
+    monkeypatch.setattr("orders.utils.checkout", slow_checkout)
+    client, user = auth_client
+    cart_item_factory(user=user, product=sample_products["products"][0])
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.post(reverse("checkout"), {"address": "random-address"})
+
+    data = client.get(response.data["status_url"]).data
+    assert data["status"] == CheckoutJob.Status.SUCCEEDED
+    assert data["order_id"] == Order.objects.get(user=user).pk
+
+
+@pytest.mark.parametrize("ordered", [False, True])
+def test_requeue_stale_checkout_jobs(sample_active_user, order_factory, ordered):
+    """Jobs lost with their worker are queued again, or succeed with their order"""
+    job = CheckoutJob.objects.create(
+        user=sample_active_user,
+        shipping_address="random-address",
+        status=CheckoutJob.Status.PROCESSING,
+    )
+    running = CheckoutJob.objects.create(
+        user=sample_active_user,
+        shipping_address="random-address",
+        status=CheckoutJob.Status.PROCESSING,
+    )
+    order = order_factory("pending") if ordered else None
+    CheckoutJob.objects.filter(pk=job.pk).update(
+        updated_at=timezone.now() - CHECKOUT_JOB_TIMEOUT
+    )
+
+    requeued = requeue_stale_checkout_jobs()
+
+    job.refresh_from_db()
+    running.refresh_from_db()
+    assert running.status == CheckoutJob.Status.PROCESSING
+    if ordered:
+        assert requeued == []
+        assert job.status == CheckoutJob.Status.SUCCEEDED
+        assert job.order == order
+    else:
+        assert requeued == [job.pk]
+        assert job.status == CheckoutJob.Status.QUEUED
@@ -8,9 +8,19 @@ urlpatterns = [
         views.CheckoutAPIView.as_view(),
         name="checkout",
     ),
+    path(
+        "jobs/<uuid:job_id>/",
+        views.CheckoutJobAPIView.as_view(),
+        name="checkout-job",
+    ),
     path(
         "invoice/",
         views.InvoiceAPIView.as_view(),
         name="invoice-list",
     ),
+    path(
+        "invoice/<int:order_id>/items/",
+        views.InvoiceItemsAPIView.as_view(),
+        name="invoice-items",
+    ),
 ]
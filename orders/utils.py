@@ -1,32 +1,62 @@
-from collections import defaultdict
+from contextlib import ExitStack
 from datetime import timedelta
+from logging import getLogger
 
 from django.db import transaction
-from django.db.models import F
 from django.utils import timezone
+from redis.exceptions import RedisError
 from rest_framework import serializers
 
 from cart.models import CartItem
+from cart.store import get_cart_store
+from cart.utils import get_cart_items
+from core.deadlines import DeadlineQueue
+from core.redis_client import get_redis_client, mark_unavailable
+from core.transactions import atomic_with_retry
 from product.models import Product
 
-from .models import Order, OrderItem
+from . import flash_sale
+from .models import CheckoutJob, Order, OrderItem, StockReservation
+from .reservations import release_reservations, reserve_stock
 
+logger = getLogger(__name__)
 
-@transaction.atomic
+# Pending orders and their reservations live this long
+ORDER_EXPIRY = timedelta(minutes=30)
+
+# Orders expired per transaction
+EXPIRY_BATCH_SIZE = 500
+
+ORDER_DEADLINES = DeadlineQueue("orders")
+
+# Async checkout workers wait this long (seconds) for a per-product lock
+PRODUCT_LOCK_TIMEOUT = 30
+# and hold it at most this long, well past any checkout
+PRODUCT_LOCK_TTL = 300
+
+# Jobs processing longer than this were lost with their worker, queued again
+CHECKOUT_JOB_TIMEOUT = timedelta(minutes=5)
+
+
+class ProductBusy(Exception):
+    """A product lock was not acquired within PRODUCT_LOCK_TIMEOUT"""
+
+
+@atomic_with_retry("create_order")
 def create_order(
     user,
     shipping_address,
     cart_items,
 ):
     """
-    - Create order and order items
-    - Stock value deducted
+    - Stock reserved in one guarded statement, short items skipped
+    - Flash sale products admitted by the Redis counters instead, the admission
+      cancelled when this transaction fails and confirmed once committed
+    - Create order, order items and stock reservations
     - User cart deleted
+    Return order, order items and skipped product titles
     """
 
-    # Calculate discount
-    subtotal = sum(cart.product.discounted_price * cart.quantity for cart in cart_items)
-
     pending_order = Order.objects.filter(
         user=user,
         status=Order.Status.PENDING,
@@ -40,6 +70,54 @@ def create_order(
             }
         )
 
+    flash_ids = Product.flash_sale_ids([cart.product_id for cart in cart_items])
+    flash_items = [cart for cart in cart_items if cart.product_id in flash_ids]
+    admission = flash_sale.admission_token(user.pk, flash_items)
+    admitted = flash_sale.admit(admission, flash_items)
+    try:
+        order, order_items, skipped = _place_items(
+            user, shipping_address, cart_items, flash_ids, admitted
+        )
+    except BaseException:
+        # Rolled back: the counters give the units back, the retry admits again
+        if admitted:
+            flash_sale.cancel(admission)
+        raise
+    if admitted:
+        transaction.on_commit(lambda: flash_sale.confirm(admission))
+
+    return (
+        order,
+        order_items,
+        skipped,
+    )
+
+
+def _place_items(user, shipping_address, cart_items, flash_ids, admitted):
+    """
+    Reserve regular items, create order, order items and stock reservations
+    """
+    reserved = admitted | reserve_stock(
+        {
+            cart.product_id: cart.quantity
+            for cart in cart_items
+            if cart.product_id not in flash_ids
+        }
+    )
+    skipped = [
+        cart.product.title for cart in cart_items if cart.product_id not in reserved
+    ]
+    cart_items = [cart for cart in cart_items if cart.product_id in reserved]
+    if not cart_items:
+        raise serializers.ValidationError(
+            {
+                "out of stock": skipped,
+            }
+        )
+
+    # Calculate discount
+    subtotal = sum(cart.product.discounted_price * cart.quantity for cart in cart_items)
+
     order = Order.objects.create(
         user=user,
         shipping_address=shipping_address,
@@ -52,46 +130,250 @@ def create_order(
             product=cart.product,
             quantity=cart.quantity,
             price_at_purchase=cart.product.discounted_price,
+            list_price=cart.product.price,
         )
         for cart in cart_items
     ]
     OrderItem.objects.bulk_create(order_items)
+    StockReservation.objects.bulk_create(
+        [
+            StockReservation(
+                order=order,
+                product_id=cart.product_id,
+                quantity=cart.quantity,
+                expires_at=order.created_at + ORDER_EXPIRY,
+                flash_sale=cart.product_id in admitted,
+            )
+            for cart in cart_items
+        ]
+    )
+
+    # Clear ordered products from user cart
+    ordered_ids = [c.product_id for c in cart_items]
+    CartItem.objects.filter(user=user, product_id__in=ordered_ids).delete()
+    transaction.on_commit(lambda: get_cart_store(user).discard(ordered_ids))
+    transaction.on_commit(
+        lambda: ORDER_DEADLINES.schedule(order.id, order.created_at + ORDER_EXPIRY)
+    )
+
+    return order, order_items, skipped
+
+
+@atomic_with_retry("expire_orders")
+def expire_order_batch(batch_size=EXPIRY_BATCH_SIZE, order_ids=None):
+    """
+    Expire one batch of overdue pending orders and release their reservations
+    Rows locked by another worker are skipped, so workers share the backlog
+    """
+
+    overdue = Order.objects.filter(
+        status=Order.Status.PENDING,
+        created_at__lte=timezone.now() - ORDER_EXPIRY,
+    )
+    if order_ids is not None:
+        overdue = overdue.filter(id__in=order_ids)
+
+    expired_ids = list(
+        overdue.order_by("id")
+        .select_for_update(skip_locked=True)
+        .values_list("id", flat=True)[:batch_size]
+    )
 
-    # Deduct stock & clear user cart
-    for cart in cart_items:
-        Product.objects.filter(id=cart.product_id).update(
-            stock=F("stock") - cart.quantity
+    if not expired_ids:
+        return 0
+
+    Order.objects.filter(id__in=expired_ids).update(status=Order.Status.EXPIRED)
+    release_reservations(expired_ids)
+    return len(expired_ids)
+
+
+def expire_due_orders():
+    """
+    Expire exactly the orders whose deadline passed
+    Orders skipped here (locked, already settled) are left to the periodic sweep
+    """
+    due = ORDER_DEADLINES.pop_due(EXPIRY_BATCH_SIZE)
+    if not due:
+        return 0
+    try:
+        return expire_order_batch(len(due), order_ids=due)
+    except Exception:
+        ORDER_DEADLINES.retry(due)
+        raise
+
+
+def mark_pending_orders(batch_size=EXPIRY_BATCH_SIZE):
+    """
+    Expire overdue pending orders, one short transaction per batch until drained
+    Return the number of expired orders
+    """
+    total = 0
+    while True:
+        expired = expire_order_batch(batch_size)
+        total += expired
+        if expired < batch_size:
+            return total
+
+
+@atomic_with_retry("checkout")
+def place_order(user, shipping_address):
+    """
+    Lock the cart and create the order in one transaction, retried as a whole
+    """
+    cart_items, errors = get_cart_items(user=user)
+    if not cart_items:
+        raise serializers.ValidationError(
+            {
+                "out of stock": errors,
+            }
         )
-    CartItem.objects.filter(
-        user=user, product__in=[c.product for c in cart_items]
-    ).delete()
 
-    return (
-        order,
-        order_items,
+    return create_order(
+        user=user,
+        shipping_address=shipping_address,
+        cart_items=cart_items,
     )
 
 
-@transaction.atomic
-def mark_pending_orders():
+def checkout(user, shipping_address):
     """
-    Mark pending orders older than 30 minutes as expired and restore product stock safely
+    Turn the user cart into a pending order
+    Return the checkout response payload, raise ValidationError when nothing is ordered
     """
 
-    expired_orders = Order.objects.filter(
-        status=Order.Status.PENDING,
-        created_at__lt=timezone.now() - timedelta(minutes=30),
-    ).prefetch_related("order_items__product")
+    # Persist write-behind cart before reading rows
+    get_cart_store(user).flush()
+    order, order_items, skipped = place_order(user, shipping_address)
 
-    if not expired_orders.exists():
+    data = {
+        "result": "Order creation success",
+        "order_id": order.id,
+        "status": order.status,
+        "items": [
+            {
+                "id": item.product.id,
+                "product": item.product.title,
+                "quantity": item.quantity,
+                "price": item.price_at_purchase,
+            }
+            for item in order_items
+        ],
+    }
+    if skipped:
+        data["skipped_items"] = skipped
+    return data
+
+
+def product_locks(product_ids):
+    """
+    Serialize checkouts per product with Redis locks taken in id order
+    Without Redis the guarded stock statements alone keep checkout correct
+    Raise ProductBusy, with the locks taken so far released, on lock timeout
+    """
+    stack = ExitStack()
+    client = get_redis_client()
+    if client is None:
+        return stack
+
+    try:
+        for product_id in sorted(set(product_ids)):
+            lock = client.lock(
+                f"checkout:product:{product_id}",
+                timeout=PRODUCT_LOCK_TTL,
+                blocking_timeout=PRODUCT_LOCK_TIMEOUT,
+            )
+            if not lock.acquire():
+                stack.close()
+                raise ProductBusy(product_id)
+            stack.callback(release_lock, lock)
+    except RedisError as e:
+        mark_unavailable(e)
+    return stack
+
+
+def release_lock(lock):
+    """
+    Release after the checkout committed: an expired or unreachable lock is
+    logged, never turned into a failed checkout
+    """
+    try:
+        lock.release()
+    except RedisError as e:
+        logger.warning(f"Checkout lock {lock.name} not released: {e}")
+
+
+def process_checkout_job(job_id):
+    """
+    Run a queued checkout once, storing the outcome on the job
+    """
+    claimed = CheckoutJob.objects.filter(
+        pk=job_id,
+        status=CheckoutJob.Status.QUEUED,
+    ).update(status=CheckoutJob.Status.PROCESSING, updated_at=timezone.now())
+    if not claimed:
         return
 
-    expired_orders.update(status=Order.Status.EXPIRED)
+    job = CheckoutJob.objects.select_related("user").get(pk=job_id)
+    # Items still only in the Redis cart are locked too
+    get_cart_store(job.user).flush()
+    product_ids = CartItem.objects.filter(user=job.user).values_list(
+        "product_id", flat=True
+    )
+    try:
+        with product_locks(product_ids):
+            result = checkout(job.user, job.shipping_address)
+    except serializers.ValidationError as e:
+        job.status = CheckoutJob.Status.FAILED
+        job.result = e.detail
+    except ProductBusy:
+        job.status = CheckoutJob.Status.FAILED
+        job.result = {"detail": "Checkout busy, please try again"}
+    except Exception:
+        job.status = CheckoutJob.Status.FAILED
+        job.result = {"detail": "Checkout failed"}
+        job.save(update_fields=["status", "result", "updated_at"])
+        raise
+    else:
+        job.status = CheckoutJob.Status.SUCCEEDED
+        job.order_id = result["order_id"]
+        job.result = result
+    job.save(update_fields=["status", "result", "order", "updated_at"])
 
-    stock_changes = defaultdict(int)
-    for order in expired_orders:
-        for item in order.order_items.all():
-            stock_changes[item.product_id] += item.quantity
 
-    for product_id, qty in stock_changes.items():
-        Product.objects.filter(id=product_id).update(stock=F("stock") + qty)
+def requeue_stale_checkout_jobs():
+    """
+    Queue again jobs stuck in processing after a worker crash
+    Jobs whose checkout committed before the crash succeed with that order
+    Return ids of the jobs to process again
+    """
+    stale = CheckoutJob.objects.filter(
+        status=CheckoutJob.Status.PROCESSING,
+        updated_at__lte=timezone.now() - CHECKOUT_JOB_TIMEOUT,
+    )
+    requeued = []
+    for job in stale:
+        order = (
+            Order.objects.filter(user_id=job.user_id, created_at__gte=job.created_at)
+            .order_by("created_at")
+            .first()
+        )
+        update = {"status": CheckoutJob.Status.QUEUED}
+        if order is not None:
+            update = {
+                "status": CheckoutJob.Status.SUCCEEDED,
+                "order": order,
+                "result": {
+                    "result": "Order creation success",
+                    "order_id": order.id,
+                    "status": order.status,
+                },
+            }
+        # Claimed like a queued job, a worker finishing meanwhile keeps its outcome
+        claimed = CheckoutJob.objects.filter(
+            pk=job.pk,
+            status=CheckoutJob.Status.PROCESSING,
+            updated_at=job.updated_at,
+        ).update(**update, updated_at=timezone.now())
+        if claimed and order is None:
+            requeued.append(job.pk)
+    return requeued
@@ -1,15 +1,27 @@
+from django.conf import settings
 from django.db import transaction
+from django.db.models import Count
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from cart.utils import get_cart_items
+from idempotency.decorators import idempotent
 
-from .models import Order
-from .serializers import CheckoutSerializer, OrderSerializer
-from .utils import create_order
+from .models import CheckoutJob, Order
+from .pagination import InvoicePagination
+from .serializers import (
+    CheckoutJobSerializer,
+    CheckoutSerializer,
+    OrderItemSerializer,
+    OrderSerializer,
+    OrderSummarySerializer,
+)
+from .tasks import process_checkout_task
+from .utils import checkout
 
 
 class CheckoutAPIView(APIView):
@@ -18,9 +30,11 @@ class CheckoutAPIView(APIView):
 
     Functionality:
         1. Fetch user cart items
-        2. Compare cart item quantities against the stock
-        3. Create both order and order_item instances if validated
-        5. Deduct stock and clear user cart
+        2. Reserve available stock with one conditional update, short items skipped
+        3. Create order, order items and stock reservations
+        4. Clear ordered cart items
+    Reserved units are deducted on payment, released on failure or expiry
+    With CHECKOUT_MODE=async the checkout is queued for a worker (202 + job id)
     """
 
     serializer_class = CheckoutSerializer
@@ -29,9 +43,29 @@ class CheckoutAPIView(APIView):
         operation_summary="Start checkout process",
         operation_description="Fetch cart information and create an invoice",
         request_body=CheckoutSerializer(),
+        manual_parameters=[
+            openapi.Parameter(
+                "Idempotency-Key",
+                openapi.IN_HEADER,
+                type=openapi.TYPE_STRING,
+                required=False,
+                description="Retries with the same key replay the first response",
+            ),
+        ],
         responses={
             400: openapi.Response("Cart empty or out of stock"),
             401: openapi.Response("Unauthorized"),
+            202: openapi.Response(
+                description="Checkout queued (CHECKOUT_MODE=async)",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        "job_id": openapi.Schema(type=openapi.TYPE_STRING),
+                        "status": openapi.Schema(type=openapi.TYPE_STRING),
+                        "status_url": openapi.Schema(type=openapi.TYPE_STRING),
+                    },
+                ),
+            ),
             201: openapi.Response(
                 description="Order created",
                 schema=openapi.Schema(
@@ -40,6 +74,7 @@ class CheckoutAPIView(APIView):
                         "result": openapi.Schema(
                             type=openapi.TYPE_STRING, description="Success message"
                         ),
+                        "order_id": openapi.Schema(type=openapi.TYPE_INTEGER),
                         "status": openapi.Schema(
                             type=openapi.TYPE_STRING, description="Order status"
                         ),
@@ -68,67 +103,99 @@ class CheckoutAPIView(APIView):
         },
         tags=["Order"],
     )
-    @transaction.atomic
+    @idempotent("checkout")
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         shipping_address = serializer.validated_data["address"]
 
-        cart_items, errors = get_cart_items(user=request.user)
-
-        if not cart_items:
+        if settings.CHECKOUT_MODE == "async":
+            job = CheckoutJob.objects.create(
+                user=request.user,
+                shipping_address=shipping_address,
+            )
+            transaction.on_commit(lambda: process_checkout_task.delay(job.pk))
             return Response(
                 {
-                    "out of stock": errors,
+                    "job_id": job.job_id,
+                    "status": job.status,
+                    "status_url": reverse(
+                        "checkout-job", kwargs={"job_id": job.job_id}
+                    ),
                 },
-                status=status.HTTP_400_BAD_REQUEST,
+                status=status.HTTP_202_ACCEPTED,
             )
 
-        order, order_items = create_order(
-            user=request.user,
-            shipping_address=shipping_address,
-            cart_items=cart_items,
-        )
-        response_data = {
-            "result": "Order creation success",
-            "status": order.status,
-            "items": [
-                {
-                    "id": item.product.id,
-                    "product": item.product.title,
-                    "quantity": item.quantity,
-                    "price": item.price_at_purchase,
-                }
-                for item in order_items
-            ],
-        }
-        if errors:
-            response_data["skipped_items"] = errors
-
         return Response(
-            response_data,
+            checkout(request.user, shipping_address),
             status=status.HTTP_201_CREATED,
         )
 
 
+class CheckoutJobAPIView(generics.RetrieveAPIView):
+    """
+    Poll the status of a queued checkout
+    """
+
+    serializer_class = CheckoutJobSerializer
+    lookup_field = "job_id"
+
+    def get_queryset(self):
+        return CheckoutJob.objects.filter(user=self.request.user)
+
+    @swagger_auto_schema(
+        operation_summary="Checkout job status",
+        operation_description="Return the status of an async checkout and its result once processed",
+        responses={
+            200: CheckoutJobSerializer(),
+            401: openapi.Response(description="Unauthorized"),
+            404: openapi.Response(description="Job not found"),
+        },
+        tags=["Order"],
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
 class InvoiceAPIView(generics.ListAPIView):
     """
-    List user related orders and order items
+    List user related orders, cursor paginated
+        - Default: orders with their items and products
+        - ?summary=true: order headers with an item count, items fetched per order
     """
 
-    serializer_class = OrderSerializer
+    pagination_class = InvoicePagination
+
+    @property
+    def summary(self):
+        return self.request.query_params.get("summary", "").lower() in ("1", "true")
+
+    def get_serializer_class(self):
+        return OrderSummarySerializer if self.summary else OrderSerializer
 
     def get_queryset(self):
         """
-        Fetch OrderItem nested info relation including orders and products filtered by current authenticated user
+        Orders of the current authenticated user
+        Items prefetched for the requested page only, counted in SQL in summary mode
         """
-        order = Order.objects.filter(user=self.request.user)
-        qs = order.prefetch_related("order_items__product")
-        return qs
+        orders = Order.objects.filter(user=self.request.user)
+        if self.summary:
+            return orders.annotate(item_count=Count("order_items"))
+        return orders.prefetch_related("order_items__product")
 
     @swagger_auto_schema(
         operation_summary="List order invoice",
-        operation_description="Returns order invoice with detailed info",
+        operation_description="Returns a page of order invoices with detailed info, "
+        "or order headers with item counts in summary mode",
+        manual_parameters=[
+            openapi.Parameter(
+                "summary",
+                openapi.IN_QUERY,
+                type=openapi.TYPE_BOOLEAN,
+                required=False,
+                description="Return order headers with item counts instead of items",
+            ),
+        ],
         responses={
             200: OrderSerializer(many=True),
             401: openapi.Response(description="Unauthorized"),
@@ -137,3 +204,30 @@ class InvoiceAPIView(generics.ListAPIView):
     )
     def get(self, request, *args, **kwargs):
         return super().get(request, *args, **kwargs)
+
+
+class InvoiceItemsAPIView(generics.ListAPIView):
+    """
+    List items of one user order, expanded on demand from the summary listing
+    """
+
+    serializer_class = OrderItemSerializer
+
+    def get_queryset(self):
+        order = get_object_or_404(
+            Order, pk=self.kwargs["order_id"], user=self.request.user
+        )
+        return order.order_items.select_related("product")
+
+    @swagger_auto_schema(
+        operation_summary="List order items",
+        operation_description="Returns the items of an order with product info",
+        responses={
+            200: OrderItemSerializer(many=True),
+            401: openapi.Response(description="Unauthorized"),
+            404: openapi.Response(description="Order not found"),
+        },
+        tags=["Order"],
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
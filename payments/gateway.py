@@ -0,0 +1,299 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+from logging import getLogger
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+from core.transactions import backoff
+from monitoring.metrics import track_gateway_call
+
+load_dotenv()
+
+logger = getLogger(__name__)
+
+CONNECT_TIMEOUT = 2  # seconds
+READ_TIMEOUT = 5
+POOL_SIZE = 20  # kept-alive connections per process
+ASYNC_POOL_SIZE = 200  # per event loop, ASGI views share one loop per process
+VERIFY_ATTEMPTS = 3
+# Verify results meaning paid: verified now, or already verified before
+VERIFIED_RESULTS = (100, 201)
+FAILURE_THRESHOLD = 5  # consecutive failures opening the circuit
+RESET_TIMEOUT = 30  # seconds before a trial call is let through
+
+
+class GatewayError(Exception):
+    """Gateway unreachable or answering with an unusable response"""
+
+
+class GatewayUnavailable(GatewayError):
+    """Circuit open, the call was not attempted"""
+
+
+class CircuitBreaker:
+    """
+    Fail fast while the gateway is unhealthy
+        - closed: calls go through, consecutive failures counted
+        - open: after `threshold` failures, calls rejected for `reset_timeout` seconds
+        - half open: a single trial call, closing the circuit on success
+    State is kept per process
+    """
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "open" or self.trial:
+                return False
+            self.trial = True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def abandon(self):
+        """A call cancelled midway: neither outcome, the next caller gets the trial"""
+        with self.lock:
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            # A failed trial reopens the circuit straight away
+            if self.failures >= self.threshold or self.trial:
+                if self.opened_at is None:
+                    logger.warning(
+                        f"Payment gateway circuit opened after {self.failures} failures"
+                    )
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+
+class ZibalClient:
+    """
+    Zibal API over a pooled keep-alive session
+        - request_payment: single attempt, a retry could create a second payment
+        - verify: retried with backoff, verifying twice is harmless
+    Every attempt is timed in the gateway latency histogram
+    """
+
+    def __init__(
+        self,
+        request_url,
+        verify_url,
+        merchant,
+        callback_url,
+        breaker=None,
+        session=None,
+    ):
+        self.request_url = request_url
+        self.verify_url = verify_url
+        self.merchant = merchant
+        self.callback_url = callback_url
+        self.breaker = breaker or CircuitBreaker()
+        self.session = session or self.pooled_session()
+        self.async_clients = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            request_url=os.getenv("ZIBAL_PAYMENT_URL"),
+            verify_url=os.getenv("ZIBAL_VERIFY_PAYMENT"),
+            merchant=os.getenv("ZIBAL_MERCHANT", "zibal"),
+            callback_url=os.getenv("DOMAIN", "") + os.getenv("PAYMENT_CALLBACK", ""),
+        )
+
+    @staticmethod
+    def pooled_session():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def request_payload(self, amount):
+        return {
+            "merchant": self.merchant,
+            "amount": int(amount),
+            "callbackUrl": self.callback_url,
+        }
+
+    def verify_payload(self, track_id):
+        return {"merchant": self.merchant, "trackId": track_id}
+
+    def check_circuit(self):
+        if not self.breaker.allow():
+            raise GatewayUnavailable("Payment gateway temporarily unavailable")
+
+    def _post(self, operation, url, payload):
+        self.check_circuit()
+        try:
+            with track_gateway_call(operation):
+                response = self.session.post(
+                    url, json=payload, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+                )
+                if response.status_code >= 500:
+                    raise GatewayError(f"Gateway answered {response.status_code}")
+                data = response.json()
+        except (requests.RequestException, ValueError, GatewayError) as e:
+            self.breaker.failure()
+            raise GatewayError(str(e)) from e
+        except BaseException:
+            self.breaker.abandon()
+            raise
+        self.breaker.success()
+        return data
+
+    def request_payment(self, amount):
+        return self._post("request", self.request_url, self.request_payload(amount))
+
+    def verify(self, track_id):
+        for attempt in range(1, VERIFY_ATTEMPTS + 1):
+            try:
+                return self._post(
+                    "verify", self.verify_url, self.verify_payload(track_id)
+                )
+            except GatewayUnavailable:
+                raise
+            except GatewayError as e:
+                if attempt == VERIFY_ATTEMPTS:
+                    raise
+                logger.warning(f"Verify {track_id} retry {attempt}: {e}")
+                time.sleep(backoff(attempt))
+
+    def async_client(self):
+        """
+        AsyncZibalClient of the running event loop, sharing this client's
+        settings and circuit breaker (httpx pools are bound to one loop)
+        """
+        loop = asyncio.get_running_loop()
+        if loop not in self.async_clients:
+            self.async_clients[loop] = AsyncZibalClient(self)
+        return self.async_clients[loop]
+
+
+class AsyncZibalClient:
+    """
+    ZibalClient counterpart for async views, over a pooled httpx.AsyncClient
+    One event loop keeps hundreds of gateway round-trips in flight
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=ASYNC_POOL_SIZE,
+                max_keepalive_connections=ASYNC_POOL_SIZE,
+            ),
+        )
+
+    async def _post(self, operation, url, payload):
+        self.client.check_circuit()
+        try:
+            with track_gateway_call(operation):
+                response = await self.http.post(url, json=payload)
+                if response.status_code >= 500:
+                    raise GatewayError(f"Gateway answered {response.status_code}")
+                data = response.json()
+        except (httpx.HTTPError, ValueError, GatewayError) as e:
+            self.client.breaker.failure()
+            raise GatewayError(str(e)) from e
+        except BaseException:
+            # Cancelled with the client disconnect, the trial must not stay taken
+            self.client.breaker.abandon()
+            raise
+        self.client.breaker.success()
+        return data
+
+    async def request_payment(self, amount):
+        return await self._post(
+            "request", self.client.request_url, self.client.request_payload(amount)
+        )
+
+    async def verify(self, track_id):
+        for attempt in range(1, VERIFY_ATTEMPTS + 1):
+            try:
+                return await self._post(
+                    "verify",
+                    self.client.verify_url,
+                    self.client.verify_payload(track_id),
+                )
+            except GatewayUnavailable:
+                raise
+            except GatewayError as e:
+                if attempt == VERIFY_ATTEMPTS:
+                    raise
+                logger.warning(f"Verify {track_id} retry {attempt}: {e}")
+                await asyncio.sleep(backoff(attempt))
+
+
+class ThreadedZibalClient:
+    """
+    Async interface over the sync client, each call run in a worker thread
+    For event loops living a single request (async views served by WSGI), which
+    would otherwise leave one httpx pool behind per request
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    async def request_payment(self, amount):
+        return await sync_to_async(self.client.request_payment, thread_sensitive=False)(
+            amount
+        )
+
+    async def verify(self, track_id):
+        return await sync_to_async(self.client.verify, thread_sensitive=False)(track_id)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_gateway():
+    """Process wide client, sharing its connection pool and circuit breaker"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ZibalClient.from_env()
+    return _client
+
+
+def get_async_gateway():
+    """
+    Async client of the running event loop under ASGI_MODE, to be called from
+    coroutines; the sync client from a worker thread otherwise
+    """
+    if settings.ASGI_MODE:
+        return get_gateway().async_client()
+    return ThreadedZibalClient(get_gateway())
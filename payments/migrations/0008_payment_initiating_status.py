@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 13:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0007_payment_payment_status_created_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('initiating', 'Initiating'), ('pending', 'Pending'), ('expired', 'Expired'), ('success', 'Success'), ('failed', 'Failed')], default='pending', max_length=50, verbose_name='Status'),
+        ),
+    ]
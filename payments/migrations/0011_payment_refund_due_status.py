@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 13:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0010_payment_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('initiating', 'Initiating'), ('pending', 'Pending'), ('verifying', 'Verifying'), ('refund_due', 'Refund due'), ('expired', 'Expired'), ('success', 'Success'), ('failed', 'Failed')], default='pending', max_length=50, verbose_name='Status'),
+        ),
+    ]
@@ -1,15 +1,32 @@
+import json
+from logging import getLogger
+
 from django.conf import settings
-from django.db import models
+from django.db import connection, models, transaction
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from orders.models import Order
+from orders.reservations import (
+    commit_reservations,
+    release_reservations,
+    retake_stock,
+)
+from product import leaderboards
 from users.models import BaseModel
 
+logger = getLogger(__name__)
+
 
 class Payment(BaseModel):
     class Status(models.TextChoices):
+        # Reserved before the gateway call, no track id yet
+        INITIATING = "initiating", _("Initiating")
         PENDING = "pending", _("Pending")
+        # Claimed by the one caller verifying it with the gateway
+        VERIFYING = "verifying", _("Verifying")
+        # Paid after its order stopped waiting, stock could not be taken again
+        REFUND_DUE = "refund_due", _("Refund due")
         EXPIRED = "expired", _("Expired")
         SUCCESS = "success", _("Success")
         FAILED = "failed", _("Failed")
@@ -64,25 +81,185 @@ class Payment(BaseModel):
         ordering = ["-paid_at"]
         verbose_name = _("Payment")
         verbose_name_plural = _("Payments")
+        indexes = [
+            models.Index(
+                fields=["status", "created_at"], name="payment_status_created_idx"
+            ),
+            models.Index(fields=["order", "status"], name="payment_order_status_idx"),
+            # Payment history cursor pagination
+            models.Index(
+                fields=["user", "-created_at", "-id"],
+                name="payment_user_created_idx",
+            ),
+            # Expiry sweeps only scan pending payments (partial index where supported)
+            models.Index(
+                fields=["created_at"],
+                condition=models.Q(status="pending"),
+                name="payment_pending_created_idx",
+            ),
+        ]
 
+    @transaction.atomic
     def mark_success(self, response_data):
-        """Mark payment as successful"""
+        """
+        Mark payment & its pending order paid, from pending or verifying
+        A late payment (order expired, failed or paid by another payment) goes
+        through revive_order
+        Sales rollups count the order once, on its transition to paid
+        Return False when the payment was settled meanwhile
+        """
+        paid_at = timezone.now()
+        settled, newly_paid = settle(
+            self,
+            self.Status.SUCCESS,
+            response_data,
+            order_status=Order.Status.PAID,
+            order_from=[Order.Status.PENDING],
+            paid_at=paid_at,
+        )
+        if not settled:
+            return False
+
         self.status = self.Status.SUCCESS
         self.raw_response = response_data
-        self.paid_at = timezone.now()
-        self.save(update_fields=["status", "raw_response", "paid_at"])
-
+        self.paid_at = paid_at
+        if newly_paid:
+            commit_reservations([self.order_id])
+        elif not self.revive_order():
+            return True
         self.order.status = Order.Status.PAID
-        self.order.save(update_fields=["status"])
+        self.order.paid_at = paid_at
+        self.order_paid()
+        return True
+
+    def revive_order(self):
+        """
+        Order left pending before this payment succeeded: pay it when its
+        released stock can be taken again, flag the payment for refund otherwise
+        """
+        revived = Order.objects.select_for_update().filter(
+            pk=self.order_id, status__in=LATE_PAYABLE
+        ).exists() and retake_stock(self.order_id)
+        if revived:
+            Order.objects.filter(pk=self.order_id).update(
+                status=Order.Status.PAID,
+                paid_at=self.paid_at,
+                updated_at=timezone.now(),
+            )
+            return True
+
+        Payment.objects.filter(pk=self.pk).update(
+            status=self.Status.REFUND_DUE, updated_at=timezone.now()
+        )
+        self.status = self.Status.REFUND_DUE
+        logger.warning(f"Payment {self.track_id} succeeded late, refund due")
+        return False
+
+    def order_paid(self):
+        """Record the sale of a newly paid order"""
+        from reports.rollups import record_sales
+
+        record_sales([self.order_id])
+        items = list(
+            self.order.order_items.values_list(
+                "product_id", "product__category_id", "quantity"
+            )
+        )
+        transaction.on_commit(lambda: leaderboards.record_purchase(items))
 
+    @transaction.atomic
     def mark_failure(self, response_data):
-        """Mark payment as failure"""
+        """
+        Mark payment failed and its still pending order with it
+        Return False when the payment was settled meanwhile
+        """
+        settled, order_failed = settle(
+            self,
+            self.Status.FAILED,
+            response_data,
+            order_status=Order.Status.FAILED,
+            order_from=[Order.Status.PENDING],
+        )
+        if not settled:
+            return False
+
         self.status = self.Status.FAILED
         self.raw_response = response_data
-        self.save(update_fields=["status", "raw_response"])
-
-        self.order.status = Order.Status.FAILED
-        self.order.save(update_fields=["status"])
+        if order_failed:
+            self.order.status = Order.Status.FAILED
+            release_reservations([self.order_id])
+        return True
 
     def __str__(self):
         return f"Payment for {self.order}"
+
+
+# Payment states a verification result may settle
+SETTLEABLE = [Payment.Status.PENDING, Payment.Status.VERIFYING]
+# Orders a late payment may still revive
+LATE_PAYABLE = [Order.Status.EXPIRED, Order.Status.FAILED]
+
+SETTLE_SQL = """
+WITH payment AS (
+    UPDATE {payment}
+    SET status = %s, raw_response = %s::jsonb,
+        paid_at = COALESCE(%s, paid_at), updated_at = %s
+    WHERE id = %s AND status = ANY(%s)
+    RETURNING order_id
+), settled_order AS (
+    UPDATE {order}
+    SET status = %s, paid_at = COALESCE(%s, {order}.paid_at), updated_at = %s
+    FROM payment
+    WHERE {order}.id = payment.order_id AND {order}.status = ANY(%s)
+    RETURNING {order}.id
+)
+SELECT (SELECT count(*) FROM payment), (SELECT count(*) FROM settled_order)
+"""
+
+
+def settle(payment, status, response_data, order_status, order_from, paid_at=None):
+    """
+    Move a settleable payment to `status` and its order, when in `order_from`,
+    to `order_status`, both as conditional updates
+    One round-trip on PostgreSQL (data-modifying CTE), two elsewhere
+    Return (payment updated, order updated)
+    """
+    now = timezone.now()
+    if connection.vendor == "postgresql":
+        sql = SETTLE_SQL.format(
+            payment=connection.ops.quote_name(Payment._meta.db_table),
+            order=connection.ops.quote_name(Order._meta.db_table),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                sql,
+                [
+                    status,
+                    json.dumps(response_data),
+                    paid_at,
+                    now,
+                    payment.pk,
+                    SETTLEABLE,
+                    order_status,
+                    paid_at,
+                    now,
+                    order_from,
+                ],
+            )
+            payment_count, order_count = cursor.fetchone()
+        return bool(payment_count), bool(order_count)
+
+    fields = {"status": status, "raw_response": response_data, "updated_at": now}
+    if paid_at:
+        fields["paid_at"] = paid_at
+    if not Payment.objects.filter(pk=payment.pk, status__in=SETTLEABLE).update(
+        **fields
+    ):
+        return False, False
+    order_fields = {"status": order_status, "updated_at": now}
+    if paid_at:
+        order_fields["paid_at"] = paid_at
+    order_count = Order.objects.filter(
+        pk=payment.order_id, status__in=order_from
+    ).update(**order_fields)
+    return True, bool(order_count)
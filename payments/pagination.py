@@ -0,0 +1,10 @@
+from rest_framework.pagination import CursorPagination
+
+
+class PaymentHistoryPagination(CursorPagination):
+    """Keyset pages over (user, created_at), stable while new payments arrive"""
+
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = ("-created_at", "-id")
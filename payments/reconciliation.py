@@ -0,0 +1,161 @@
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from logging import getLogger
+
+from django.utils import timezone
+
+from core.transactions import atomic_with_retry
+from monitoring.metrics import RECONCILE_BATCH_DURATION, RECONCILED_PAYMENTS
+
+from .gateway import VERIFIED_RESULTS, GatewayError, GatewayUnavailable, get_gateway
+from .models import Payment
+from .utils import PAYMENT_EXPIRY
+
+logger = getLogger(__name__)
+
+# Pending payments without a callback for this long are verified by us
+RECONCILE_AFTER = timedelta(minutes=15)
+RECONCILE_BATCH_SIZE = 100
+# Concurrent verify calls, bounding the request rate we put on the gateway
+RECONCILE_WORKERS = 8
+
+
+def verify_all(payments, workers=RECONCILE_WORKERS):
+    """
+    Verify the payments concurrently on a bounded thread pool
+    Return {payment id: verify response, or the GatewayError raised}
+    Threads only talk to the gateway, the database stays on the caller's connection,
+    which renews the claims every `workers` results
+    """
+    gateway = get_gateway()
+
+    def verify(payment):
+        try:
+            return payment.id, gateway.verify(payment.track_id)
+        except GatewayError as e:
+            return payment.id, e
+
+    results = {}
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="reconcile"
+    ) as pool:
+        for payment_id, data in pool.map(verify, payments):
+            results[payment_id] = data
+            if len(results) % workers == 0:
+                renew_claims([payment.id for payment in payments])
+    return results
+
+
+def renew_claims(payment_ids):
+    """
+    Keep claimed payments out of release_stale_verifications: a whole batch may
+    take longer than VERIFICATION_TIMEOUT, a single verify does not
+    """
+    Payment.objects.filter(id__in=payment_ids, status=Payment.Status.VERIFYING).update(
+        updated_at=timezone.now()
+    )
+
+
+@atomic_with_retry("reconcile_payments")
+def claim_batch(payment_ids):
+    """
+    Claim the payments still pending (pending -> verifying), as a callback would
+    Rows locked by a concurrent run are left to it
+    Return the claimed payments
+    """
+    claimed = list(
+        Payment.objects.select_for_update(skip_locked=True)
+        .filter(id__in=payment_ids, status=Payment.Status.PENDING)
+        .only("id", "track_id")
+    )
+    Payment.objects.filter(id__in=[p.id for p in claimed]).update(
+        status=Payment.Status.VERIFYING, updated_at=timezone.now()
+    )
+    return claimed
+
+
+@atomic_with_retry("reconcile_payments")
+def settle_batch(results):
+    """
+    Apply verify results to the claimed payments, in one transaction
+    Gateway errors and payments not paid yet are handed back to pending, the
+    user may still pay until PAYMENT_EXPIRY
+    Return outcome counts, payments settled meanwhile counted as skipped
+    """
+    outcomes = Counter()
+    payable_since = timezone.now() - PAYMENT_EXPIRY
+    payments = Payment.objects.select_related("order").filter(
+        id__in=results, status=Payment.Status.VERIFYING
+    )
+    for payment in payments:
+        data = results[payment.id]
+        if isinstance(data, GatewayError):
+            Payment.objects.filter(pk=payment.pk).update(
+                status=Payment.Status.PENDING, updated_at=timezone.now()
+            )
+            outcomes["error"] += 1
+        elif data["result"] in VERIFIED_RESULTS:
+            if payment.mark_success(data):
+                outcomes[
+                    "refund_due"
+                    if payment.status == Payment.Status.REFUND_DUE
+                    else "success"
+                ] += 1
+        elif payment.created_at > payable_since:
+            Payment.objects.filter(pk=payment.pk).update(
+                status=Payment.Status.PENDING, updated_at=timezone.now()
+            )
+            outcomes["unpaid"] += 1
+        elif payment.mark_failure(data):
+            outcomes["failed"] += 1
+    return outcomes
+
+
+def reconcile_payments(batch_size=RECONCILE_BATCH_SIZE, workers=RECONCILE_WORKERS):
+    """
+    Verify stale pending payments against the gateway before they expire,
+    batch by batch in id order, claimed like a callback claims its payment
+        - success: payment & order marked paid, as the callback would
+        - not paid: left pending until PAYMENT_EXPIRY, then payment & order
+          marked failed
+        - gateway error: left pending for the next run
+    Stops early once the gateway circuit opens
+    Return outcome counts
+    """
+    stale = Payment.objects.filter(
+        status=Payment.Status.PENDING,
+        track_id__isnull=False,
+        created_at__lte=timezone.now() - RECONCILE_AFTER,
+    ).order_by("id")
+
+    totals = Counter()
+    last_id = 0
+    while True:
+        batch = list(
+            stale.filter(id__gt=last_id).values_list("id", flat=True)[:batch_size]
+        )
+        if not batch:
+            break
+
+        start = time.perf_counter()
+        claimed = claim_batch(batch)
+        results = verify_all(claimed, workers)
+        outcomes = settle_batch(results)
+        outcomes["skipped"] = len(batch) - sum(outcomes.values())
+        RECONCILE_BATCH_DURATION.observe(time.perf_counter() - start)
+        for outcome, count in outcomes.items():
+            RECONCILED_PAYMENTS.labels(outcome=outcome).inc(count)
+        totals.update(outcomes)
+
+        last_id = batch[-1]
+        if any(isinstance(data, GatewayUnavailable) for data in results.values()):
+            logger.warning("Payment reconciliation stopped, gateway circuit open")
+            break
+        if len(batch) < batch_size:
+            break
+
+    if totals:
+        logger.info(f"Payments reconciled: {dict(totals)}")
+    return totals
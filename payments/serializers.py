@@ -1,18 +1,37 @@
+from django.urls import reverse
 from rest_framework import serializers
 
-from orders.serializers import OrderSerializer
-
 from .models import Payment
 
 
+class PaymentOrderSummarySerializer(serializers.Serializer):
+    """Order summary read from the fields annotated on the payment row"""
+
+    id = serializers.IntegerField(source="order_id")
+    status = serializers.CharField(source="order_status")
+    total = serializers.ReadOnlyField(source="order_total")
+    item_count = serializers.IntegerField(source="order_item_count")
+    items_url = serializers.SerializerMethodField()
+
+    def get_items_url(self, obj):
+        request = self.context.get("request")
+        url = reverse("invoice-items", kwargs={"order_id": obj.order_id})
+        return request.build_absolute_uri(url) if request else url
+
+
 class PaymentSerializer(serializers.ModelSerializer):
-    order = OrderSerializer(many=True)
+    order = PaymentOrderSummarySerializer(source="*", read_only=True)
+
+    created_at = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S")
 
     class Meta:
         model = Payment
         fields = [
-            "order",
+            "id",
             "track_id",
             "amount",
             "status",
+            "paid_at",
+            "created_at",
+            "order",
         ]
@@ -1,8 +1,34 @@
 from celery import shared_task
 
-from .utils import expired_payments
+from .reconciliation import reconcile_payments
+from .utils import (
+    expire_due_payments,
+    expire_stale_initiations,
+    expired_payments,
+    release_stale_verifications,
+)
 
 
 @shared_task
 def expired_payments_task():
     expired_payments()
+
+
+@shared_task
+def expire_due_payments_task():
+    expire_due_payments()
+
+
+@shared_task
+def expire_stale_initiations_task():
+    expire_stale_initiations()
+
+
+@shared_task
+def release_stale_verifications_task():
+    release_stale_verifications()
+
+
+@shared_task
+def reconcile_payments_task():
+    reconcile_payments()
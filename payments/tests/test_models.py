@@ -1,3 +1,28 @@
+import pytest
+from django.db import connection
+from django.utils import timezone
+
+from orders.models import Order, StockReservation
+from orders.reservations import release_reservations, reserve_stock
+from payments.models import Payment, settle
+from payments.reconciliation import RECONCILE_AFTER, reconcile_payments, verify_all
+from payments.utils import (
+    PAYMENT_EXPIRY,
+    VERIFICATION_TIMEOUT,
+    expired_payments,
+    release_stale_verifications,
+)
+from product.models import Product
+
+
+def stale_payment(order, track_id, age=RECONCILE_AFTER):
+    payment = Payment.objects.create(
+        order=order, user=order.user, track_id=track_id, amount=10
+    )
+    Payment.objects.filter(pk=payment.pk).update(created_at=timezone.now() - age)
+    return payment
+
+
 def test_payment_model(
     sample_payment,
     sample_active_user,
@@ -5,3 +30,193 @@ def test_payment_model(
 ):
     assert sample_payment.user == sample_active_user
     assert str(sample_payment) == f"Payment for {sample_order}"
+
+
+def test_expiry_sweep_uses_index(assert_uses_index, sample_payment):
+    with assert_uses_index("payments_payment"):
+        expired_payments()
+
+
+def test_reconcile_stale_payments(gateway_stub, order_factory):
+    stale = [stale_payment(order_factory(), f"40{index}") for index in range(5)]
+    fresh = stale_payment(order_factory(), "499", age=RECONCILE_AFTER / 2)
+
+    outcomes = reconcile_payments(batch_size=2)
+
+    assert outcomes == {"success": 5, "skipped": 0}
+    assert sorted(body["trackId"] for _, body in gateway_stub.requests) == [
+        p.track_id for p in stale
+    ]
+    assert set(
+        Order.objects.filter(order_payments__in=stale).values_list("status", flat=True)
+    ) == {Order.Status.PAID}
+    fresh.refresh_from_db()
+    assert fresh.status == Payment.Status.PENDING
+
+
+def test_reconcile_outcomes(gateway_stub, order_factory):
+    stale_payment(order_factory(), "501")
+    unpaid = stale_payment(order_factory(), "502", age=PAYMENT_EXPIRY)
+    stale_payment(order_factory(), "503")
+    gateway_stub.reply({"result": 100})
+    gateway_stub.reply({"result": 202, "message": "Not paid"})
+    gateway_stub.reply({}, status=503, times=3)
+
+    outcomes = reconcile_payments(workers=1)
+
+    assert outcomes == {"success": 1, "failed": 1, "error": 1, "skipped": 0}
+    statuses = dict(Payment.objects.values_list("track_id", "status"))
+    assert statuses == {
+        "501": Payment.Status.SUCCESS,
+        "502": Payment.Status.FAILED,
+        "503": Payment.Status.PENDING,
+    }
+    unpaid.order.refresh_from_db()
+    assert unpaid.order.status == Order.Status.FAILED
+
+
+def test_reconcile_unpaid_payment_left_payable(gateway_stub, order_factory):
+    """Not paid at 15 minutes, paid later: the payment is still there to succeed"""
+    payment = stale_payment(order_factory(), "601")
+    gateway_stub.reply({"result": 202, "message": "Not paid"})
+
+    assert reconcile_payments() == {"unpaid": 1, "skipped": 0}
+    payment.refresh_from_db()
+    payment.order.refresh_from_db()
+    assert payment.status == Payment.Status.PENDING
+    assert payment.order.status == Order.Status.PENDING
+
+    assert reconcile_payments() == {"success": 1, "skipped": 0}
+    payment.refresh_from_db()
+    payment.order.refresh_from_db()
+    assert payment.status == Payment.Status.SUCCESS
+    assert payment.order.status == Order.Status.PAID
+
+
+def test_reconcile_renews_claims(gateway_stub, order_factory):
+    """Payments verifying in a long batch are not released mid-verify"""
+    payments = [stale_payment(order_factory(), f"70{index}") for index in range(2)]
+    Payment.objects.update(
+        status=Payment.Status.VERIFYING,
+        updated_at=timezone.now() - VERIFICATION_TIMEOUT,
+    )
+
+    results = verify_all(payments, workers=1)
+
+    assert set(results) == {p.id for p in payments}
+    assert release_stale_verifications() == 0
+
+
+@pytest.mark.skipif(
+    connection.vendor != "postgresql", reason="Single statement settle on PostgreSQL"
+)
+def test_settle_single_statement(sample_payment):
+    paid_at = timezone.now()
+    settled = settle(
+        sample_payment,
+        Payment.Status.SUCCESS,
+        {"result": 100},
+        Order.Status.PAID,
+        [Order.Status.PENDING],
+        paid_at=paid_at,
+    )
+
+    assert settled == (True, True)
+    sample_payment.refresh_from_db()
+    sample_payment.order.refresh_from_db()
+    assert (sample_payment.status, sample_payment.paid_at) == (
+        Payment.Status.SUCCESS,
+        paid_at,
+    )
+    assert sample_payment.raw_response == {"result": 100}
+    assert sample_payment.order.status == Order.Status.PAID
+    assert settle(
+        sample_payment,
+        Payment.Status.FAILED,
+        {},
+        Order.Status.FAILED,
+        [Order.Status.PENDING],
+    ) == (False, False)
+
+
+def test_settled_payment_not_settled_again(sample_payment):
+    assert sample_payment.mark_failure({"result": 202})
+    assert not sample_payment.mark_success({"result": 100})
+
+    sample_payment.refresh_from_db()
+    sample_payment.order.refresh_from_db()
+    assert sample_payment.status == Payment.Status.FAILED
+    assert sample_payment.order.status == Order.Status.FAILED
+
+
+def test_stale_verification_released(sample_payment):
+    Payment.objects.filter(pk=sample_payment.pk).update(
+        status=Payment.Status.VERIFYING,
+        updated_at=timezone.now() - VERIFICATION_TIMEOUT,
+    )
+
+    assert release_stale_verifications() == 1
+    sample_payment.refresh_from_db()
+    assert sample_payment.status == Payment.Status.PENDING
+
+
+@pytest.fixture
+def released_order(sample_products, sample_payment):
+    """Pending payment whose order expired, its 2 reserved units given back"""
+    product = sample_products["products"][0]
+    reserve_stock({product.id: 2})
+    StockReservation.objects.create(
+        order=sample_payment.order,
+        product=product,
+        quantity=2,
+        expires_at=timezone.now(),
+    )
+    Order.objects.filter(pk=sample_payment.order_id).update(status=Order.Status.EXPIRED)
+    release_reservations([sample_payment.order_id])
+    sample_payment.order.refresh_from_db()
+    return product
+
+
+def test_late_payment_retakes_stock(sample_payment, released_order):
+    product = released_order
+
+    assert sample_payment.mark_success({"result": 100})
+
+    sample_payment.refresh_from_db()
+    sample_payment.order.refresh_from_db()
+    product.refresh_from_db()
+    assert sample_payment.status == Payment.Status.SUCCESS
+    assert sample_payment.order.status == Order.Status.PAID
+    assert (product.stock, product.reserved) == (3, 0)
+    assert StockReservation.objects.get().status == StockReservation.Status.COMMITTED
+
+
+def test_late_payment_without_stock_refund_due(sample_payment, released_order):
+    product = released_order
+    # Units sold to someone else meanwhile
+    Product.objects.filter(pk=product.pk).update(reserved=4)
+
+    assert sample_payment.mark_success({"result": 100})
+
+    sample_payment.refresh_from_db()
+    sample_payment.order.refresh_from_db()
+    product.refresh_from_db()
+    assert sample_payment.status == Payment.Status.REFUND_DUE
+    assert sample_payment.order.status == Order.Status.EXPIRED
+    assert (product.stock, product.reserved) == (5, 4)
+    assert StockReservation.objects.get().status == StockReservation.Status.RELEASED
+
+
+def test_second_payment_of_paid_order_refund_due(sample_payment):
+    assert sample_payment.mark_success({"result": 100})
+    second = Payment.objects.create(
+        order=sample_payment.order,
+        user=sample_payment.user,
+        track_id="700",
+        amount=10,
+    )
+
+    assert second.mark_success({"result": 100})
+
+    second.refresh_from_db()
+    assert second.status == Payment.Status.REFUND_DUE
@@ -1,10 +1,16 @@
-from unittest.mock import patch
+import asyncio
 
-import requests
+import httpx
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.handlers.asgi import ASGIHandler
 from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
 
 from orders.models import Order
 from payments.models import Payment
+from payments.utils import INITIATION_TIMEOUT, expire_stale_initiations
 
 
 def test_no_pending_order(auth_client):
@@ -15,29 +21,89 @@ def test_no_pending_order(auth_client):
     assert response.status_code == 400
 
 
-@patch("payments.views.requests.post")
 def test_create_new_payment(
-    mock_post,
+    gateway_stub,
     auth_client,
     sample_order,
 ):
     client, _ = auth_client
     url = reverse("create-payment")
-    mock_post.return_value.json.return_value = {
-        "result": 100,
-        "trackId": "FAKE_TRACK_ID",
-        "message": "Success",
-    }
+    gateway_stub.reply(
+        {
+            "result": 100,
+            "trackId": "FAKE_TRACK_ID",
+            "message": "Success",
+        }
+    )
     response = client.post(url)
 
     assert response.status_code == 200
     assert response.data["trackId"] == "FAKE_TRACK_ID"
-    assert Payment.objects.filter(order=sample_order, track_id="FAKE_TRACK_ID").exists()
+    payment = Payment.objects.get(order=sample_order)
+    assert payment.track_id == "FAKE_TRACK_ID"
+    assert payment.status == Payment.Status.PENDING
+    assert gateway_stub.requests == [
+        (
+            "/request",
+            {
+                "merchant": "zibal",
+                "amount": int(sample_order.total_amount),
+                "callbackUrl": "http://testserver/api/v1/payments/callback/",
+            },
+        )
+    ]
+
+
+def test_create_payment_not_retried(gateway_stub, auth_client, sample_order):
+    client, _ = auth_client
+    gateway_stub.reply({"detail": "unavailable"}, status=503)
+
+    response = client.post(reverse("create-payment"))
+
+    assert response.status_code == 502
+    assert len(gateway_stub.requests) == 1
+    assert not Payment.objects.filter(order=sample_order).exists()
+
+
+def test_initiation_in_progress(gateway_stub, auth_client, sample_order):
+    client, user = auth_client
+    Payment.objects.create(
+        order=sample_order,
+        user=user,
+        amount=sample_order.total_amount,
+        status=Payment.Status.INITIATING,
+    )
+
+    response = client.post(reverse("create-payment"))
+
+    assert response.status_code == 409
+    assert gateway_stub.requests == []
+
+
+def test_stale_initiation_swept(gateway_stub, auth_client, sample_order):
+    client, user = auth_client
+    payment = Payment.objects.create(
+        order=sample_order,
+        user=user,
+        amount=sample_order.total_amount,
+        status=Payment.Status.INITIATING,
+    )
+    Payment.objects.filter(pk=payment.pk).update(
+        created_at=timezone.now() - INITIATION_TIMEOUT
+    )
+    gateway_stub.reply({"result": 100, "trackId": "AFTER_CRASH", "message": "Ok"})
+
+    assert expire_stale_initiations() == 1
+    response = client.post(reverse("create-payment"))
+
+    assert response.status_code == 200
+    payment.refresh_from_db()
+    assert payment.status == Payment.Status.EXPIRED
+    assert Payment.objects.get(track_id="AFTER_CRASH").status == Payment.Status.PENDING
 
 
-@patch("payments.views.requests.post")
 def test_existing_payment_returned(
-    mock_post,
+    gateway_stub,
     auth_client,
     sample_order,
     sample_payment,
@@ -49,6 +115,7 @@ def test_existing_payment_returned(
     assert response.status_code == 200
     assert "Already initiated payment" in response.data["message"]
     assert Payment.objects.filter(order=sample_order).count() == 1
+    assert gateway_stub.requests == []
 
 
 def test_callback_without_track_id(auth_client):
@@ -72,9 +139,8 @@ def test_callback_payment_not_found(auth_client):
     assert "No payment record found" in response.data["detail"]
 
 
-@patch("payments.views.requests.post")
 def test_callback_success(
-    mock_post,
+    gateway_stub,
     auth_client,
     sample_order,
     sample_payment,
@@ -83,7 +149,7 @@ def test_callback_success(
     order = sample_order
     client, _ = auth_client
     url = reverse("payment-callback")
-    mock_post.return_value.json.return_value = {"result": 100}
+    gateway_stub.reply({"result": 100})
     response = client.get(
         url,
         {
@@ -98,15 +164,14 @@ def test_callback_success(
     assert "Payment was successful" in response.data["detail"]
 
 
-@patch("payments.views.requests.post")
 def test_callback_previously_verified(
-    mock_post, auth_client, sample_payment, sample_order
+    gateway_stub, auth_client, sample_payment, sample_order
 ):
     order = sample_order
     payment = sample_payment
     client, _ = auth_client
     url = reverse("payment-callback")
-    mock_post.return_value.json.return_value = {"result": 201}
+    gateway_stub.reply({"result": 201})
     response = client.get(
         url,
         {
@@ -121,16 +186,19 @@ def test_callback_previously_verified(
     assert "success" in response.data["detail"]
 
 
-@patch("payments.views.requests.post")
-def test_callback_failed_payment(mock_post, auth_client, sample_order, sample_payment):
+def test_callback_failed_payment(
+    gateway_stub, auth_client, sample_order, sample_payment
+):
     order = sample_order
     payment = sample_payment
     client, _ = auth_client
     url = reverse("payment-callback")
-    mock_post.return_value.json.return_value = {
-        "result": -1,
-        "message": "Insufficient funds",
-    }
+    gateway_stub.reply(
+        {
+            "result": -1,
+            "message": "Insufficient funds",
+        }
+    )
     response = client.get(
         url,
         {
@@ -142,18 +210,15 @@ def test_callback_failed_payment(mock_post, auth_client, sample_order, sample_pa
     assert payment.status == Payment.Status.FAILED
 
 
-@patch(
-    "payments.views.requests.post",
-    side_effect=requests.RequestException("Gateway down"),
-)
 def test_callback_gateway_error(
-    mock_post,
+    gateway_stub,
     auth_client,
     sample_order,
     sample_payment,
 ):
     client, _ = auth_client
     url = reverse("payment-callback")
+    gateway_stub.reply({"detail": "Gateway down"}, status=503, times=3)
     response = client.get(
         url,
         {
@@ -161,10 +226,249 @@ def test_callback_gateway_error(
         },
     )
     assert response.status_code == 502
+    # Verification is idempotent, retried before giving up
+    assert len(gateway_stub.requests) == 3
+    # Claim handed back, the next callback verifies again
+    sample_payment.refresh_from_db()
+    assert sample_payment.status == Payment.Status.PENDING
 
 
-def test_payment_history(auth_client):
+def test_callback_late_payment_refund_due(
+    gateway_stub, auth_client, sample_payment, sample_order
+):
     client, _ = auth_client
-    url = reverse("payment-history")
-    response = client.get(url)
+    Order.objects.filter(pk=sample_order.pk).update(status=Order.Status.PAID)
+
+    response = client.get(
+        reverse("payment-callback"), {"trackId": sample_payment.track_id}
+    )
+
+    assert response.status_code == 409
+    assert "refunded" in response.data["detail"]
+
+
+def test_callback_expired_payment(auth_client, sample_payment):
+    client, _ = auth_client
+    Payment.objects.filter(pk=sample_payment.pk).update(status=Payment.Status.EXPIRED)
+
+    response = client.get(
+        reverse("payment-callback"), {"trackId": sample_payment.track_id}
+    )
+
+    assert response.status_code == 400
+    assert response.data["detail"] == "Payment expired"
+
+
+def test_callback_after_success_not_reverified(
+    gateway_stub, auth_client, sample_payment
+):
+    client, _ = auth_client
+    url = reverse("payment-callback")
+
+    first = client.get(url, {"trackId": sample_payment.track_id})
+    second = client.get(url, {"trackId": sample_payment.track_id})
+
+    assert first.status_code == second.status_code == 200
+    assert second.data["detail"] == "Payment was successful"
+    assert len(gateway_stub.requests) == 1
+
+
+def test_callback_verify_retry_succeeds(gateway_stub, auth_client, sample_payment):
+    client, _ = auth_client
+    gateway_stub.reply({"detail": "Gateway down"}, status=502)
+    gateway_stub.reply({"result": 100})
+
+    response = client.get(
+        reverse("payment-callback"), {"trackId": sample_payment.track_id}
+    )
+
+    assert response.status_code == 200
+    assert len(gateway_stub.requests) == 2
+
+
+def test_gateway_circuit_opens(gateway_stub, auth_client, sample_payment):
+    client, _ = auth_client
+    url = reverse("payment-callback")
+    gateway_stub.reply({"detail": "Gateway down"}, status=503, times=3)
+
+    failed = client.get(url, {"trackId": sample_payment.track_id})
+    rejected = client.get(url, {"trackId": sample_payment.track_id})
+
+    assert failed.status_code == 502
+    assert rejected.status_code == 503
+    assert gateway_stub.client.breaker.state == "open"
+    assert len(gateway_stub.requests) == 3
+
+
+def test_payment_history(
+    auth_client,
+    sample_products,
+    order_factory,
+    order_item_factory,
+    django_assert_num_queries,
+):
+    client, user = auth_client
+    payments = []
+    for index in range(3):
+        order = order_factory()
+        for product in sample_products["products"][:2]:
+            order_item_factory(order=order, product=product, price=product.price)
+        payments.append(
+            Payment.objects.create(
+                order=order, user=user, track_id=f"60{index}", amount=10
+            )
+        )
+
+    # Page of payments with their order summaries in one query, after auth
+    with django_assert_num_queries(1):
+        first = client.get(reverse("payment-history"), {"page_size": 2}).json()
+    second = client.get(first["next"]).json()
+
+    assert [p["id"] for p in first["results"] + second["results"]] == [
+        p.id for p in reversed(payments)
+    ]
+    assert second["next"] is None
+    summary = first["results"][0]["order"]
+    assert summary["id"] == payments[-1].order_id
+    assert summary["status"] == Order.Status.PENDING
+    assert summary["item_count"] == 2
+
+    items = client.get(summary["items_url"])
+
+    assert items.status_code == 200
+    assert len(items.json()) == 2
+
+
+def test_gateway_circuit_half_open_trial(gateway_stub, auth_client, sample_payment):
+    client, _ = auth_client
+    breaker = gateway_stub.client.breaker
+    for _ in range(breaker.threshold):
+        breaker.failure()
+    breaker.opened_at -= breaker.reset_timeout
+
+    response = client.get(
+        reverse("payment-callback"), {"trackId": sample_payment.track_id}
+    )
+
     assert response.status_code == 200
+    assert breaker.state == "closed"
+
+
+def test_gateway_cancelled_trial_released(gateway_stub):
+    """A trial call cancelled by a client disconnect lets the next call try"""
+    breaker = gateway_stub.client.breaker
+    for _ in range(breaker.threshold):
+        breaker.failure()
+    breaker.opened_at -= breaker.reset_timeout
+    gateway_stub.delay = 1
+
+    async def cancelled_verify():
+        call = asyncio.ensure_future(gateway_stub.client.async_client().verify("1"))
+        await asyncio.sleep(0.2)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+
+    async_to_sync(cancelled_verify)()
+
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def test_callback_outside_asgi_uses_sync_client(gateway_stub, sample_payment):
+    """A throwaway event loop per request gets no httpx pool of its own"""
+    response = APIClient().get(
+        reverse("payment-callback"), {"trackId": sample_payment.track_id}
+    )
+
+    assert response.status_code == 200
+    assert [path for path, _ in gateway_stub.requests] == ["/verify"]
+    assert not gateway_stub.client.async_clients
+
+
+def asgi_callbacks(track_ids):
+    """Send the callbacks concurrently through the ASGI handler"""
+
+    async def callbacks():
+        transport = httpx.ASGITransport(app=ASGIHandler())
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://testserver"
+        ) as client:
+            return await asyncio.gather(
+                *[
+                    client.get(reverse("payment-callback"), params={"trackId": t})
+                    for t in track_ids
+                ]
+            )
+
+    return async_to_sync(callbacks)()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_callbacks_concurrent_under_asgi(gateway_stub, sample_active_user, settings):
+    # Mirrors ASGI_MODE, a sync middleware would serialize the async views
+    settings.ASGI_MODE = True
+    settings.MIDDLEWARE = [m for m in settings.MIDDLEWARE if "whitenoise" not in m]
+    payments = [
+        Payment.objects.create(
+            order=Order.objects.create(
+                user=sample_active_user, shipping_address="-", total_amount=10
+            ),
+            user=sample_active_user,
+            track_id=f"30{index}",
+            amount=10,
+        )
+        for index in range(5)
+    ]
+    gateway_stub.delay = 1
+
+    responses = asgi_callbacks([p.track_id for p in payments])
+
+    assert [r.status_code for r in responses] == [200] * 5
+    # One at a time when serialized
+    assert gateway_stub.max_in_flight == 5
+    assert not Payment.objects.exclude(status=Payment.Status.SUCCESS).exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_duplicate_callbacks_verified_once(gateway_stub, sample_payment, settings):
+    settings.ASGI_MODE = True
+    settings.MIDDLEWARE = [m for m in settings.MIDDLEWARE if "whitenoise" not in m]
+    gateway_stub.delay = 0.5
+
+    responses = asgi_callbacks([sample_payment.track_id] * 4)
+
+    assert [r.status_code for r in responses] == [200] * 4
+    assert len(gateway_stub.requests) == 1
+    sample_payment.refresh_from_db()
+    assert sample_payment.status == Payment.Status.SUCCESS
+
+
+def test_payment_queries_use_index(
+    assert_uses_index, gateway_stub, auth_client, sample_order
+):
+    """Pending order and payment lookups of the payment request, then history"""
+    client, _ = auth_client
+    gateway_stub.reply({"result": 100, "trackId": "FAKE_TRACK_ID", "message": ""})
+
+    with assert_uses_index("payments_payment"), assert_uses_index("orders_order"):
+        assert client.post(reverse("create-payment")).status_code == 200
+    with assert_uses_index("payments_payment"):
+        assert client.get(reverse("payment-history")).status_code == 200
+
+
+@pytest.mark.django_db(transaction=True)
+def test_duplicate_callbacks_after_gateway_error(
+    gateway_stub, sample_payment, settings
+):
+    settings.ASGI_MODE = True
+    settings.MIDDLEWARE = [m for m in settings.MIDDLEWARE if "whitenoise" not in m]
+    gateway_stub.delay = 0.3
+    gateway_stub.reply({"detail": "Gateway down"}, status=503, times=3)
+
+    responses = asgi_callbacks([sample_payment.track_id] * 3)
+
+    # Waiters see the claim handed back, retryable rather than not found
+    assert sorted(r.status_code for r in responses) == [409, 409, 502]
+    sample_payment.refresh_from_db()
+    assert sample_payment.status == Payment.Status.PENDING
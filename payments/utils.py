@@ -3,17 +3,80 @@ from datetime import timedelta
 from django.db import transaction
 from django.utils import timezone
 
+from core.deadlines import DeadlineQueue
+
 from .models import Payment
 
+# Pending payments live this long
+PAYMENT_EXPIRY = timedelta(minutes=30)
+# Initiating payments older than this were interrupted between the
+# reservation and recording the track id (worker crash or restart)
+INITIATION_TIMEOUT = timedelta(minutes=2)
+# Duplicate callbacks wait this long (seconds) for the claimed verification
+VERIFY_WAIT_TIMEOUT = 20
+VERIFY_POLL_INTERVAL = 0.2
+# Verifying payments older than this lost their verifier (worker crash or restart)
+VERIFICATION_TIMEOUT = timedelta(minutes=2)
+
+PAYMENT_DEADLINES = DeadlineQueue("payments")
+
+
+def schedule_payment_expiry(payment):
+    """Register the expiry deadline once the payment is committed"""
+    transaction.on_commit(
+        lambda: PAYMENT_DEADLINES.schedule(
+            payment.id, payment.created_at + PAYMENT_EXPIRY
+        )
+    )
+
 
 @transaction.atomic
-def expired_payments():
+def expired_payments(payment_ids=None):
+    """
+    Expire overdue pending payments, limited to the given ids when passed
+    Return the number of expired payments
+    """
     pending_payments = Payment.objects.filter(
         status=Payment.Status.PENDING,
-        created_at__lt=timezone.now() - timedelta(minutes=30),
+        created_at__lte=timezone.now() - PAYMENT_EXPIRY,
     )
+    if payment_ids is not None:
+        pending_payments = pending_payments.filter(id__in=payment_ids)
+
+    return pending_payments.update(status=Payment.Status.EXPIRED)
+
+
+def expire_due_payments():
+    """
+    Expire exactly the payments whose deadline passed
+    """
+    due = PAYMENT_DEADLINES.pop_due()
+    if not due:
+        return 0
+    try:
+        return expired_payments(due)
+    except Exception:
+        PAYMENT_DEADLINES.retry(due)
+        raise
+
+
+def expire_stale_initiations():
+    """
+    Expire payments stuck in initiating so the order can request a new one
+    Return the number of expired payments
+    """
+    return Payment.objects.filter(
+        status=Payment.Status.INITIATING,
+        created_at__lte=timezone.now() - INITIATION_TIMEOUT,
+    ).update(status=Payment.Status.EXPIRED, updated_at=timezone.now())
 
-    if not pending_payments.exists():
-        return
 
-    pending_payments.update(status=Payment.Status.EXPIRED)
+def release_stale_verifications():
+    """
+    Hand payments stuck in verifying back to pending, to be verified again
+    Return the number of released payments
+    """
+    return Payment.objects.filter(
+        status=Payment.Status.VERIFYING,
+        updated_at__lte=timezone.now() - VERIFICATION_TIMEOUT,
+    ).update(status=Payment.Status.PENDING, updated_at=timezone.now())
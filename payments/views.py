@@ -1,33 +1,67 @@
+import asyncio
 import os
+import time
 from logging import getLogger
 
-import requests
+from asgiref.sync import sync_to_async
 from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
 from dotenv import load_dotenv
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
-from rest_framework.views import APIView
 
+from core.views import AsyncAPIView
+from idempotency.decorators import idempotent
 from orders.models import Order
 
+from .gateway import (
+    VERIFIED_RESULTS,
+    GatewayError,
+    GatewayUnavailable,
+    get_async_gateway,
+)
 from .models import Payment
+from .pagination import PaymentHistoryPagination
 from .serializers import PaymentSerializer
+from .utils import (
+    VERIFY_POLL_INTERVAL,
+    VERIFY_WAIT_TIMEOUT,
+    schedule_payment_expiry,
+)
 
 load_dotenv()
 
 logger = getLogger()
 
 
-class PaymentRequestAPIView(APIView):
-    payment_url = os.getenv("ZIBAL_PAYMENT_URL")
+class PaymentRequestAPIView(AsyncAPIView):
+    """
+    Request a gateway payment for the pending order, in three phases
+        - reserve: short transaction creating an initiating payment
+        - gateway call, outside any transaction
+        - record: short transaction storing the track id
+    Async: the gateway round-trip does not hold a worker under ASGI
+    Payments left initiating by a crash are expired by a periodic sweep
+    """
+
     request_payment = os.getenv("ZIBAL_REQUEST_PAYMENT")
 
     @swagger_auto_schema(
         operation_summary="Request payment on pending orders",
         operation_description="Return payment url and track id based on pending order",
         request_body=None,
+        manual_parameters=[
+            openapi.Parameter(
+                "Idempotency-Key",
+                openapi.IN_HEADER,
+                type=openapi.TYPE_STRING,
+                required=False,
+                description="Retries with the same key replay the first response",
+            ),
+        ],
         responses={
             200: openapi.Response(
                 description="Payment request successfully created",
@@ -36,28 +70,28 @@ class PaymentRequestAPIView(APIView):
                 description="No pending order or payment gateway error",
             ),
             401: openapi.Response(description="Unauthorized"),
+            409: openapi.Response(
+                description="Payment initiation already in progress",
+            ),
             502: openapi.Response(
                 description="Payment gateway connection error",
             ),
+            503: openapi.Response(
+                description="Payment gateway circuit open, retry later",
+            ),
         },
         tags=["Payment"],
     )
-    @transaction.atomic
-    def post(self, request, *args, **kwargs):
+    @idempotent("payment-request")
+    async def post(self, request, *args, **kwargs):
         """
         Return payment on pending order
+        No transaction is held open across the gateway round-trip
         """
 
-        pending_order = (
-            Order.objects.filter(
-                user=request.user,
-                status=Order.Status.PENDING,
-            )
-            .prefetch_related("order_items")
-            .first()
-        )
+        order, payment, reserved = await sync_to_async(self.reserve)(request.user)
 
-        if not pending_order:
+        if not order:
             return Response(
                 {
                     "detail": "Pending order not found",
@@ -65,33 +99,35 @@ class PaymentRequestAPIView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        existing_payment = Payment.objects.filter(
-            order=pending_order,
-            status=Payment.Status.PENDING,
-        ).first()
-
-        if existing_payment:
+        if not reserved:
+            if payment.status == Payment.Status.INITIATING:
+                return Response(
+                    {
+                        "detail": "Payment initiation in progress, retry shortly",
+                    },
+                    status=status.HTTP_409_CONFLICT,
+                )
             return Response(
                 {
-                    "track_id": existing_payment.track_id,
-                    "payment_url": self.request_payment
-                    + f"/{existing_payment.track_id}",
+                    "track_id": payment.track_id,
+                    "payment_url": self.request_payment + f"/{payment.track_id}",
                     "message": "Already initiated payment",
                 },
                 status=status.HTTP_200_OK,
             )
 
         try:
-            response = requests.post(
-                url=self.payment_url,
-                json={
-                    "merchant": os.getenv("ZIBAL_MERCHANT", "zibal"),
-                    "amount": int(pending_order.total_amount),
-                    "callbackUrl": os.getenv("DOMAIN") + os.getenv("PAYMENT_CALLBACK"),
+            response = await get_async_gateway().request_payment(payment.amount)
+        except GatewayUnavailable as e:
+            await payment.adelete()
+            return Response(
+                {
+                    "detail": str(e),
                 },
-                timeout=5,
-            ).json()
-        except requests.RequestException as e:
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        except GatewayError as e:
+            await payment.adelete()
             return Response(
                 {
                     "detail": f"Payment gateway error: {str(e)}",
@@ -99,56 +135,108 @@ class PaymentRequestAPIView(APIView):
                 status=status.HTTP_502_BAD_GATEWAY,
             )
 
-        # Success response
-        if response["result"] == 100:
-            try:
-                Payment.objects.create(
-                    order=pending_order,
-                    user=request.user,
-                    track_id=response["trackId"],
-                    amount=pending_order.total_amount,
-                    raw_response=response,
-                )
-            except Exception as e:
-                logger.error(
-                    f"Failed to persist payment info {response['trackId']}: {str(e)}"
-                )
-                return Response(
-                    {
-                        "detail": "Internal error happened while creating payment credentials",
-                        "track_id": response["trackId"],
-                    },
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                )
-
+        # Failure response
+        if response["result"] != 100:
+            await payment.adelete()
             return Response(
                 {
-                    "trackId": response["trackId"],
+                    "detail": "Payment gateway error",
                     "result": response["result"],
                     "message": response["message"],
-                    "payment_url": f"{self.request_payment}/{response['trackId']}",
                 },
-                status=status.HTTP_200_OK,
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Success response
+        try:
+            recorded = await sync_to_async(self.record)(payment, response)
+        except Exception as e:
+            logger.error(
+                f"Failed to persist payment info {response['trackId']}: {str(e)}"
             )
-        # Failure response
-        else:
             return Response(
                 {
-                    "detail": "Payment gateway error",
-                    "result": response["result"],
-                    "message": response["message"],
+                    "detail": "Internal error happened while creating payment credentials",
+                    "track_id": response["trackId"],
                 },
-                status=status.HTTP_400_BAD_REQUEST,
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+        if not recorded:
+            return Response(
+                {
+                    "detail": "Payment initiation expired, request a new payment",
+                },
+                status=status.HTTP_409_CONFLICT,
             )
 
+        return Response(
+            {
+                "trackId": response["trackId"],
+                "result": response["result"],
+                "message": response["message"],
+                "payment_url": f"{self.request_payment}/{response['trackId']}",
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    @transaction.atomic
+    def reserve(self, user):
+        """
+        Phase 1: reserve an initiating payment on the locked pending order
+        Return (order, payment, reserved), payment being the existing one
+        when the order already has an initiating or pending payment
+        """
+        order = (
+            Order.objects.select_for_update()
+            .filter(user=user, status=Order.Status.PENDING)
+            .first()
+        )
+        if not order:
+            return None, None, False
+
+        existing = order.order_payments.filter(
+            status__in=[Payment.Status.INITIATING, Payment.Status.PENDING]
+        ).first()
+        if existing:
+            return order, existing, False
+
+        payment = Payment.objects.create(
+            order=order,
+            user=user,
+            amount=order.total_amount,
+            status=Payment.Status.INITIATING,
+        )
+        return order, payment, True
+
+    @transaction.atomic
+    def record(self, payment, response):
+        """
+        Phase 3: store the track id, the payment becomes pending
+        False when the sweeper expired the reservation meanwhile
+        """
+        recorded = Payment.objects.filter(
+            pk=payment.pk, status=Payment.Status.INITIATING
+        ).update(
+            track_id=response["trackId"],
+            status=Payment.Status.PENDING,
+            raw_response=response,
+            updated_at=timezone.now(),
+        )
+        if recorded:
+            schedule_payment_expiry(payment)
+        return bool(recorded)
+
 
-class PaymentVerifyAPIView(APIView):
+class PaymentVerifyAPIView(AsyncAPIView):
     """
     Verify the payment and update both payment and order status
+        - The first callback claims the payment (pending -> verifying) and is
+          the only one calling the gateway
+        - Duplicate callbacks (refreshes, gateway retries) wait for its outcome
+        - A gateway error hands the payment back to pending for a later retry
     """
 
     permission_classes = [permissions.AllowAny]
-    verify_url = os.getenv("ZIBAL_VERIFY_PAYMENT")
 
     @swagger_auto_schema(
         operation_summary="Verify payment callback",
@@ -167,15 +255,22 @@ class PaymentVerifyAPIView(APIView):
                 description="Payment verification success",
             ),
             400: openapi.Response(
-                description="Payment failed or invalid trackId",
+                description="Payment failed or expired, or invalid trackId",
+            ),
+            409: openapi.Response(
+                description="Verification still in progress or not completed yet, "
+                "or paid after the order expired and due for refund",
             ),
             502: openapi.Response(
                 description="Payment gateway connection error",
             ),
+            503: openapi.Response(
+                description="Payment gateway circuit open, retry later",
+            ),
         },
         tags=["Payment"],
     )
-    def get(self, request, *args, **kwargs):
+    async def get(self, request, *args, **kwargs):
         track_id = request.GET.get("trackId")
         if not track_id:
             return Response(
@@ -185,31 +280,30 @@ class PaymentVerifyAPIView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        try:
-            payment = Payment.objects.get(
-                track_id=track_id,
-                status=Payment.Status.PENDING,
-            )
-        except Payment.DoesNotExist:
-            return Response(
-                {
-                    "detail": "No payment record found",
-                },
-                status=status.HTTP_404_NOT_FOUND,
-            )
+        claimed = await Payment.objects.filter(
+            track_id=track_id,
+            status=Payment.Status.PENDING,
+        ).aupdate(status=Payment.Status.VERIFYING, updated_at=timezone.now())
+        if not claimed:
+            return await self.verification_outcome(track_id)
+
+        payment = await Payment.objects.select_related("order").aget(track_id=track_id)
 
         # Verify payment
         try:
-            response = requests.post(
-                self.verify_url,
-                json={
-                    "merchant": os.getenv("ZIBAL_MERCHANT", "zibal"),
-                    "trackId": payment.track_id,
-                },
-                timeout=5,
-            )
-            data = response.json()
-        except (requests.RequestException, ValueError) as e:
+            data = await get_async_gateway().verify(payment.track_id)
+        except GatewayError as e:
+            await Payment.objects.filter(
+                pk=payment.pk,
+                status=Payment.Status.VERIFYING,
+            ).aupdate(status=Payment.Status.PENDING, updated_at=timezone.now())
+            if isinstance(e, GatewayUnavailable):
+                return Response(
+                    {
+                        "detail": str(e),
+                    },
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                )
             return Response(
                 {
                     "detail": f"Gateway error: {str(e)}",
@@ -217,50 +311,104 @@ class PaymentVerifyAPIView(APIView):
                 status=status.HTTP_502_BAD_GATEWAY,
             )
 
-        with transaction.atomic():
-            try:
-                payment = Payment.objects.select_for_update().get(track_id=track_id)
-            except Payment.DoesNotExist:
+        # Success verification response
+        if data["result"] in VERIFIED_RESULTS:
+            await sync_to_async(payment.mark_success)(data)
+        # Verification failed
+        else:
+            await sync_to_async(payment.mark_failure)(data)
+        return await self.verification_outcome(track_id)
+
+    async def verification_outcome(self, track_id):
+        """
+        Response for the payment's settled status, waiting while another
+        callback verifies it
+        """
+        deadline = time.monotonic() + VERIFY_WAIT_TIMEOUT
+        while True:
+            payment_status = (
+                await Payment.objects.filter(track_id=track_id)
+                .values_list("status", flat=True)
+                .afirst()
+            )
+            if payment_status == Payment.Status.SUCCESS:
                 return Response(
                     {
-                        "detail": "Payment record not found",
+                        "detail": "Payment was successful",
+                        "track_id": track_id,
                     },
-                    status=status.HTTP_404_NOT_FOUND,
+                    status=status.HTTP_200_OK,
                 )
-
-            # Success verification response
-            if data["result"] in [100, 201]:
-                payment.mark_success(data)
+            if payment_status == Payment.Status.REFUND_DUE:
                 return Response(
                     {
-                        "detail": "Payment was successful",
+                        "detail": "Order no longer available, the payment will be refunded",
                         "track_id": track_id,
                     },
-                    status=status.HTTP_200_OK,
+                    status=status.HTTP_409_CONFLICT,
                 )
-
-            # Verification failed
-            else:
-                payment.mark_failure(data)
+            if payment_status == Payment.Status.FAILED:
                 return Response(
                     {
                         "detail": "Verification failed",
                     },
                     status=status.HTTP_400_BAD_REQUEST,
                 )
+            if payment_status == Payment.Status.EXPIRED:
+                return Response(
+                    {
+                        "detail": "Payment expired",
+                    },
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            if payment_status is None:
+                return Response(
+                    {
+                        "detail": "No payment record found",
+                    },
+                    status=status.HTTP_404_NOT_FOUND,
+                )
+            # Handed back after a gateway error, or not sent to the gateway yet
+            if payment_status != Payment.Status.VERIFYING:
+                return Response(
+                    {
+                        "detail": "Payment not verified yet, retry later",
+                        "track_id": track_id,
+                    },
+                    status=status.HTTP_409_CONFLICT,
+                )
+            if time.monotonic() >= deadline:
+                return Response(
+                    {
+                        "detail": "Payment verification in progress",
+                    },
+                    status=status.HTTP_409_CONFLICT,
+                )
+            await asyncio.sleep(VERIFY_POLL_INTERVAL)
 
 
 class PaymentHistoryAPIView(generics.ListAPIView):
-    """User payment history"""
+    """
+    User payment history, cursor paginated
+    Each payment carries an order summary from the same query, order items
+    are fetched on demand through the summary's items_url
+    """
 
     serializer_class = PaymentSerializer
+    pagination_class = PaymentHistoryPagination
 
     def get_queryset(self):
-        return Payment.objects.filter(user=self.request.user).select_related("order")
+        """Payments joined to their order, items counted in SQL"""
+        return Payment.objects.filter(user=self.request.user).annotate(
+            order_status=F("order__status"),
+            order_total=F("order__total_amount"),
+            order_item_count=Count("order__order_items"),
+        )
 
     @swagger_auto_schema(
         operation_summary="List user payment history",
-        operation_description="Returns list of payments associated with authenticated user",
+        operation_description="Returns a page of payments associated with authenticated "
+        "user, each with a summary of its order",
         responses={
             200: PaymentSerializer(many=True),
             401: openapi.Response(description="Unauthorized"),
@@ -72,6 +72,8 @@ class ProductAdmin(admin.ModelAdmin):
         "short_description",
         "visit_count",
         "stock",
+        "reserved",
+        "flash_sale",
     ]
     fields = [
         "title",
@@ -80,9 +82,11 @@ class ProductAdmin(admin.ModelAdmin):
         "price",
         "description",
         "stock",
+        "reserved",
+        "flash_sale",
         "brand",
     ]
-    readonly_fields = ["visit_count", "slug"]
+    readonly_fields = ["visit_count", "slug", "reserved"]
 
     class Media:
         js = ["admin/js/price_format.js"]
@@ -110,6 +114,7 @@ class DiscountAdmin(admin.ModelAdmin):
         "end_date",
         "product",
         "category",
+        "flash_sale",
     ]
 
 
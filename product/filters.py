@@ -1,5 +1,5 @@
 import django_filters
-from django.db.models import Q
+from django.db.models import F, Q
 from django.utils import timezone
 
 from .models import Product
@@ -43,8 +43,8 @@ class ProductFilter(django_filters.FilterSet):
         value,
     ):
         if value:
-            return queryset.filter(stock__gt=0)
-        return queryset.filter(stock=0)
+            return queryset.filter(stock__gt=F("reserved"))
+        return queryset.filter(stock__lte=F("reserved"))
 
     def filter_brand(
         self,
@@ -0,0 +1,136 @@
+import heapq
+import threading
+from collections import defaultdict
+
+from redis.exceptions import RedisError
+
+from core.redis_client import get_redis_client, mark_unavailable
+
+# Score per event and factor applied on each decay run (hourly)
+BOARDS = {
+    "trending": {"view": 1, "purchase": 5, "decay": 0.8},
+}
+MIN_SCORE = 0.01  # members decayed below it are dropped
+WINDOW = 500  # ranks resolved into a product ordering
+
+
+def board_key(board, category_id=None):
+    scope = f"category:{category_id}" if category_id else "all"
+    return f"leaderboard:{board}:{scope}"
+
+
+class RedisLeaderboards:
+    """
+    One sorted set per board and scope (all products / one category)
+    scored by product id
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def add(self, increments):
+        pipe = self.client.pipeline(transaction=False)
+        for key, members in increments.items():
+            for product_id, amount in members.items():
+                pipe.zincrby(key, amount, product_id)
+        pipe.execute()
+
+    def top(self, key, limit):
+        return [int(member) for member in self.client.zrevrange(key, 0, limit - 1)]
+
+    def decay(self, board, factor):
+        for key in self.client.scan_iter(match=f"leaderboard:{board}:*"):
+            pipe = self.client.pipeline()
+            # Scales every score in place
+            pipe.zunionstore(key, {key: factor})
+            pipe.zremrangebyscore(key, "-inf", MIN_SCORE)
+            pipe.execute()
+
+
+class MemoryLeaderboards:
+    """
+    Per-process fallback while Redis is unavailable
+    Scores start over with the process and are not shared between workers
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.boards = defaultdict(lambda: defaultdict(float))
+
+    def add(self, increments):
+        with self.lock:
+            for key, members in increments.items():
+                for product_id, amount in members.items():
+                    self.boards[key][product_id] += amount
+
+    def top(self, key, limit):
+        with self.lock:
+            scores = dict(self.boards.get(key, {}))
+        return heapq.nlargest(limit, scores, key=scores.get)
+
+    def decay(self, board, factor):
+        prefix = f"leaderboard:{board}:"
+        with self.lock:
+            for key in [k for k in self.boards if k.startswith(prefix)]:
+                self.boards[key] = defaultdict(
+                    float,
+                    {
+                        product_id: score * factor
+                        for product_id, score in self.boards[key].items()
+                        if score * factor >= MIN_SCORE
+                    },
+                )
+
+    def clear(self):
+        with self.lock:
+            self.boards.clear()
+
+
+memory_leaderboards = MemoryLeaderboards()
+
+
+def _call(method, *args):
+    client = get_redis_client()
+    if client is not None:
+        try:
+            return getattr(RedisLeaderboards(client), method)(*args)
+        except RedisError as e:
+            mark_unavailable(e)
+    return getattr(memory_leaderboards, method)(*args)
+
+
+def record(event, items):
+    """
+    Add an event ("view" or "purchase") to every board weighting it
+    items: (product_id, category_id, quantity) tuples
+    """
+    increments = defaultdict(lambda: defaultdict(float))
+    for board, weights in BOARDS.items():
+        if not weights[event]:
+            continue
+        for product_id, category_id, quantity in items:
+            amount = weights[event] * quantity
+            increments[board_key(board)][product_id] += amount
+            if category_id:
+                increments[board_key(board, category_id)][product_id] += amount
+    if increments:
+        _call("add", increments)
+
+
+def record_view(product):
+    record("view", [(product.id, product.category_id, 1)])
+
+
+def record_purchase(items):
+    record("purchase", items)
+
+
+def top_products(board, category_id=None, limit=WINDOW):
+    """Product ids of the board, best first"""
+    return _call("top", board_key(board, category_id), limit)
+
+
+def decay():
+    """Scale every board down so older events weigh less than recent ones"""
+    for board, weights in BOARDS.items():
+        _call("decay", board, weights["decay"])
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 12:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0054_alter_category_options_alter_discount_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reserved',
+            field=models.PositiveIntegerField(default=0, help_text='Units held by active stock reservations of pending orders', verbose_name='Reserved'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-19 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0055_product_reserved'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discount',
+            name='flash_sale',
+            field=models.BooleanField(default=False, help_text='Discounted products run in flash sale mode until the end date', verbose_name='Flash sale'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='flash_sale',
+            field=models.BooleanField(default=False, help_text='Admit checkouts against a Redis stock counter', verbose_name='Flash sale'),
+        ),
+    ]
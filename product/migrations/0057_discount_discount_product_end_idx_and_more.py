@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-19 12:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("product", "0056_discount_flash_sale_product_flash_sale"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="discount",
+            index=models.Index(
+                fields=["product", "end_date"], name="discount_product_end_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="discount",
+            index=models.Index(
+                fields=["category", "end_date"], name="discount_category_end_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="feedback",
+            index=models.Index(
+                fields=["product", "-rating"], name="feedback_product_rating_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["category", "-visit_count"], name="product_category_visits_idx"
+            ),
+        ),
+    ]
@@ -1,8 +1,10 @@
+from collections import defaultdict
 from decimal import Decimal
 
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
@@ -125,6 +127,16 @@ class Product(BaseModel):
         verbose_name=_("Stock"),
         default=0,
     )
+    reserved = models.PositiveIntegerField(
+        verbose_name=_("Reserved"),
+        default=0,
+        help_text="Units held by active stock reservations of pending orders",
+    )
+    flash_sale = models.BooleanField(
+        verbose_name=_("Flash sale"),
+        default=False,
+        help_text="Admit checkouts against a Redis stock counter",
+    )
     visit_count = models.PositiveIntegerField(
         _("Visit counts"),
         default=0,
@@ -162,11 +174,21 @@ class Product(BaseModel):
                 name="unique_title",
             )
         ]
+        indexes = [
+            # Category listings sorted by popularity
+            models.Index(
+                fields=["category", "-visit_count"], name="product_category_visits_idx"
+            ),
+        ]
 
     def get_discount(self):
         """
         Find max discount for products and  categories
+        Reuses discounts attached by Product.attach_discounts when present
         """
+        if hasattr(self, "active_discounts"):
+            return max([d.percent for d in self.active_discounts], default=0)
+
         discounts = list(self.product_discounts.filter(end_date__gte=timezone.now()))
         if self.category:
             discounts += list(
@@ -174,6 +196,63 @@ class Product(BaseModel):
             )
         return max([d.percent for d in discounts], default=0)
 
+    @classmethod
+    def attach_discounts(cls, products):
+        """
+        Resolve active product & category discounts of many products in one query
+            - active_product_discounts: discounts set on the product itself
+            - active_discounts: product and category discounts used by get_discount
+        """
+        products = list(products)
+        if not products:
+            return products
+
+        discounts = Discount.objects.filter(end_date__gte=timezone.now()).filter(
+            Q(product__in=[p.id for p in products])
+            | Q(category__in={p.category_id for p in products})
+        )
+        by_product, by_category = defaultdict(list), defaultdict(list)
+        for discount in discounts:
+            if discount.product_id:
+                by_product[discount.product_id].append(discount)
+            if discount.category_id:
+                by_category[discount.category_id].append(discount)
+
+        for product in products:
+            product.active_product_discounts = by_product[product.id]
+            product.active_discounts = (
+                by_product[product.id] + by_category[product.category_id]
+            )
+        return products
+
+    @classmethod
+    def flash_sale_ids(cls, product_ids):
+        """
+        Ids of the given products in flash sale mode, by flag or active flash discount
+        """
+        now = timezone.now()
+        return set(
+            cls.objects.filter(id__in=product_ids)
+            .filter(
+                Q(flash_sale=True)
+                | Q(
+                    product_discounts__flash_sale=True,
+                    product_discounts__end_date__gte=now,
+                )
+                | Q(
+                    category__category_discounts__flash_sale=True,
+                    category__category_discounts__end_date__gte=now,
+                )
+            )
+            .values_list("id", flat=True)
+            .distinct()
+        )
+
+    @property
+    def available(self):
+        """Physical stock minus active reservations"""
+        return max(self.stock - self.reserved, 0)
+
     @property
     def discounted_price(self):
         discount = Decimal(self.get_discount())
@@ -236,10 +315,24 @@ class Discount(BaseModel):
         null=True,
         related_name="category_discounts",
     )
+    flash_sale = models.BooleanField(
+        verbose_name=_("Flash sale"),
+        default=False,
+        help_text="Discounted products run in flash sale mode until the end date",
+    )
 
     class Meta:
         verbose_name = _("Discount")
         verbose_name_plural = _("Discounts")
+        indexes = [
+            # Active discount lookups (end_date >= now) per product / category
+            models.Index(
+                fields=["product", "end_date"], name="discount_product_end_idx"
+            ),
+            models.Index(
+                fields=["category", "end_date"], name="discount_category_end_idx"
+            ),
+        ]
 
     def clean(self):
         super().clean()
@@ -41,6 +41,11 @@ class Feedback(BaseModel):
                 fields=["user", "product"], name="unique_user_product"
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=["product", "-rating"], name="feedback_product_rating_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user.email}- {self.description[:10]}"
@@ -1,14 +1,65 @@
+from django.db.models import Case, IntegerField, Value, When
 from rest_framework.filters import OrderingFilter
 
+from . import leaderboards
+from .models import Category
+
 
 class CustomOrderingFilter(OrderingFilter):
-    """Custom ordering renamed for convenience"""
+    """
+    Custom ordering renamed for convenience
+    Leaderboard aliases rank products by their leaderboard position, "-" for
+    best first like any descending field, falling back to the column alias
+    while the leaderboard is empty
+    best_selling is a plain column alias: units sold from the sales rollups
+    """
 
     alias_map = {
         "latest": "created_at",
         "most_visited": "visit_count",
+        "best_selling": "units_sold",
+        "trending": "visit_count",
+    }
+    leaderboard_map = {
+        "trending": "trending",
     }
 
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params.get(self.ordering_param, "")
+        fields = [param.strip() for param in params.split(",") if param.strip()]
+        if fields and fields[0].lstrip("-") in self.leaderboard_map:
+            ranked = self.rank_by_leaderboard(
+                request,
+                queryset,
+                self.leaderboard_map[fields[0].lstrip("-")],
+                descending=fields[0].startswith("-"),
+                then=self.remove_invalid_fields(queryset, fields[1:], view, request),
+            )
+            if ranked is not None:
+                return ranked
+        return super().filter_queryset(request, queryset, view)
+
+    def rank_by_leaderboard(self, request, queryset, board, descending, then):
+        """
+        Order by the top leaderboard ids, products outside it ranked last
+        (first when ascending), ties broken by the remaining ordering fields
+        """
+        category_id = None
+        if slug := request.query_params.get("category"):
+            category_id = (
+                Category.objects.filter(slug=slug).values_list("id", flat=True).first()
+            )
+        ids = leaderboards.top_products(board, category_id)
+        if not ids:
+            return None
+        rank = Case(
+            *[When(pk=product_id, then=Value(i)) for i, product_id in enumerate(ids)],
+            default=Value(len(ids)),
+            output_field=IntegerField(),
+        )
+        rank = rank.asc() if descending else rank.desc()
+        return queryset.order_by(rank, *then, "-visit_count", "-created_at")
+
     def remove_invalid_fields(
         self,
         queryset,
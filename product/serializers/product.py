@@ -72,7 +72,7 @@ class ProductSerializer(BaseSerializer):
 
     def get_in_stock(self, obj):
         """Boolean value of stock"""
-        return obj.stock > 0
+        return obj.available > 0
 
     def get_has_discount(self, obj):
         "bool value for product discounts"
@@ -209,7 +209,7 @@ class ProductDetailSerializer(BaseSerializer):
 
     def get_in_stock(self, obj):
         """Boolean stock value"""
-        return obj.stock > 0
+        return obj.available > 0
 
     def get_images(self, obj):
         """
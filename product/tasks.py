@@ -0,0 +1,8 @@
+from celery import shared_task
+
+from . import leaderboards
+
+
+@shared_task
+def decay_leaderboards_task():
+    leaderboards.decay()
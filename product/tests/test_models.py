@@ -4,10 +4,12 @@ import pytest
 from django.db import IntegrityError, transaction
 from django.utils.text import slugify
 
+from product import leaderboards
 from product.models import (
     FeatureValue,
     Feedback,
     Like,
+    Product,
 )
 
 
@@ -160,3 +162,43 @@ def test_feedback(
             product=product,
             rating=random.randint(1, 5),
         )
+
+
+def test_leaderboards_scopes_and_decay(memory_leaderboards):
+    leaderboards.record_purchase([(1, 10, 2), (2, 20, 1)])
+    leaderboards.record_view(Product(id=3, category_id=10))
+
+    assert leaderboards.top_products("trending") == [1, 2, 3]
+    assert leaderboards.top_products("trending", category_id=20) == [2]
+    assert leaderboards.top_products("trending", category_id=10) == [1, 3]
+
+    for _ in range(25):
+        leaderboards.decay()
+
+    # Single views fade out of trending, purchases weigh more
+    assert leaderboards.top_products("trending") == [1, 2]
+
+
+def test_redis_leaderboards(redis_leaderboards, memory_leaderboards):
+    leaderboards.record_purchase([(1, 10, 2), (2, 20, 1)])
+    leaderboards.record_view(Product(id=3, category_id=10))
+    leaderboards.record_view(Product(id=3, category_id=10))
+
+    key = leaderboards.board_key("trending")
+    assert redis_leaderboards.zrevrange(key, 0, -1, withscores=True) == [
+        (b"1", 10.0),
+        (b"2", 5.0),
+        (b"3", 2.0),
+    ]
+    assert leaderboards.top_products("trending", category_id=10, limit=1) == [1]
+    assert not memory_leaderboards.boards
+
+    leaderboards.decay()
+    assert redis_leaderboards.zscore(key, 1) == pytest.approx(8.0)
+    assert redis_leaderboards.zscore(key, 3) == pytest.approx(1.6)
+
+    # Views decayed below MIN_SCORE are pruned, in every scope
+    for _ in range(25):
+        leaderboards.decay()
+    assert leaderboards.top_products("trending") == [1, 2]
+    assert leaderboards.top_products("trending", category_id=10) == [1]
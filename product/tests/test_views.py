@@ -1,10 +1,14 @@
 import random
+from datetime import timedelta
 
 import pytest
 from django.urls import reverse
+from django.utils import timezone
 from faker import Faker
+from rest_framework.test import APIClient
 
-from product.models import Feedback, Like
+from product.models import Discount, Feedback, Like
+from reports.models import ProductDailySales
 
 faker = Faker()
 
@@ -146,6 +150,62 @@ def test_product_ordering(
         assert values == sorted(values)
 
 
+def test_best_selling_ordering(auth_client, sample_products):
+    best, runner_up = sample_products["products"][3], sample_products["products"][7]
+    for product, units in [(best, 3), (runner_up, 1)]:
+        ProductDailySales.objects.create(
+            day=timezone.localdate(), product=product, units=units
+        )
+    client, _ = auth_client
+
+    response = client.get(
+        reverse("product-list"), {"ordering": "-best_selling", "page_size": 2}
+    )
+
+    assert response.status_code == 200
+    assert [p["id"] for p in response.json()["results"]] == [best.id, runner_up.id]
+
+    response = client.get(
+        reverse("product-list"), {"ordering": "best_selling", "page_size": 15}
+    )
+    assert [p["id"] for p in response.json()["results"]][-2:] == [
+        runner_up.id,
+        best.id,
+    ]
+
+
+@pytest.mark.parametrize("redis", [False, True])
+def test_trending_ordering(
+    request, auth_client, sample_products, django_capture_on_commit_callbacks, redis
+):
+    if redis:
+        request.getfixturevalue("redis_leaderboards")
+    first, second = sample_products["products"][2], sample_products["products"][1]
+    client, _ = auth_client
+    for product, visits in [(first, 2), (second, 1)]:
+        for _ in range(visits):
+            with django_capture_on_commit_callbacks(execute=True):
+                client.get(reverse("product-detail", kwargs={"slug": product.slug}))
+
+    def ranked(ordering):
+        response = client.get(
+            reverse("product-list"),
+            {"ordering": ordering, "category": first.category.slug, "page_size": 5},
+        )
+        assert response.status_code == 200
+        return [p["id"] for p in response.json()["results"]]
+
+    best_first = ranked("-trending")
+    assert best_first[:2] == [first.id, second.id]
+    assert len(best_first) == 5
+    assert ranked("trending")[-2:] == [second.id, first.id]
+    # Products outside the leaderboard keep the secondary ordering
+    by_price = ranked("-trending,price")
+    prices = {p.id: p.price for p in sample_products["products"]}
+    assert by_price[:2] == [first.id, second.id]
+    assert [prices[i] for i in by_price[2:]] == sorted(prices[i] for i in by_price[2:])
+
+
 def test_search_products(
     auth_client,
     sample_products,
@@ -330,3 +390,23 @@ def test_toggle_likes(
             user=user,
             product=product,
         ).exists()
+
+
+def test_listings_use_index(assert_uses_index, sample_products):
+    """Discount lookups of the product list, feedbacks and category top products"""
+    product = sample_products["products"][0]
+    Discount.objects.create(
+        name="Sale",
+        percent=10,
+        end_date=timezone.now() + timedelta(days=1),
+        product=product,
+    )
+    client = APIClient()
+
+    with assert_uses_index("product_discount"):
+        assert client.get(reverse("product-list")).status_code == 200
+    with assert_uses_index("product_feedback"):
+        url = reverse("list-create-feedback", kwargs={"product_id": product.pk})
+        assert client.get(url).status_code == 200
+    with assert_uses_index("product_product"):
+        assert client.get(reverse("category-list")).status_code == 200
@@ -1,11 +1,14 @@
 from django.db import IntegrityError, transaction
-from django.db.models import Avg, F, Q
+from django.db.models import Avg, F, OuterRef, Q
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 
+from reports.rollups import units_sold
+
+from .. import leaderboards
 from ..filters import ProductFilter
 from ..models import Category, Product
 from ..ordering import CustomOrderingFilter
@@ -37,6 +40,7 @@ class ProductListAPIView(generics.ListAPIView):
         "price",
         "visit_count",
         "created_at",
+        "units_sold",
     ]
     ordering = ["-visit_count"]
 
@@ -62,6 +66,11 @@ class ProductListAPIView(generics.ListAPIView):
         if category_slug:
             qs = qs.filter(category__slug=category_slug)
 
+        # Best sellers read the daily sales rollup, not the order history
+        ordering = self.request.query_params.get("ordering", "")
+        if "best_selling" in ordering or "units_sold" in ordering:
+            qs = qs.annotate(units_sold=units_sold(OuterRef("pk")))
+
         return qs
 
     @swagger_auto_schema(
@@ -100,7 +109,7 @@ class ProductListAPIView(generics.ListAPIView):
                 name="ordering",
                 in_=openapi.IN_QUERY,
                 type=openapi.TYPE_STRING,
-                description="Sorted by price | visit_count | created_at",
+                description="Sorted by price | visit_count | created_at | best_selling | trending",
                 required=False,
                 example="-created_at",
             ),
@@ -207,6 +216,7 @@ class ProductDetailAPIView(generics.RetrieveAPIView):
             instance.visit_count = F("visit_count") + 1
             instance.save(update_fields=["visit_count"])
             instance.refresh_from_db()
+            transaction.on_commit(lambda: leaderboards.record_view(instance))
 
             serializer = self.get_serializer(instance)
             return Response(serializer.data, status=status.HTTP_200_OK)
@@ -0,0 +1,37 @@
+from django.contrib import admin
+
+from .models import BrandDailySales, CategoryDailySales, ProductDailySales
+
+
+class DailySalesAdmin(admin.ModelAdmin):
+    """Read only, rows are maintained by payments & the backfill command"""
+
+    date_hierarchy = "day"
+    list_filter = ["day"]
+    ordering = ["-day", "-revenue"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ProductDailySales)
+class ProductDailySalesAdmin(DailySalesAdmin):
+    list_display = ["day", "product", "units", "revenue", "discount"]
+    list_select_related = ["product"]
+    search_fields = ["product__title"]
+
+
+@admin.register(CategoryDailySales)
+class CategoryDailySalesAdmin(DailySalesAdmin):
+    list_display = ["day", "category", "units", "revenue", "discount"]
+    list_select_related = ["category"]
+    search_fields = ["category__title"]
+
+
+@admin.register(BrandDailySales)
+class BrandDailySalesAdmin(DailySalesAdmin):
+    list_display = ["day", "brand", "units", "revenue", "discount"]
+    search_fields = ["brand"]
@@ -0,0 +1,80 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import OuterRef
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from orders.models import Order
+
+from ...rollups import ROLLUPS, record_sales, sold_at
+
+
+def lock_rollups():
+    """
+    Hold concurrent record_sales until the rebuild commits, readers keep the
+    previous rollups meanwhile
+    SQLite needs no lock: the delete already takes the single writer lock
+    """
+    if connection.vendor != "postgresql":
+        return
+    tables = ", ".join(model._meta.db_table for model, _, _ in ROLLUPS)
+    with connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {tables} IN SHARE ROW EXCLUSIVE MODE")
+
+
+class Command(BaseCommand):
+    help = "Rebuild daily sales rollups from paid orders, in chunks of orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since",
+            type=date.fromisoformat,
+            help="First day to rebuild (YYYY-MM-DD), all history by default",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Orders aggregated per statement",
+        )
+
+    @transaction.atomic
+    def handle(self, *args, since=None, chunk_size=1000, **kwargs):
+        # Delete & rebuild in one transaction, orders paid from the lock on
+        # are added by Payment.mark_success once it is released
+        lock_rollups()
+        started = timezone.now()
+        orders = Order.objects.filter(status=Order.Status.PAID).annotate(
+            sold_at=sold_at(OuterRef("pk"))
+        )
+        orders = orders.filter(sold_at__lt=started)
+        if since:
+            orders = orders.annotate(paid_day=TruncDate("sold_at")).filter(
+                paid_day__gte=since
+            )
+
+        for model, _, _ in ROLLUPS:
+            rollups = model.objects.all()
+            if since:
+                rollups = rollups.filter(day__gte=since)
+            rollups.delete()
+
+        last_id, total = 0, 0
+        while True:
+            order_ids = list(
+                orders.filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:chunk_size]
+            )
+            if not order_ids:
+                break
+            record_sales(order_ids)
+            last_id = order_ids[-1]
+            total += len(order_ids)
+            self.stdout.write(f"{total} orders rolled up")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Sales rollups rebuilt from {total} orders")
+        )
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.4 on 2026-10-19 13:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('product', '0057_discount_discount_product_end_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BrandDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True, verbose_name='Created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True, verbose_name='Updated at')),
+                ('day', models.DateField(verbose_name='Day')),
+                ('units', models.PositiveIntegerField(default=0, verbose_name='Units sold')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Revenue')),
+                ('discount', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Discount given')),
+                ('brand', models.CharField(max_length=100, verbose_name='Brand')),
+            ],
+            options={
+                'verbose_name': 'Brand daily sales',
+                'verbose_name_plural': 'Brand daily sales',
+                'ordering': ['-day', '-revenue'],
+                'abstract': False,
+                'constraints': [models.UniqueConstraint(fields=('day', 'brand'), name='unique_brand_daily_sales')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CategoryDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True, verbose_name='Created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True, verbose_name='Updated at')),
+                ('day', models.DateField(verbose_name='Day')),
+                ('units', models.PositiveIntegerField(default=0, verbose_name='Units sold')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Revenue')),
+                ('discount', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Discount given')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='product.category', verbose_name='Category')),
+            ],
+            options={
+                'verbose_name': 'Category daily sales',
+                'verbose_name_plural': 'Category daily sales',
+                'ordering': ['-day', '-revenue'],
+                'abstract': False,
+                'constraints': [models.UniqueConstraint(fields=('day', 'category'), name='unique_category_daily_sales')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True, verbose_name='Created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True, verbose_name='Updated at')),
+                ('day', models.DateField(verbose_name='Day')),
+                ('units', models.PositiveIntegerField(default=0, verbose_name='Units sold')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Revenue')),
+                ('discount', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Discount given')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='product.product', verbose_name='Product')),
+            ],
+            options={
+                'verbose_name': 'Product daily sales',
+                'verbose_name_plural': 'Product daily sales',
+                'ordering': ['-day', '-revenue'],
+                'abstract': False,
+                'indexes': [models.Index(fields=['product', 'day'], name='product_sales_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'product'), name='unique_product_daily_sales')],
+            },
+        ),
+    ]
@@ -0,0 +1,100 @@
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+from product.models import Category, Product
+from users.models import BaseModel
+
+
+class DailySales(BaseModel):
+    """
+    Sales of one day, incremented when orders are paid
+    """
+
+    day = models.DateField(
+        verbose_name=_("Day"),
+    )
+    units = models.PositiveIntegerField(
+        verbose_name=_("Units sold"),
+        default=0,
+    )
+    revenue = models.DecimalField(
+        verbose_name=_("Revenue"),
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+    )
+    discount = models.DecimalField(
+        verbose_name=_("Discount given"),
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+    )
+
+    class Meta:
+        abstract = True
+        ordering = ["-day", "-revenue"]
+
+
+class ProductDailySales(DailySales):
+    product = models.ForeignKey(
+        Product,
+        verbose_name=_("Product"),
+        on_delete=models.CASCADE,
+        related_name="daily_sales",
+    )
+
+    class Meta(DailySales.Meta):
+        verbose_name = _("Product daily sales")
+        verbose_name_plural = _("Product daily sales")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "product"], name="unique_product_daily_sales"
+            ),
+        ]
+        indexes = [
+            # Best seller sums over recent days
+            models.Index(fields=["product", "day"], name="product_sales_day_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product} on {self.day}: {self.units}"
+
+
+class CategoryDailySales(DailySales):
+    category = models.ForeignKey(
+        Category,
+        verbose_name=_("Category"),
+        on_delete=models.CASCADE,
+        related_name="daily_sales",
+    )
+
+    class Meta(DailySales.Meta):
+        verbose_name = _("Category daily sales")
+        verbose_name_plural = _("Category daily sales")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "category"], name="unique_category_daily_sales"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.category} on {self.day}: {self.units}"
+
+
+class BrandDailySales(DailySales):
+    brand = models.CharField(
+        verbose_name=_("Brand"),
+        max_length=100,
+    )
+
+    class Meta(DailySales.Meta):
+        verbose_name = _("Brand daily sales")
+        verbose_name_plural = _("Brand daily sales")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "brand"], name="unique_brand_daily_sales"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.brand} on {self.day}: {self.units}"
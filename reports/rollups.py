@@ -0,0 +1,105 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, TruncDate
+from django.utils import timezone
+
+from orders.models import OrderItem
+from payments.models import Payment
+
+from .models import BrandDailySales, CategoryDailySales, ProductDailySales
+
+# (rollup model, rollup key column, OrderItem lookup of the key)
+ROLLUPS = [
+    (ProductDailySales, "product_id", "product_id"),
+    (CategoryDailySales, "category_id", "product__category_id"),
+    (BrandDailySales, "brand", "product__brand"),
+]
+
+# Concurrent payments of the same day add up instead of overwriting each other
+UPSERT_SQL = """
+INSERT INTO {table} (day, {key}, units, revenue, discount, created_at, updated_at)
+VALUES {rows}
+ON CONFLICT (day, {key}) DO UPDATE SET
+    units = {table}.units + excluded.units,
+    revenue = {table}.revenue + excluded.revenue,
+    discount = {table}.discount + excluded.discount,
+    updated_at = excluded.updated_at
+"""
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+BEST_SELLER_DAYS = 30
+
+
+def sold_at(order_ref, paid_at="paid_at"):
+    """
+    When the referenced order was paid
+    Orders paid before Order.paid_at was recorded fall back to their first
+    successful payment
+    """
+    first_payment = (
+        Payment.objects.filter(order=order_ref, status=Payment.Status.SUCCESS)
+        .order_by("paid_at")
+        .values("paid_at")[:1]
+    )
+    return Coalesce(paid_at, Subquery(first_payment))
+
+
+def units_sold(product_ref, days=BEST_SELLER_DAYS):
+    """Units of the referenced product sold over the last `days`, from the rollup"""
+    since = timezone.localdate() - timedelta(days=days)
+    units = (
+        ProductDailySales.objects.filter(product=product_ref, day__gte=since)
+        .values("product")
+        .annotate(total=Sum("units"))
+        .values("total")
+    )
+    return Coalesce(Subquery(units), 0)
+
+
+def aggregate_sales(order_ids, key):
+    """Units, revenue & discount of the orders grouped by paid day and `key`"""
+    list_price = Coalesce("list_price", "product__price", "price_at_purchase")
+    return (
+        OrderItem.objects.filter(order_id__in=order_ids)
+        .annotate(day=TruncDate(sold_at(OuterRef("order_id"), "order__paid_at")))
+        .exclude(day=None)
+        .exclude(**{f"{key}__isnull": True})
+        .values("day", key)
+        .annotate(
+            units=Sum("quantity"),
+            revenue=Sum(F("price_at_purchase") * F("quantity"), output_field=MONEY),
+            discount=Sum(
+                Greatest(list_price - F("price_at_purchase"), Value(Decimal(0)))
+                * F("quantity"),
+                output_field=MONEY,
+            ),
+        )
+        .order_by("day", key)
+    )
+
+
+def record_sales(order_ids):
+    """
+    Add paid orders to the daily product, category and brand rollups
+    Call once per order, when it turns paid
+    """
+    now = timezone.now()
+    for model, column, key in ROLLUPS:
+        rows = [
+            (row["day"], row[key], row["units"], row["revenue"], row["discount"])
+            for row in aggregate_sales(order_ids, key)
+        ]
+        if not rows:
+            continue
+        sql = UPSERT_SQL.format(
+            table=model._meta.db_table,
+            key=column,
+            rows=", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(rows)),
+        )
+        params = [value for row in rows for value in (*row, now, now)]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
@@ -0,0 +1,104 @@
+from decimal import Decimal
+
+import pytest
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.utils import timezone
+
+from orders.models import Order
+from payments.models import Payment
+from product import leaderboards
+from product.models import Product
+from reports.models import BrandDailySales, CategoryDailySales, ProductDailySales
+from reports.rollups import record_sales
+
+
+def pay(order, track_id):
+    payment = Payment.objects.create(
+        order=order, user=order.user, track_id=track_id, amount=order.total_amount
+    )
+    payment.mark_success({})
+    return payment
+
+
+def sold(model, **lookup):
+    row = model.objects.get(day=timezone.localdate(), **lookup)
+    return row.units, row.revenue, row.discount
+
+
+def make_order(order_factory, order_item_factory, product, quantity):
+    order = order_factory()
+    item = order_item_factory(
+        order=order, product=product, quantity=quantity, price=Decimal("80")
+    )
+    item.list_price = Decimal("100")
+    item.save(update_fields=["list_price"])
+    return order
+
+
+def test_paid_orders_roll_up(
+    sample_products,
+    order_factory,
+    order_item_factory,
+    django_capture_on_commit_callbacks,
+):
+    product = sample_products["products"][0]
+    Product.objects.filter(pk=product.pk).update(brand="Samsung")
+    product.refresh_from_db()
+    first = make_order(order_factory, order_item_factory, product, 2)
+    second = make_order(order_factory, order_item_factory, product, 1)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        pay(first, "1001")
+        pay(second, "1002")
+        # A second successful payment must not count the order twice
+        pay(first, "1003")
+
+    expected = (3, Decimal("240"), Decimal("60"))
+    first.refresh_from_db()
+    assert first.status == Order.Status.PAID
+    assert first.paid_at is not None
+    assert sold(ProductDailySales, product=product) == expected
+    assert sold(CategoryDailySales, category=product.category) == expected
+    assert sold(BrandDailySales, brand="Samsung") == expected
+    assert leaderboards.memory_leaderboards.boards[
+        leaderboards.board_key("trending")
+    ] == {product.id: 15}
+
+
+def test_backfill_rebuilds_rollups(sample_products, order_factory, order_item_factory):
+    products = sample_products["products"][:2]
+    for index, product in enumerate(products):
+        pay(make_order(order_factory, order_item_factory, product, 1), f"20{index}")
+    expected = {p.id: sold(ProductDailySales, product=p) for p in products}
+    ProductDailySales.objects.filter(product=products[0]).update(units=99)
+
+    call_command("backfill_sales_rollups", chunk_size=1)
+
+    assert {p.id: sold(ProductDailySales, product=p) for p in products} == expected
+    assert not BrandDailySales.objects.exists()
+
+
+def test_backfill_failure_keeps_rollups(
+    monkeypatch, sample_products, order_factory, order_item_factory
+):
+    """Delete & rebuild commit together, a failed rebuild leaves the rollups as is"""
+    products = sample_products["products"][:2]
+    for index, product in enumerate(products):
+        pay(make_order(order_factory, order_item_factory, product, 1), f"30{index}")
+    expected = {p.id: sold(ProductDailySales, product=p) for p in products}
+    calls = []
+
+    def failing(order_ids):
+        calls.append(order_ids)
+        if len(calls) == 2:
+            raise DatabaseError("connection lost")
+        record_sales(order_ids)
+
+    monkeypatch.setattr(
+        "reports.management.commands.backfill_sales_rollups.record_sales", failing
+    )
+    with pytest.raises(DatabaseError):
+        call_command("backfill_sales_rollups", chunk_size=1)
+
+    assert {p.id: sold(ProductDailySales, product=p) for p in products} == expected
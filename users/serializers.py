@@ -6,6 +6,8 @@ from djoser.serializers import TokenCreateSerializer, UserCreateSerializer
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
+from cart.store import merge_session_cart
+
 logger = logging.getLogger(__name__)
 
 User = get_user_model()
@@ -41,3 +43,13 @@ class CustomTokenSerializer(TokenObtainPairSerializer):
             "Email or password is incorrect",
         )
     }
+
+    def validate(self, attrs):
+        """
+        Issue the token pair and merge the guest session cart into the user cart
+        """
+        data = super().validate(attrs)
+        request = self.context.get("request")
+        if request is not None:
+            merge_session_cart(request.session, self.user)
+        return data